@@ -1,6 +1,55 @@
+import sys
+
 try:
-    from ._ax_queue import Empty, Full, Queue as AXQueue
-except:
+    from ._ax_queue import (
+        BroadcastQueue,
+        CoalescingQueue,
+        DelayQueue as AXDelayQueue,
+        Empty,
+        Full,
+        PriorityQueue as AXPriorityQueue,
+        Queue as AXQueue,
+        ShardedQueue,
+        SPSCQueue,
+        TypedQueue,
+        wait_any,
+    )
+except ImportError:
     # maybe the cpp compilation failed, fall back to python:
     print('AXQueue not available, falling back to standard Queue')
     from queue import Empty, Full, Queue as AXQueue
+
+    # queue.Queue has none of their semantics (priority=, delay=, lanes=...)
+    _NATIVE_ONLY = {
+        'AsyncAXQueue',
+        'AXDelayQueue',
+        'AXPriorityQueue',
+        'AXSharedQueue',
+        'BroadcastQueue',
+        'CoalescingQueue',
+        'Executor',
+        'ShardedQueue',
+        'SPSCQueue',
+        'TypedQueue',
+        'wait_any',
+    }
+
+    def __getattr__(name):
+        if name in _NATIVE_ONLY:
+            raise ImportError(f'{name} needs the compiled ax_queue extension')
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+else:
+    from .async_queue import AsyncAXQueue
+    from .executor import Executor
+
+    # the extension only builds it with pthreads and mmap
+    if sys.platform == 'win32':
+
+        def __getattr__(name):
+            if name == 'AXSharedQueue':
+                raise ImportError(f'{name} is not available on Windows')
+            raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    else:
+        from ._ax_queue import SharedQueue as AXSharedQueue
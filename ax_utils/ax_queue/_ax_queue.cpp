@@ -1,12 +1,31 @@
 #include "Python.h"
 #include "compat.h"
 
+#include <atomic>
+#include <algorithm>
 #include <exception>
+#include <functional>
 #include <deque>
 #include <cstdint>
+#include <cstring>
+#include <limits>
+#include <string>
 #include <chrono>
+#include <cmath>
 #include <mutex>
 #include <condition_variable>
+#include <thread>
+#include <vector>
+
+#ifndef _WIN32
+#include <cerrno>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <unistd.h>
+#endif
+#ifdef __linux__
+#include <sys/eventfd.h>
+#endif
 
 using Lock = std::unique_lock<std::mutex>;
 
@@ -16,6 +35,10 @@ using Lock = std::unique_lock<std::mutex>;
  * goes to sleep again because the Queue is not big enough. Hence a lot of
  * context switches for nothing. So it is recommended to use get_many() and
  * put_many() together with the same size of items.
+ *
+ * If the producer side can't batch use get_up_to(max_items, min_items=1) on
+ * the consumer side. It returns as soon as min_items are there and takes
+ * everything available (up to max_items) under the same lock.
  */
 
 /* Macro to wrap c++ exceptions into python ones */
@@ -37,14 +60,323 @@ class AllowThreads {
 
 static const char *put_kwlist[] = {"item", "block", "timeout", NULL};
 static const char *put_many_kwlist[] = {"items", "block", "timeout", NULL};
+static const char *queue_put_many_kwlist[] = {"items", "block", "timeout", "atomic", NULL};
 static const char *get_kwlist[] = {"block", "timeout", NULL};
 static const char *get_many_kwlist[] = {"items", "block", "timeout", NULL};
+static const char *get_up_to_kwlist[] = {"max_items", "block", "timeout", "min_items", NULL};
 static const char *init_kwlist[] = {"maxsize", NULL};
+static const char *task_done_kwlist[] = {"n", NULL};
+static const char *join_kwlist[] = {"timeout", NULL};
+static const char *queue_init_kwlist[] = {"maxsize", "stats", "maxweight", "weigher", "overflow", "spin_us", "spill_dir", "spill_after", "acyclic", NULL};
 
 
 static PyObject * EmptyError;
 static PyObject * FullError;
 
+/* pickle.dumps/loads, only imported once a queue spills to disk */
+static PyObject * pickle_dumps;
+static PyObject * pickle_loads;
+
+/* A file descriptor which is readable as long as a condition holds, e.g.
+ * "queue is not empty". Lets event loops (asyncio, gevent, epoll) wait for a
+ * queue without a helper thread. eventfd on linux, a pipe elsewhere.
+ *
+ * The fd must only be polled, never read, by the user. Only state changes
+ * cost a syscall and all calls happen under the Bridge::mutex.
+ */
+class Notifier {
+    private:
+        int read_fd = -1;
+        int write_fd = -1;
+        bool is_set = false;
+
+    public:
+        ~Notifier() {
+#ifndef _WIN32
+            if (this->read_fd != -1) {
+                close(this->read_fd);
+            }
+            if (this->write_fd != -1 and this->write_fd != this->read_fd) {
+                close(this->write_fd);
+            }
+#endif
+        }
+
+        /* Returns false and sets errno if no fd could be created */
+        bool open() {
+#if defined(__linux__)
+            this->read_fd = eventfd(0, EFD_NONBLOCK | EFD_CLOEXEC);
+            this->write_fd = this->read_fd;
+            return this->read_fd != -1;
+#elif !defined(_WIN32)
+            int fds[2];
+            if (pipe(fds) == -1) {
+                return false;
+            }
+            for (int fd: fds) {
+                fcntl(fd, F_SETFL, fcntl(fd, F_GETFL) | O_NONBLOCK);
+                fcntl(fd, F_SETFD, fcntl(fd, F_GETFD) | FD_CLOEXEC);
+            }
+            this->read_fd = fds[0];
+            this->write_fd = fds[1];
+            return true;
+#else
+            errno = ENOSYS;
+            return false;
+#endif
+        }
+
+        int fileno() {
+            return this->read_fd;
+        }
+
+        void update(bool state) {
+#ifndef _WIN32
+            if (state == this->is_set) {
+                return;
+            }
+
+            std::uint64_t value = 1;
+            ssize_t ret;
+            if (state) {
+                ret = write(this->write_fd, &value, this->read_fd == this->write_fd ? 8 : 1);
+            }
+            else {
+                ret = read(this->read_fd, &value, this->read_fd == this->write_fd ? 8 : 1);
+            }
+            (void)ret;
+            this->is_set = state;
+#endif
+        }
+};
+
+/* Items of Queue(spill_dir=...) beyond spill_after are pickled into
+ * append-only segment files, which are mmap'd. A segment file is unlinked
+ * right after it is created, so nothing is left behind if the process dies,
+ * and it is unmapped as soon as the consumer has read it. Records are a
+ * uint64_t length followed by the pickle. All calls happen under the
+ * Bridge::mutex, pickling and unpickling never do: pickle may run any Python
+ * code, which could use the queue again.
+ */
+static const size_t SPILL_SEGMENT_SIZE = 16 * 1024 * 1024;
+
+struct SpillSegment {
+    int fd;
+    char *data;
+    size_t capacity;
+    size_t write_pos;
+    size_t read_pos;
+};
+
+class Spill {
+    private:
+        std::string dir;
+        std::deque<SpillSegment> segments;
+
+        void release(SpillSegment &segment) {
+#ifndef _WIN32
+            munmap(segment.data, segment.capacity);
+            close(segment.fd);
+#endif
+        }
+
+        /* Returns false and sets errno if no segment could be created */
+        bool add_segment(size_t min_capacity) {
+#ifndef _WIN32
+            size_t page = static_cast<size_t>(sysconf(_SC_PAGESIZE));
+            size_t capacity = std::max(SPILL_SEGMENT_SIZE, (min_capacity + page - 1) / page * page);
+
+            std::string path = this->dir + "/ax_queue_spill_XXXXXX";
+            std::vector<char> name(path.begin(), path.end());
+            name.push_back('\0');
+
+            int fd = mkstemp(name.data());
+            if (fd == -1) {
+                return false;
+            }
+            unlink(name.data());
+
+            if (ftruncate(fd, capacity) == -1) {
+                int error = errno;
+                close(fd);
+                errno = error;
+                return false;
+            }
+
+            void *data = mmap(NULL, capacity, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+            if (data == MAP_FAILED) {
+                int error = errno;
+                close(fd);
+                errno = error;
+                return false;
+            }
+
+            this->segments.push_back({fd, static_cast<char*>(data), capacity, 0, 0});
+            return true;
+#else
+            errno = ENOSYS;
+            return false;
+#endif
+        }
+
+    public:
+        /* Items in memory before the queue spills */
+        size_t after;
+        /* Spilled records */
+        size_t count = 0;
+
+        Spill(const char *dir, size_t after) : dir(dir), after(after) {}
+
+        ~Spill() {
+            this->clear();
+        }
+
+        /* Returns false and sets errno if the record could not be written */
+        bool append(const char *data, std::uint64_t len) {
+            size_t needed = sizeof(len) + len;
+            if (this->segments.empty() or
+                    this->segments.back().capacity - this->segments.back().write_pos < needed) {
+                if (not this->add_segment(needed)) {
+                    return false;
+                }
+            }
+
+            SpillSegment &segment = this->segments.back();
+            memcpy(segment.data + segment.write_pos, &len, sizeof(len));
+            memcpy(segment.data + segment.write_pos + sizeof(len), data, len);
+            segment.write_pos += needed;
+            this->count += 1;
+            return true;
+        }
+
+        /* The oldest record, only valid until pop_front() */
+        const char* front(std::uint64_t &len) {
+            SpillSegment &segment = this->segments.front();
+            memcpy(&len, segment.data + segment.read_pos, sizeof(len));
+            return segment.data + segment.read_pos + sizeof(len);
+        }
+
+        void pop_front() {
+            std::uint64_t len;
+            this->front(len);
+
+            SpillSegment &segment = this->segments.front();
+            segment.read_pos += sizeof(len) + len;
+            this->count -= 1;
+
+            if (segment.read_pos < segment.write_pos) {
+                return;
+            }
+
+            /* The last segment is kept for the next records */
+            if (this->segments.size() == 1) {
+                segment.read_pos = 0;
+                segment.write_pos = 0;
+            }
+            else {
+                this->release(segment);
+                this->segments.pop_front();
+            }
+        }
+
+        /* Calls f(data, len) for every record, oldest first, stops if it
+         * returns false. Returns false if it was stopped.
+         */
+        template <typename F>
+        bool for_each(F f) {
+            for (SpillSegment &segment: this->segments) {
+                size_t pos = segment.read_pos;
+                while (pos < segment.write_pos) {
+                    std::uint64_t len;
+                    memcpy(&len, segment.data + pos, sizeof(len));
+                    if (not f(segment.data + pos + sizeof(len), len)) {
+                        return false;
+                    }
+                    pos += sizeof(len) + len;
+                }
+            }
+            return true;
+        }
+
+        /* State to undo the appends after it, see rollback() */
+        struct Mark {
+            size_t segments;
+            size_t write_pos;
+            size_t count;
+        };
+
+        Mark mark() {
+            size_t write_pos = this->segments.empty() ? 0 : this->segments.back().write_pos;
+            return {this->segments.size(), write_pos, this->count};
+        }
+
+        void rollback(const Mark &mark) {
+            while (this->segments.size() > mark.segments) {
+                this->release(this->segments.back());
+                this->segments.pop_back();
+            }
+            if (not this->segments.empty()) {
+                this->segments.back().write_pos = mark.write_pos;
+            }
+            this->count = mark.count;
+        }
+
+        void clear() {
+            for (SpillSegment &segment: this->segments) {
+                this->release(segment);
+            }
+            this->segments.clear();
+            this->count = 0;
+        }
+};
+
+/* Time spent in one kind of blocking wait */
+struct WaitStats {
+    std::uint64_t count = 0;
+    std::chrono::steady_clock::duration total{0};
+    std::chrono::steady_clock::duration longest{0};
+
+    void add(std::chrono::steady_clock::duration waited) {
+        this->count += 1;
+        this->total += waited;
+        this->longest = std::max(this->longest, waited);
+    }
+};
+
+/* Counters of Queue(stats=True). They are only touched under the
+ * Bridge::mutex, a queue without stats pays one NULL check per call.
+ * Compile with -DAX_QUEUE_NO_STATS to remove even that.
+ */
+class QueueStats {
+    public:
+        std::uint64_t puts = 0;
+        std::uint64_t items_put = 0;
+        std::uint64_t max_put_batch = 0;
+        std::uint64_t gets = 0;
+        std::uint64_t items_got = 0;
+        std::uint64_t max_get_batch = 0;
+        /* try_to_lock failed and we had to wait for the mutex */
+        std::uint64_t lock_contended = 0;
+        WaitStats blocked_empty;
+        WaitStats blocked_full;
+        std::uint64_t high_watermark = 0;
+        std::uint64_t timeouts = 0;
+};
+
+/* A thread blocked in wait_any(), see there */
+class AnyWaiter {
+    public:
+        std::mutex mutex;
+        std::condition_variable cond;
+        bool signaled = false;
+
+        void signal() {
+            std::lock_guard<std::mutex> lock(this->mutex);
+            this->signaled = true;
+            this->cond.notify_one();
+        }
+};
+
 class Bridge {
     public:
         std::mutex mutex;
@@ -52,6 +384,81 @@ class Bridge {
         std::condition_variable full_cond;
         std::condition_variable all_tasks_done_cond;
         std::deque<PyObject*> queue;
+        /* queue.size() for spinning threads, which don't hold the mutex */
+        std::atomic<size_t> size{0};
+        /* Current spin time, adapted between 0 and Queue::spin_us */
+        long int spin_budget = 0;
+        std::uint32_t spin_skips = 0;
+        /* Only used by weighted queues, weights[i] belongs to queue[i] */
+        std::deque<std::uint64_t> weights;
+        std::uint64_t weight = 0;
+        /* Items dropped by an overflow policy */
+        std::uint64_t dropped = 0;
+        /* Only created on request, see Queue_fileno */
+        Notifier *readable = NULL;
+        Notifier *writable = NULL;
+        /* Only created for Queue(stats=True) */
+        QueueStats *stats = NULL;
+        /* Only created for Queue(spill_dir=...) */
+        Spill *spill = NULL;
+        /* Threads in wait_any() for this queue */
+        std::vector<AnyWaiter*> any_waiters;
+        /* get_matching() waits for new items, not for a non-empty queue */
+        std::condition_variable match_cond;
+        std::uint32_t match_waiters = 0;
+        std::uint64_t pushes = 0;
+        /* Free slots promised to a streaming put_many(), see _reserve_slots */
+        size_t reserved = 0;
+
+        ~Bridge() {
+            delete this->readable;
+            delete this->writable;
+            delete this->stats;
+            delete this->spill;
+        }
+};
+
+/* The templates below are shared with the other queues, which have no stats */
+template <typename B>
+static inline QueueStats*
+_stats_of(B *bridge)
+{
+    return NULL;
+}
+
+static inline QueueStats*
+_stats_of(Bridge *bridge)
+{
+#ifdef AX_QUEUE_NO_STATS
+    return NULL;
+#else
+    return bridge->stats;
+#endif
+}
+
+/* Measures a blocking wait for the stats, if there are any */
+class BlockedTimer {
+    private:
+        WaitStats *wait_stats;
+        std::chrono::steady_clock::time_point start;
+    public:
+        BlockedTimer(WaitStats *wait_stats) : wait_stats(wait_stats) {
+            if (wait_stats) {
+                this->start = std::chrono::steady_clock::now();
+            }
+        }
+        ~BlockedTimer() {
+            if (this->wait_stats) {
+                this->wait_stats->add(std::chrono::steady_clock::now() - this->start);
+            }
+        }
+};
+
+/* What put() does if the queue is full */
+enum Overflow {
+    OVERFLOW_BLOCK,
+    OVERFLOW_DROP_OLDEST,
+    OVERFLOW_DROP_NEWEST,
 };
 
 typedef struct {
@@ -59,8 +466,277 @@ typedef struct {
     Bridge *bridge;
     size_t maxsize;
     std::uint64_t unfinished_tasks;
+    Overflow overflow;
+    /* Spin that long before parking on a condition variable */
+    long int spin_us;
+    /* maxweight or weigher given, 0 => weight is not limited */
+    bool weighted;
+    std::uint64_t maxweight;
+    PyObject *weigher;
+    /* The items can't be part of a cycle, the GC doesn't visit them */
+    bool acyclic;
 } Queue;
 
+/* Weight of an item, has to be called without the lock.
+ * Default: len() of bytes-like objects, 1 for everything else.
+ */
+static int
+_item_weight(Queue *self, PyObject *item, std::uint64_t &weight)
+{
+    weight = 0;
+    if (not self->weighted) {
+        return 0;
+    }
+
+    if (self->weigher) {
+        PyObject *result = PyObject_CallFunctionObjArgs(self->weigher, item, NULL);
+        if (result == NULL) {
+            return -1;
+        }
+
+        long long value = PyLong_AsLongLong(result);
+        Py_DECREF(result);
+        if (value == -1 and PyErr_Occurred()) {
+            return -1;
+        }
+
+        if (value < 0) {
+            PyErr_Format(PyExc_ValueError, "weight must be greater or equal 0 but it is: %lld", value);
+            return -1;
+        }
+        weight = value;
+    }
+    else if (PyBytes_Check(item)) {
+        weight = PyBytes_GET_SIZE(item);
+    }
+    else if (PyByteArray_Check(item)) {
+        weight = PyByteArray_GET_SIZE(item);
+    }
+    else if (PyObject_CheckBuffer(item)) {
+        Py_buffer buffer;
+        if (PyObject_GetBuffer(item, &buffer, PyBUF_SIMPLE) == -1) {
+            return -1;
+        }
+        weight = buffer.len;
+        PyBuffer_Release(&buffer);
+    }
+    else {
+        weight = 1;
+    }
+    return 0;
+}
+
+/* Number of queued items, for Queue including the spilled ones */
+template <typename T>
+static inline size_t
+_queued(T *self)
+{
+    return self->bridge->queue.size();
+}
+
+static inline size_t
+_queued(Queue *self)
+{
+    Bridge *bridge = self->bridge;
+    return bridge->queue.size() + (bridge->spill ? bridge->spill->count : 0);
+}
+
+/* An item heavier than maxweight is accepted by an empty queue, else it
+ * could never be put.
+ */
+template <typename T>
+static inline bool
+_has_free_slots(T *self, size_t nb_of_items, std::uint64_t weight)
+{
+    return self->maxsize == 0 or (self->maxsize - _queued(self)) >= nb_of_items;
+}
+
+static inline bool
+_has_free_slots(Queue *self, size_t nb_of_items, std::uint64_t weight)
+{
+    Bridge *bridge = self->bridge;
+    if (self->maxsize != 0 and _queued(self) + bridge->reserved + nb_of_items > self->maxsize) {
+        return false;
+    }
+    return (self->maxweight == 0 or bridge->queue.empty() or
+            bridge->weight + weight <= self->maxweight);
+}
+
+/* Records taken out of the spill under the lock, see _popped_item */
+typedef std::vector<std::string> SpillRecords;
+
+static PyObject*
+_load_spilled(const char *data, std::uint64_t len)
+{
+    PyObject *item = NULL;
+    PyObject *view = PyMemoryView_FromMemory(const_cast<char*>(data), len, PyBUF_READ);
+    if (view != NULL) {
+        item = PyObject_CallFunctionObjArgs(pickle_loads, view, NULL);
+        Py_DECREF(view);
+    }
+    return item;
+}
+
+/* Steals the reference of item, record is its pickle (only needed if the
+ * item is spilled, see _spill_from). Returns -1 if the record could not be
+ * written. Once items are spilled all new items are spilled too until the
+ * consumer has caught up, this keeps the FIFO order.
+ */
+static inline int
+_push_item(Queue *self, PyObject *item, std::uint64_t weight, PyObject *record=NULL)
+{
+    Bridge *bridge = self->bridge;
+    Spill *spill = bridge->spill;
+    if (spill and (spill->count or bridge->queue.size() >= spill->after)) {
+        /* The caller still holds a reference */
+        Py_DECREF(item);
+        if (not spill->append(PyBytes_AS_STRING(record), PyBytes_GET_SIZE(record))) {
+            PyErr_SetFromErrno(PyExc_OSError);
+            return -1;
+        }
+    }
+    else {
+        bridge->queue.push_back(item);
+        if (self->weighted) {
+            bridge->weights.push_back(weight);
+            bridge->weight += weight;
+        }
+    }
+    bridge->size.store(_queued(self), std::memory_order_release);
+    return 0;
+}
+
+/* Returns the reference of the queue. A spilled item is returned as NULL,
+ * its record is copied to records and unpickled by the caller after the
+ * lock is released.
+ */
+static inline PyObject*
+_pop_item(Queue *self, SpillRecords &records)
+{
+    Bridge *bridge = self->bridge;
+    PyObject *item = NULL;
+    if (bridge->queue.empty()) {
+        std::uint64_t len;
+        const char *data = bridge->spill->front(len);
+        records.emplace_back(data, len);
+        bridge->spill->pop_front();
+    }
+    else {
+        item = bridge->queue.front();
+        bridge->queue.pop_front();
+        if (self->weighted) {
+            bridge->weight -= bridge->weights.front();
+            bridge->weights.pop_front();
+        }
+    }
+    bridge->size.store(_queued(self), std::memory_order_release);
+    return item;
+}
+
+/* The items in memory come first, so records holds the last ones */
+static void
+_pop_items(
+        Queue *self,
+        size_t nb_of_items,
+        std::vector<PyObject*> &items,
+        SpillRecords &records)
+{
+    items.reserve(nb_of_items);
+    for (size_t i=0; i<nb_of_items; i++) {
+        PyObject *item = _pop_item(self, records);
+        if (item != NULL) {
+            items.push_back(item);
+        }
+    }
+}
+
+static inline void
+_count_put(Queue *self, size_t nb_of_items)
+{
+    QueueStats *stats = _stats_of(self->bridge);
+    if (stats) {
+        stats->puts += 1;
+        stats->items_put += nb_of_items;
+        stats->max_put_batch = std::max<std::uint64_t>(stats->max_put_batch, nb_of_items);
+        stats->high_watermark = std::max<std::uint64_t>(
+                stats->high_watermark, _queued(self));
+    }
+}
+
+static inline void
+_count_get(Queue *self, size_t nb_of_items)
+{
+    QueueStats *stats = _stats_of(self->bridge);
+    if (stats) {
+        stats->gets += 1;
+        stats->items_got += nb_of_items;
+        stats->max_get_batch = std::max<std::uint64_t>(stats->max_get_batch, nb_of_items);
+    }
+}
+
+/* Has to be called after every change of the queue size */
+static inline void
+_update_notifiers(Queue *self)
+{
+    Bridge *bridge = self->bridge;
+    if (bridge->readable) {
+        bridge->readable->update(_queued(self) != 0);
+    }
+    if (not bridge->any_waiters.empty() and _queued(self) != 0) {
+        for (AnyWaiter *waiter: bridge->any_waiters) {
+            waiter->signal();
+        }
+    }
+    if (bridge->writable) {
+        bridge->writable->update(self->overflow != OVERFLOW_BLOCK or (
+                _has_free_slots(self, 1, 0) and (
+                    self->maxweight == 0 or bridge->weight < self->maxweight)));
+    }
+}
+
+/* spill_dir and spill_after come together, pickle is imported on first use */
+static int
+_check_spill_args(bool has_spill_dir, const std::string &spill_path, Py_ssize_t spill_after)
+{
+    if (not has_spill_dir) {
+        if (spill_after != -1) {
+            PyErr_Format(PyExc_ValueError, "spill_after needs a spill_dir");
+            return -1;
+        }
+        return 0;
+    }
+
+#ifdef _WIN32
+    PyErr_Format(PyExc_NotImplementedError, "spill_dir is not supported on windows");
+    return -1;
+#else
+    if (spill_after < 0) {
+        PyErr_Format(PyExc_ValueError, "spill_dir needs spill_after >= 0");
+        return -1;
+    }
+
+    if (access(spill_path.c_str(), W_OK | X_OK) == -1) {
+        PyErr_SetFromErrnoWithFilename(PyExc_OSError, spill_path.c_str());
+        return -1;
+    }
+
+    if (pickle_dumps == NULL) {
+        PyObject *pickle = PyImport_ImportModule("pickle");
+        if (pickle == NULL) {
+            return -1;
+        }
+        pickle_dumps = PyObject_GetAttrString(pickle, "dumps");
+        pickle_loads = PyObject_GetAttrString(pickle, "loads");
+        Py_DECREF(pickle);
+        if (pickle_dumps == NULL or pickle_loads == NULL) {
+            Py_CLEAR(pickle_dumps);
+            Py_CLEAR(pickle_loads);
+            return -1;
+        }
+    }
+    return 0;
+#endif
+}
 
 static PyObject *
 Queue_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
@@ -70,6 +746,12 @@ Queue_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
     self->bridge = NULL;
     self->unfinished_tasks = 0;
     self->maxsize = 0;
+    self->weighted = false;
+    self->maxweight = 0;
+    self->weigher = NULL;
+    self->overflow = OVERFLOW_BLOCK;
+    self->spin_us = 0;
+    self->acyclic = false;
 
     return reinterpret_cast<PyObject*>(self);
 }
@@ -78,15 +760,109 @@ static int
 Queue_init(Queue *self, PyObject *args, PyObject *kwargs)
 {
     long int maxsize=0;
+    int stats=0;
+    long long maxweight=0;
+    PyObject *weigher=NULL;
+    const char *overflow="block";
+    long int spin_us=0;
+    PyObject *spill_dir=NULL;
+    Py_ssize_t spill_after=-1;
+    int acyclic=0;
     if(not PyArg_ParseTupleAndKeywords(
                 args,
                 kwargs,
-                "|l",
-                const_cast<char**>(init_kwlist),
-                &maxsize))
+                "|lpLOslO&np",
+                const_cast<char**>(queue_init_kwlist),
+                &maxsize,
+                &stats,
+                &maxweight,
+                &weigher,
+                &overflow,
+                &spin_us,
+                PyUnicode_FSConverter,
+                &spill_dir,
+                &spill_after,
+                &acyclic))
     {
         return -1;
     }
+    self->acyclic = acyclic;
+
+    /* Only the path is needed, it is copied into the Spill */
+    std::string spill_path;
+    if (spill_dir != NULL) {
+        spill_path = PyBytes_AS_STRING(spill_dir);
+        Py_DECREF(spill_dir);
+    }
+
+    if (_check_spill_args(spill_dir != NULL, spill_path, spill_after) == -1) {
+        return -1;
+    }
+
+    if (spin_us < 0) {
+        PyErr_Format(
+                PyExc_ValueError,
+                "spin_us must be greater or equal 0 but it is: %ld",
+                spin_us);
+        return -1;
+    }
+    self->spin_us = spin_us;
+
+    if (strcmp(overflow, "block") == 0) {
+        self->overflow = OVERFLOW_BLOCK;
+    }
+    else if (strcmp(overflow, "drop_oldest") == 0) {
+        self->overflow = OVERFLOW_DROP_OLDEST;
+    }
+    else if (strcmp(overflow, "drop_newest") == 0) {
+        self->overflow = OVERFLOW_DROP_NEWEST;
+    }
+    else {
+        PyErr_Format(
+                PyExc_ValueError,
+                "overflow must be 'block', 'drop_oldest' or 'drop_newest', not '%s'",
+                overflow);
+        return -1;
+    }
+
+    if (self->overflow != OVERFLOW_BLOCK and maxsize <= 0 and maxweight <= 0) {
+        PyErr_Format(PyExc_ValueError, "overflow '%s' needs maxsize or maxweight", overflow);
+        return -1;
+    }
+
+    if (weigher == Py_None) {
+        weigher = NULL;
+    }
+
+    if (weigher != NULL and not PyCallable_Check(weigher)) {
+        PyErr_Format(PyExc_TypeError, "weigher must be callable");
+        return -1;
+    }
+
+    if (maxweight < 0) {
+        PyErr_Format(
+                PyExc_ValueError,
+                "maxweight must be greater or equal 0 but it is: %lld",
+                maxweight);
+        return -1;
+    }
+
+    if (spill_dir != NULL and (self->overflow != OVERFLOW_BLOCK or maxweight > 0 or weigher != NULL)) {
+        PyErr_Format(PyExc_ValueError, "spill_dir can't be combined with overflow, maxweight or weigher");
+        return -1;
+    }
+
+    self->maxweight = maxweight;
+    self->weighted = maxweight > 0 or weigher != NULL;
+    Py_XINCREF(weigher);
+    Py_XSETREF(self->weigher, weigher);
+
+#ifdef AX_QUEUE_NO_STATS
+    if (stats) {
+        PyErr_Format(PyExc_ValueError, "AXQueue is compiled without stats");
+        return -1;
+    }
+#endif
 
     if (maxsize < 0) {
         self->maxsize = 0;
@@ -97,6 +873,13 @@ Queue_init(Queue *self, PyObject *args, PyObject *kwargs)
 
     BEGIN_SAFE_CALL
         self->bridge = new Bridge();
+        self->bridge->spin_budget = spin_us;
+        if (stats) {
+            self->bridge->stats = new QueueStats();
+        }
+        if (spill_dir != NULL) {
+            self->bridge->spill = new Spill(spill_path.c_str(), spill_after);
+        }
     END_SAFE_CALL("Error creating underlying queue: %s", -1)
     return 0;
 }
@@ -104,7 +887,9 @@ Queue_init(Queue *self, PyObject *args, PyObject *kwargs)
 static int
 Queue_traverse(Queue *self, visitproc visit, void *arg)
 {
-    if (self->bridge == NULL) {
+    Py_VISIT(self->weigher);
+    /* A backlog of millions of items would be visited on every collection */
+    if (self->bridge == NULL or self->acyclic) {
         return 0;
     }
 
@@ -118,6 +903,7 @@ Queue_traverse(Queue *self, visitproc visit, void *arg)
 static int
 Queue_clear(Queue *self)
 {
+    Py_CLEAR(self->weigher);
     if (self->bridge == NULL) {
         return 0;
     }
@@ -127,6 +913,13 @@ Queue_clear(Queue *self)
     }
 
     self->bridge->queue.clear();
+    if (self->bridge->spill) {
+        self->bridge->spill->clear();
+    }
+    self->bridge->size.store(0);
+    self->bridge->weights.clear();
+    self->bridge->weight = 0;
+    _update_notifiers(self);
 
     return 0;
 }
@@ -138,140 +931,7318 @@ Queue_dealloc(Queue *self)
         Queue_clear(self);
         delete self->bridge;
     }
-    Py_TYPE(self)->tp_free(reinterpret_cast<PyObject*>(self));
-}
+    Py_TYPE(self)->tp_free(reinterpret_cast<PyObject*>(self));
+}
+
+
+static int
+_parse_block_and_timeout(
+        PyObject *py_block,
+        PyObject *py_timeout,
+        bool & block,
+        double & timeout)
+{
+
+    if (py_block != NULL and PyObject_Not(py_block)) {
+        block = false;
+    }
+
+    /* timeout = None => only block is used
+     * timeout < 0 => Value Error
+     * timeout > 0 wait for timeout
+     * timeout == 0 => block = false
+     */
+    if (py_timeout != NULL and py_timeout != Py_None) {
+        timeout = PyFloat_AsDouble(py_timeout);
+        if (PyErr_Occurred()) {
+            PyErr_Format(PyExc_ValueError, "'timeout' is not a valid float");
+            return -1;
+        }
+
+        if (timeout < 0) {
+            PyErr_Format(PyExc_ValueError, "'timeout' must be positive");
+            return -1;
+        }
+
+        if (timeout > static_cast<double>(std::numeric_limits<time_t>::max())) {
+            PyErr_Format(PyExc_OverflowError, "timeout is too large");
+            return -1;
+        }
+
+        if (timeout == 0) {
+            block = false;
+        }
+    }
+    return 1;
+}
+
+static void
+_wait_for_lock(Lock& lock)
+{
+    AllowThreads raii_lock;
+    lock.lock();
+}
+
+static void
+_wait_for_lock(Lock& lock, QueueStats *stats)
+{
+    _wait_for_lock(lock);
+    if (stats) {
+        stats->lock_contended += 1;
+    }
+}
+
+template <typename B>
+static void
+_blocked_wait_full(B* bridge, Lock& lock)
+{
+    QueueStats *stats = _stats_of(bridge);
+    BlockedTimer timer(stats ? &stats->blocked_full : NULL);
+    AllowThreads raii_lock;
+    bridge->full_cond.wait(lock);
+}
+
+template <typename B>
+static bool
+_timed_wait_full(
+        B* bridge,
+        Lock& lock,
+        std::chrono::steady_clock::time_point timeout)
+{
+    QueueStats *stats = _stats_of(bridge);
+    std::cv_status ret;
+    {
+        BlockedTimer timer(stats ? &stats->blocked_full : NULL);
+        AllowThreads raii_lock;
+        ret = bridge->full_cond.wait_until(lock, timeout);
+    }
+    if (stats and ret == std::cv_status::timeout) {
+        stats->timeouts += 1;
+    }
+    return ret == std::cv_status::no_timeout;
+}
+
+static inline void
+_cpu_relax()
+{
+#if defined(__x86_64__) || defined(__i386__)
+    __builtin_ia32_pause();
+#elif defined(__aarch64__)
+    asm volatile("yield");
+#else
+    std::this_thread::yield();
+#endif
+}
+
+/* Busy waits with the GIL and the lock released until ready() or the spin
+ * budget is over. Saves the futex sleep/wake if the other side is quick. The
+ * lock is held again afterwards, the caller has to check its condition again.
+ *
+ * The budget adapts: it doubles (up to spin_us) if spinning was enough and
+ * halves if we had to park anyway, e.g. on a busy or single core machine.
+ * Once it is 0 every 64th wait probes with 1us.
+ */
+template <typename F>
+static void
+_spin(Queue *self, Lock& lock, std::chrono::steady_clock::time_point limit, F ready)
+{
+    Bridge *bridge = self->bridge;
+    long int budget = bridge->spin_budget;
+    if (budget == 0) {
+        if (++bridge->spin_skips % 64 != 0) {
+            return;
+        }
+        budget = 1;
+    }
+
+    auto deadline = std::min(
+            limit,
+            std::chrono::steady_clock::now() + std::chrono::microseconds(budget));
+
+    bool done;
+    {
+        AllowThreads raii_lock;
+        lock.unlock();
+        while (not (done = ready()) and std::chrono::steady_clock::now() < deadline) {
+            _cpu_relax();
+        }
+        lock.lock();
+    }
+
+    if (done) {
+        bridge->spin_budget = std::min(self->spin_us, budget * 2);
+    }
+    else {
+        bridge->spin_budget = budget / 2;
+    }
+}
+
+/* Only Queue(spin_us=...) spins, the other queues park right away */
+template <typename T>
+static inline void
+_spin_for_items(T *self, Lock& lock, size_t nb_of_items, std::chrono::steady_clock::time_point limit)
+{
+}
+
+static inline void
+_spin_for_items(Queue *self, Lock& lock, size_t nb_of_items, std::chrono::steady_clock::time_point limit)
+{
+    if (self->spin_us == 0) {
+        return;
+    }
+
+    Bridge *bridge = self->bridge;
+    _spin(self, lock, limit, [bridge, nb_of_items]() {
+        return bridge->size.load(std::memory_order_acquire) >= nb_of_items;
+    });
+}
+
+template <typename T>
+static inline void
+_spin_for_free_slots(T *self, Lock& lock, size_t nb_of_items, std::chrono::steady_clock::time_point limit)
+{
+}
+
+/* Only the item count is watched, a queue full by weight parks right away */
+static inline void
+_spin_for_free_slots(Queue *self, Lock& lock, size_t nb_of_items, std::chrono::steady_clock::time_point limit)
+{
+    if (self->spin_us == 0 or self->maxsize == 0) {
+        return;
+    }
+
+    Bridge *bridge = self->bridge;
+    size_t maxsize = self->maxsize;
+    _spin(self, lock, limit, [bridge, maxsize, nb_of_items]() {
+        return maxsize - bridge->size.load(std::memory_order_acquire) >= nb_of_items;
+    });
+}
+
+template <typename T>
+static bool
+_wait_for_free_slots(
+        T *self,
+        bool block,
+        double timeout,
+        Lock& lock,
+        size_t nb_of_items,
+        std::uint64_t weight=0)
+{
+    std::uint64_t timeout_millis = static_cast<std::uint64_t>(timeout*1000);
+
+    if (_has_free_slots(self, nb_of_items, weight)) {
+        /* Fall through the end of method */
+    }
+    else if (not block) {
+        PyErr_Format(FullError, "Queue Full");
+        return false;
+    }
+    else if (timeout > 0) {
+        auto abs_timeout = std::chrono::steady_clock::now();
+        abs_timeout += std::chrono::milliseconds(timeout_millis);
+        _spin_for_free_slots(self, lock, nb_of_items, abs_timeout);
+        while (not _has_free_slots(self, nb_of_items, weight)) {
+            if (not _timed_wait_full(self->bridge, lock, abs_timeout)) {
+                PyErr_Format(FullError, "Queue Full");
+                return false;
+            }
+        }
+    }
+    else {
+        _spin_for_free_slots(self, lock, nb_of_items, std::chrono::steady_clock::time_point::max());
+        while (not _has_free_slots(self, nb_of_items, weight)) {
+            _blocked_wait_full(self->bridge, lock);
+        }
+    }
+    return true;
+}
+
+/* Makes room for nb_of_items by dropping the oldest items. They never
+ * reach a consumer, so they count as done for task_done()/join().
+ * The caller has to decref them without the lock.
+ */
+static void
+_drop_oldest(
+        Queue *self,
+        size_t nb_of_items,
+        std::uint64_t weight,
+        std::vector<PyObject*> &dropped)
+{
+    Bridge *bridge = self->bridge;
+    size_t already_dropped = dropped.size();
+    /* Queues with an overflow policy never spill */
+    SpillRecords records;
+    while (not bridge->queue.empty() and not _has_free_slots(self, nb_of_items, weight)) {
+        dropped.push_back(_pop_item(self, records));
+    }
+
+    size_t nb_of_dropped = dropped.size() - already_dropped;
+    bridge->dropped += nb_of_dropped;
+    self->unfinished_tasks -= nb_of_dropped;
+}
+
+/* Index of the first of items[first:nb_to_put] which _push_item spills */
+static inline size_t
+_spill_from(Queue *self, size_t first, size_t nb_to_put)
+{
+    Bridge *bridge = self->bridge;
+    Spill *spill = bridge->spill;
+    size_t in_memory = 0;
+    if (spill->count == 0 and bridge->queue.size() < spill->after) {
+        in_memory = spill->after - bridge->queue.size();
+    }
+    return std::min(nb_to_put, first + in_memory);
+}
+
+/* Pickles of the items of one put, made before the lock is taken */
+class SpillPickles {
+    public:
+        std::vector<PyObject*> records;
+        /* records[i] is set for the items from first on */
+        size_t first;
+
+        SpillPickles(size_t nb_of_items) : records(nb_of_items, NULL), first(nb_of_items) {}
+
+        ~SpillPickles() {
+            for (PyObject *record: this->records) {
+                Py_XDECREF(record);
+            }
+        }
+
+        /* Pickles items[from:first], returns -1 on error */
+        int pickle(PyObject **items, size_t from) {
+            for (size_t i=from; i<this->first; i++) {
+                this->records[i] = PyObject_CallFunction(pickle_dumps, "Oi", items[i], -1);
+                if (this->records[i] == NULL) {
+                    return -1;
+                }
+            }
+            this->first = std::min(this->first, from);
+            return 0;
+        }
+};
+
+/* Puts borrowed items, weights is NULL for queues which are not weighted.
+ * With nb_put only room for the first item is waited for and as many items
+ * as fit are put, nb_put tells how many. unreserve releases slots taken by
+ * _reserve_slots in the same lock hold, so the items can use them.
+ *
+ * Items which will be spilled are pickled before the lock is taken. Which
+ * ones spill is only known under the lock, if more do than guessed the
+ * lock is released to pickle them and the put starts over. Nothing is put
+ * if a record can't be written.
+ */
+static PyObject*
+_internal_put_items(
+        Queue *self,
+        PyObject **items,
+        const std::uint64_t *weights,
+        size_t nb_of_items,
+        bool block,
+        double timeout,
+        bool *rejected=NULL,
+        size_t *nb_put=NULL,
+        size_t unreserve=0)
+{
+    Bridge *bridge = self->bridge;
+    Spill *spill = bridge->spill;
+    std::vector<PyObject*> dropped;
+    SpillPickles pickles(spill ? nb_of_items : 0);
+    size_t nb_to_put = nb_of_items;
+    size_t first = 0;
+    size_t pushed = 0;
+    size_t skipped = 0;
+    bool failed = false;
+
+    /* drop_oldest: the head of a batch bigger than maxsize is dropped right away */
+    if (self->overflow == OVERFLOW_DROP_OLDEST and self->maxsize != 0
+            and nb_of_items > self->maxsize) {
+        first = nb_of_items - self->maxsize;
+    }
+
+    std::uint64_t weight = 0;
+    for (size_t i=first; weights and i<nb_of_items; i++) {
+        weight += weights[i];
+    }
+
+    if (spill) {
+        size_t queued = bridge->size.load(std::memory_order_acquire);
+        size_t guess = queued >= spill->after ? 0 : std::min(nb_of_items, spill->after - queued);
+        if (pickles.pickle(items, guess) == -1) {
+            return NULL;
+        }
+    }
+
+    BEGIN_SAFE_CALL
+
+    while (true) {
+        Lock lock(bridge->mutex, std::try_to_lock);
+        if (not lock.owns_lock()) {
+            _wait_for_lock(lock, _stats_of(bridge));
+        }
+        bridge->reserved -= unreserve;
+
+        if (self->overflow == OVERFLOW_BLOCK) {
+            /* try_put: a full queue is no error */
+            if (rejected and not _has_free_slots(self, nb_of_items, weight)) {
+                *rejected = true;
+                Py_RETURN_NONE;
+            }
+
+            if (nb_put) {
+                std::uint64_t fitting_weight = weights ? weights[0] : 0;
+                if (not _wait_for_free_slots(self, block, timeout, lock, 1, fitting_weight)) {
+                    return NULL;
+                }
+
+                /* Only the first item may exceed maxweight in an empty queue */
+                for (nb_to_put=1; nb_to_put<nb_of_items; nb_to_put++) {
+                    std::uint64_t item_weight = weights ? weights[nb_to_put] : 0;
+                    if (not _has_free_slots(self, nb_to_put + 1, 0) or (self->maxweight and
+                            bridge->weight + fitting_weight + item_weight > self->maxweight)) {
+                        break;
+                    }
+                    fitting_weight += item_weight;
+                }
+            }
+            else if (not _wait_for_free_slots(self, block, timeout, lock, nb_of_items, weight)) {
+                return NULL;
+            }
+        }
+        else if (self->overflow == OVERFLOW_DROP_OLDEST) {
+            _drop_oldest(self, nb_of_items - first, weight, dropped);
+        }
+
+        if (spill) {
+            size_t spill_from = _spill_from(self, first, nb_to_put);
+            if (spill_from < pickles.first) {
+                /* The reserved slots are kept for the next attempt */
+                bridge->reserved += unreserve;
+                lock.unlock();
+                if (pickles.pickle(items, spill_from) == -1) {
+                    return NULL;
+                }
+                continue;
+            }
+        }
+
+        size_t in_memory = bridge->queue.size();
+        Spill::Mark mark = spill ? spill->mark() : Spill::Mark();
+        for (size_t i=first; i<nb_to_put; i++) {
+            std::uint64_t item_weight = weights ? weights[i] : 0;
+            if (self->overflow == OVERFLOW_DROP_NEWEST and
+                    not _has_free_slots(self, 1, item_weight)) {
+                skipped++;
+                continue;
+            }
+
+            Py_INCREF(items[i]);
+            PyObject *record = spill and i >= pickles.first ? pickles.records[i] : NULL;
+            if (_push_item(self, items[i], item_weight, record) == -1) {
+                failed = true;
+                break;
+            }
+            pushed++;
+        }
+
+        if (failed and pushed) {
+            /* Only a spill fails, put_many stays all or nothing */
+            spill->rollback(mark);
+            while (bridge->queue.size() > in_memory) {
+                dropped.push_back(bridge->queue.back());
+                bridge->queue.pop_back();
+            }
+            bridge->size.store(_queued(self), std::memory_order_release);
+            pushed = 0;
+        }
+
+        bridge->dropped += first + skipped;
+        if (rejected) {
+            *rejected = first + skipped > 0;
+        }
+        if (nb_put) {
+            *nb_put = failed ? 0 : nb_to_put;
+        }
+
+        if (pushed > 0) {
+            self->unfinished_tasks += pushed;
+            bridge->pushes += pushed;
+            if (bridge->match_waiters) {
+                bridge->match_cond.notify_all();
+            }
+            _count_put(self, pushed);
+            _update_notifiers(self);
+            if (pushed == 1) {
+                bridge->empty_cond.notify_one();
+            }
+            else {
+                bridge->empty_cond.notify_all();
+            }
+        }
+        if (unreserve > pushed) {
+            /* Reserved slots which stay free */
+            _update_notifiers(self);
+            bridge->full_cond.notify_all();
+        }
+        break;
+    }
+
+    for (PyObject *item: dropped) {
+        Py_DECREF(item);
+    }
+
+    if (failed) {
+        return NULL;
+    }
+
+    END_SAFE_CALL("Error in put: %s", NULL)
+    Py_RETURN_NONE;
+}
+
+static PyObject*
+_internal_put(Queue *self, PyObject *item, bool block, double timeout)
+{
+    std::uint64_t weight;
+    if (_item_weight(self, item, weight) == -1) {
+        return NULL;
+    }
+    return _internal_put_items(self, &item, self->weighted ? &weight : NULL, 1, block, timeout);
+}
+
+static PyObject*
+Queue_put(Queue *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *item;
+
+    PyObject *py_block=NULL;
+    bool block=true;
+
+    PyObject *py_timeout=NULL;
+    double timeout = 0;
+    
+    if (not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "O|OO:put",
+                                const_cast<char**>(put_kwlist),
+                                &item,
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+    return _internal_put(self, item, block, timeout);
+}
+
+/* The weights have to be known before the lock is taken */
+static int
+_item_weights(
+        Queue *self,
+        PyObject **items,
+        size_t nb_of_items,
+        std::vector<std::uint64_t> &weights)
+{
+    if (not self->weighted) {
+        return 0;
+    }
+
+    weights.resize(nb_of_items);
+    for (size_t i=0; i<nb_of_items; i++) {
+        if (_item_weight(self, items[i], weights[i]) == -1) {
+            return -1;
+        }
+    }
+    return 0;
+}
+
+/* Items pulled from an iterator per lock hold by put_many(atomic=False) */
+#define PUT_MANY_CHUNK_SIZE 1024
+
+/* Reserves up to max_slots free slots of a bounded queue, waiting for at
+ * least one. Items are pulled from an iterator only for reserved slots, so
+ * none is lost when the queue stays full. Returns 0 with Full set if there
+ * was no room in time.
+ */
+static size_t
+_reserve_slots(Queue *self, bool block, double timeout, size_t max_slots)
+{
+    Bridge *bridge = self->bridge;
+    Lock lock(bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock, _stats_of(bridge));
+    }
+
+    if (not _wait_for_free_slots(self, block, timeout, lock, 1)) {
+        return 0;
+    }
+    size_t slots = std::min(max_slots, self->maxsize - _queued(self) - bridge->reserved);
+    bridge->reserved += slots;
+    _update_notifiers(self);
+    return slots;
+}
+
+static void
+_release_slots(Queue *self, size_t slots)
+{
+    Bridge *bridge = self->bridge;
+    Lock lock(bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock, _stats_of(bridge));
+    }
+
+    bridge->reserved -= slots;
+    _update_notifiers(self);
+    bridge->full_cond.notify_all();
+}
+
+/* put_many(atomic=False) puts as many items as fit per lock hold and waits
+ * for room for the rest, so any iterable and batches bigger than maxsize
+ * can be put. Returns how many items were taken (items dropped by an
+ * overflow policy included), fewer than given if block is False or the
+ * timeout (for the whole call) expired. Lists and tuples can be resumed at
+ * that index, iterators right where they are: items are only pulled for
+ * reserved slots. With maxweight the weight of an item is only known once
+ * it is pulled, so other iterables are only taken by a put which waits
+ * until all items are put and are read into a tuple first. If the iterator
+ * raises, the items before are put first.
+ */
+static PyObject*
+_put_many_streaming(Queue *self, PyObject *items, bool block, double timeout)
+{
+    PyObject *sequence = NULL;
+    PyObject *iterator = NULL;
+
+    bool is_sequence = PyList_Check(items) or PyTuple_Check(items);
+    if (not is_sequence and self->maxweight != 0 and (not block or timeout > 0)) {
+        PyErr_Format(PyExc_ValueError,
+                "put_many(atomic=False) with block=False or a timeout needs a list or tuple "
+                "on a queue with maxweight");
+        return NULL;
+    }
+
+    /* A tuple can't change while the lock is released */
+    if (is_sequence or self->maxweight != 0) {
+        if ((sequence = PySequence_Tuple(items)) == NULL) {
+            return NULL;
+        }
+    }
+    else if ((iterator = PyObject_GetIter(items)) == NULL) {
+        return NULL;
+    }
+
+    /* Owned references of the items pulled from the iterator */
+    std::vector<PyObject*> chunk;
+    std::vector<std::uint64_t> weights;
+    PyObject **src = NULL;
+    size_t src_len = 0;
+    size_t pos = 0;
+    size_t queued = 0;
+    size_t reserved = 0;
+    bool failed = false;
+    /* Only bounded queues which block can run out of room */
+    bool reserve = self->overflow == OVERFLOW_BLOCK and self->maxsize != 0;
+    /* An error of the iterator is raised after the items before it are put */
+    PyObject *exc_type = NULL, *exc_value = NULL, *exc_tb = NULL;
+
+    BEGIN_SAFE_CALL
+
+    std::uint64_t timeout_millis = static_cast<std::uint64_t>(timeout*1000);
+    auto deadline = std::chrono::steady_clock::now();
+    deadline += std::chrono::milliseconds(timeout_millis);
+
+    if (sequence) {
+        src = PySequence_Fast_ITEMS(sequence);
+        src_len = PyTuple_GET_SIZE(sequence);
+        failed = _item_weights(self, src, src_len, weights) == -1;
+    }
+
+    auto time_left = [&](bool &may_block, double &remaining) {
+        may_block = block;
+        remaining = 0;
+        if (block and timeout > 0) {
+            std::chrono::duration<double> left = deadline - std::chrono::steady_clock::now();
+            remaining = left.count();
+            /* Still put what fits right now */
+            if (remaining <= 0) {
+                may_block = false;
+            }
+        }
+    };
+
+    while (not failed) {
+        bool may_block;
+        double remaining;
+
+        if (pos == src_len) {
+            if (iterator == NULL or exc_type) {
+                break;
+            }
+
+            for (PyObject *item: chunk) {
+                Py_DECREF(item);
+            }
+            chunk.clear();
+            pos = 0;
+
+            size_t chunk_size = PUT_MANY_CHUNK_SIZE;
+            if (reserve) {
+                time_left(may_block, remaining);
+                if ((reserved = _reserve_slots(self, may_block, remaining, chunk_size)) == 0) {
+                    if (PyErr_ExceptionMatches(FullError)) {
+                        PyErr_Clear();
+                    }
+                    else {
+                        failed = true;
+                    }
+                    break;
+                }
+                chunk_size = reserved;
+            }
+
+            PyObject *item;
+            while (chunk.size() < chunk_size and (item = PyIter_Next(iterator))) {
+                chunk.push_back(item);
+            }
+            src = chunk.data();
+            src_len = chunk.size();
+
+            if (PyErr_Occurred()) {
+                PyErr_Fetch(&exc_type, &exc_value, &exc_tb);
+            }
+
+            if (src_len == 0 or _item_weights(self, src, src_len, weights) == -1) {
+                failed = src_len != 0;
+                if (reserved) {
+                    _release_slots(self, reserved);
+                }
+                break;
+            }
+        }
+
+        time_left(may_block, remaining);
+        size_t nb_put = 0;
+        PyObject *ret = _internal_put_items(
+                self,
+                src + pos,
+                self->weighted ? weights.data() + pos : NULL,
+                src_len - pos,
+                may_block,
+                remaining,
+                NULL,
+                &nb_put,
+                reserved);
+        /* The items pulled for reserved slots all fit */
+        reserved = 0;
+        if (ret == NULL) {
+            if (PyErr_ExceptionMatches(FullError)) {
+                PyErr_Clear();
+            }
+            else {
+                failed = true;
+            }
+            break;
+        }
+        Py_DECREF(ret);
+
+        pos += nb_put;
+        queued += nb_put;
+    }
+
+    for (PyObject *item: chunk) {
+        Py_DECREF(item);
+    }
+    Py_XDECREF(sequence);
+    Py_XDECREF(iterator);
+
+    if (exc_type) {
+        if (failed) {
+            Py_DECREF(exc_type);
+            Py_XDECREF(exc_value);
+            Py_XDECREF(exc_tb);
+        }
+        else {
+            PyErr_Restore(exc_type, exc_value, exc_tb);
+            failed = true;
+        }
+    }
+
+    if (failed) {
+        return NULL;
+    }
+    return PyLong_FromSize_t(queued);
+
+    END_SAFE_CALL("Error in put_many: %s", NULL)
+}
+
+static PyObject*
+Queue_put_many(Queue *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *items;
+
+    PyObject *py_block=NULL;
+    bool block=true;
+
+    PyObject *py_timeout=NULL;
+    double timeout = 0;
+
+    int atomic = 1;
+
+    PyObject *sequence=NULL;
+    Py_ssize_t items_len;
+    std::vector<std::uint64_t> weights;
+
+    if (not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "O|OOp:put",
+                                const_cast<char**>(queue_put_many_kwlist),
+                                &items,
+                                &py_block,
+                                &py_timeout,
+                                &atomic))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+
+    if (not atomic) {
+        return _put_many_streaming(self, items, block, timeout);
+    }
+
+    if ((items_len = PyObject_Length(items)) == -1) {
+        return NULL;
+    }
+
+    if (items_len == 0) {
+        Py_RETURN_NONE;
+    }
+
+    /* Can happen if items is a custom object overloading __len__ */
+    if (items_len < 0) {
+        return PyErr_Format(
+                PyExc_ValueError,
+                "len of items is smaller 0: %i",
+                items_len);
+    }
+
+    if (self->overflow == OVERFLOW_BLOCK and self->maxsize > 0
+            and static_cast<size_t>(items_len) > self->maxsize) {
+        return PyErr_Format(
+                    PyExc_ValueError,
+                    "items of size %i is bigger than maxsize: %i",
+                    items_len,
+                    self->maxsize);
+    }
+
+    /* The weights have to be known before we take the lock */
+    if ((sequence = PySequence_Fast(items, "items must be iterable")) == NULL) {
+        return NULL;
+    }
+    items_len = PySequence_Fast_GET_SIZE(sequence);
+    PyObject **src = PySequence_Fast_ITEMS(sequence);
+
+    BEGIN_SAFE_CALL
+
+    if (_item_weights(self, src, items_len, weights) == -1) {
+        Py_DECREF(sequence);
+        return NULL;
+    }
+
+    PyObject *ret = _internal_put_items(
+            self, src, self->weighted ? weights.data() : NULL, items_len, block, timeout);
+    Py_DECREF(sequence);
+    return ret;
+
+    END_SAFE_CALL("Error in put_many: %s", NULL)
+}
+
+template <typename B>
+static void
+_blocked_wait_empty(B* bridge, Lock& lock)
+{
+    QueueStats *stats = _stats_of(bridge);
+    BlockedTimer timer(stats ? &stats->blocked_empty : NULL);
+    AllowThreads raii_lock;
+    bridge->empty_cond.wait(lock);
+}
+
+template <typename B>
+static bool
+_timed_wait_empty(
+        B* bridge,
+        Lock& lock,
+        std::chrono::steady_clock::time_point timeout)
+{
+    QueueStats *stats = _stats_of(bridge);
+    std::cv_status ret;
+    {
+        BlockedTimer timer(stats ? &stats->blocked_empty : NULL);
+        AllowThreads raii_lock;
+        ret = bridge->empty_cond.wait_until(lock, timeout);
+    }
+    if (stats and ret == std::cv_status::timeout) {
+        stats->timeouts += 1;
+    }
+    return ret == std::cv_status::no_timeout;
+}
+
+template <typename T>
+static bool
+_wait_for_items(
+        T *self,
+        bool block,
+        double timeout,
+        Lock& lock,
+        long int items_len)
+{
+    std::uint64_t timeout_millis = static_cast<std::uint64_t>(timeout*1000);
+
+    if (_queued(self) >= static_cast<size_t>(items_len)) {
+        /* Fall through the end of method */
+    }
+    else if (not block) {
+        PyErr_Format(EmptyError, "Queue Empty");
+        return false;
+    }
+    else if (timeout > 0) {
+        auto abs_timeout = std::chrono::steady_clock::now();
+        abs_timeout += std::chrono::milliseconds(timeout_millis);
+        _spin_for_items(self, lock, items_len, abs_timeout);
+        while (_queued(self) < items_len) {
+            if (not _timed_wait_empty(self->bridge, lock, abs_timeout)) {
+                PyErr_Format(EmptyError, "Queue Empty");
+                return false;
+            }
+        }
+    }
+    else {
+        _spin_for_items(self, lock, items_len, std::chrono::steady_clock::time_point::max());
+        while (not (_queued(self) >= static_cast<size_t>(items_len))) {
+            _blocked_wait_empty(self->bridge, lock);
+        }
+    }
+    return true;
+}
+
+/* Spilled items which could not be unpickled are lost, they count as done
+ * for task_done()/join().
+ */
+static void
+_lose_spilled(Queue *self, size_t nb_of_items)
+{
+    Lock lock(self->bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock, _stats_of(self->bridge));
+    }
+
+    self->unfinished_tasks -= std::min<std::uint64_t>(nb_of_items, self->unfinished_tasks);
+    if (self->unfinished_tasks == 0) {
+        self->bridge->all_tasks_done_cond.notify_all();
+    }
+}
+
+/* Finishes _pop_item after the lock is released */
+static PyObject*
+_popped_item(Queue *self, PyObject *item, SpillRecords &records)
+{
+    if (item != NULL) {
+        return item;
+    }
+
+    item = _load_spilled(records[0].data(), records[0].size());
+    if (item == NULL) {
+        _lose_spilled(self, 1);
+    }
+    return item;
+}
+
+/* Finishes _pop_items after the lock is released, it steals the items.
+ * The error of a record which can't be unpickled is raised if no item is
+ * left, else it goes to sys.unraisablehook and the other items are still
+ * returned.
+ */
+static PyObject*
+_popped_tuple(Queue *self, std::vector<PyObject*> &items, SpillRecords &records)
+{
+    size_t lost = 0;
+    PyObject *exc_type = NULL, *exc_value = NULL, *exc_tb = NULL;
+    for (std::string &record: records) {
+        PyObject *item = _load_spilled(record.data(), record.size());
+        if (item != NULL) {
+            items.push_back(item);
+            continue;
+        }
+
+        lost++;
+        if (exc_type == NULL) {
+            PyErr_Fetch(&exc_type, &exc_value, &exc_tb);
+        }
+        else {
+            PyErr_WriteUnraisable(reinterpret_cast<PyObject*>(self));
+        }
+    }
+
+    if (lost) {
+        _lose_spilled(self, lost);
+    }
+    if (exc_type) {
+        PyErr_Restore(exc_type, exc_value, exc_tb);
+        if (items.empty()) {
+            return NULL;
+        }
+        PyErr_WriteUnraisable(reinterpret_cast<PyObject*>(self));
+    }
+
+    PyObject *result_tuple = PyTuple_New(items.size());
+    if (result_tuple == NULL) {
+        for (PyObject *item: items) {
+            Py_DECREF(item);
+        }
+        return NULL;
+    }
+
+    for (size_t i=0; i<items.size(); i++) {
+        PyTuple_SET_ITEM(result_tuple, i, items[i]);
+    }
+    return result_tuple;
+}
+
+static PyObject*
+_internal_get(Queue *self, bool block, double timeout)
+{
+    PyObject *item;
+    SpillRecords records;
+
+    BEGIN_SAFE_CALL
+
+    {
+        Lock lock(self->bridge->mutex, std::try_to_lock);
+        if (not lock.owns_lock()) {
+            _wait_for_lock(lock, _stats_of(self->bridge));
+        }
+
+        if (not _wait_for_items(self, block, timeout, lock, 1)) {
+            return NULL;
+        }
+
+        item = _pop_item(self, records);
+        _count_get(self, 1);
+        _update_notifiers(self);
+        self->bridge->full_cond.notify_one();
+    }
+    return _popped_item(self, item, records);
+
+    END_SAFE_CALL("Error in get: %s", NULL)
+}
+
+static PyObject*
+Queue_get(Queue *self, PyObject *args, PyObject *kwargs)
+{
+
+    PyObject *py_block=NULL;
+    PyObject *py_timeout=NULL;
+
+    bool block=true;
+    double timeout = 0;
+    
+    if(not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "|OO:get",
+                                const_cast<char**>(get_kwlist),
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+    return _internal_get(self, block, timeout);
+}
+
+static PyObject*
+Queue_get_many(Queue *self, PyObject *args, PyObject *kwargs)
+{
+
+    PyObject *py_block=NULL;
+    PyObject *py_timeout=NULL;
+
+    bool block=true;
+    double timeout = 0;
+    long int items=0;
+
+    if(not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "l|OO:get",
+                                const_cast<char**>(get_many_kwlist),
+                                &items,
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+
+    if (items == 0) {
+        return PyTuple_New(0);
+    }
+
+    if (items < 0) {
+        return PyErr_Format(
+                PyExc_ValueError,
+                "items must be greater or equal 0 but it is: %ld",
+                items);
+    }
+
+
+    if (self->maxsize > 0 and static_cast<size_t>(items) > self->maxsize) {
+        return PyErr_Format(
+                PyExc_ValueError,
+                "you want to get %ld but maxsize is %i",
+                items,
+                self->maxsize);
+    }
+
+    std::vector<PyObject*> popped;
+    SpillRecords records;
+
+    BEGIN_SAFE_CALL
+
+    {
+        Lock lock(self->bridge->mutex, std::try_to_lock);
+        if (not lock.owns_lock()) {
+            _wait_for_lock(lock, _stats_of(self->bridge));
+        }
+
+        if (not _wait_for_items(self, block, timeout, lock, items)) {
+            return NULL;
+        }
+
+        _pop_items(self, items, popped, records);
+        _count_get(self, items);
+        _update_notifiers(self);
+        self->bridge->full_cond.notify_all();
+    }
+    return _popped_tuple(self, popped, records);
+
+
+    END_SAFE_CALL("Error in get_many: %s", NULL)
+}
+
+/* Like _wait_for_items, but a timeout is not an error */
+template <typename T>
+static void
+_wait_for_min_items(
+        T *self,
+        bool block,
+        double timeout,
+        Lock& lock,
+        size_t min_items)
+{
+    std::uint64_t timeout_millis = static_cast<std::uint64_t>(timeout*1000);
+
+    if (_queued(self) >= min_items or not block) {
+        /* Fall through the end of method */
+    }
+    else if (timeout > 0) {
+        auto abs_timeout = std::chrono::steady_clock::now();
+        abs_timeout += std::chrono::milliseconds(timeout_millis);
+        _spin_for_items(self, lock, min_items, abs_timeout);
+        while (_queued(self) < min_items) {
+            if (not _timed_wait_empty(self->bridge, lock, abs_timeout)) {
+                break;
+            }
+        }
+    }
+    else {
+        _spin_for_items(self, lock, min_items, std::chrono::steady_clock::time_point::max());
+        while (_queued(self) < min_items) {
+            _blocked_wait_empty(self->bridge, lock);
+        }
+    }
+}
+
+static PyObject*
+Queue_get_up_to(Queue *self, PyObject *args, PyObject *kwargs)
+{
+
+    PyObject *py_block=NULL;
+    PyObject *py_timeout=NULL;
+
+    bool block=true;
+    double timeout = 0;
+    long int max_items=0;
+    long int min_items=1;
+
+    if(not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "l|OOl:get_up_to",
+                                const_cast<char**>(get_up_to_kwlist),
+                                &max_items,
+                                &py_block,
+                                &py_timeout,
+                                &min_items))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+
+    if (max_items < 0 or min_items < 0) {
+        return PyErr_Format(
+                PyExc_ValueError,
+                "max_items and min_items must be greater or equal 0");
+    }
+
+    if (min_items > max_items) {
+        return PyErr_Format(
+                PyExc_ValueError,
+                "min_items %ld is bigger than max_items %ld",
+                min_items,
+                max_items);
+    }
+
+    if (self->maxsize > 0 and static_cast<size_t>(min_items) > self->maxsize) {
+        return PyErr_Format(
+                PyExc_ValueError,
+                "you want to get at least %ld but maxsize is %i",
+                min_items,
+                self->maxsize);
+    }
+
+    if (max_items == 0) {
+        return PyTuple_New(0);
+    }
+
+    std::vector<PyObject*> popped;
+    SpillRecords records;
+
+    BEGIN_SAFE_CALL
+
+    {
+        Lock lock(self->bridge->mutex, std::try_to_lock);
+        if (not lock.owns_lock()) {
+            _wait_for_lock(lock, _stats_of(self->bridge));
+        }
+
+        _wait_for_min_items(self, block, timeout, lock, static_cast<size_t>(min_items));
+
+        size_t items = std::min(_queued(self), static_cast<size_t>(max_items));
+        _pop_items(self, items, popped, records);
+        _count_get(self, items);
+        if (items > 0) {
+            _update_notifiers(self);
+            self->bridge->full_cond.notify_all();
+        }
+    }
+    return _popped_tuple(self, popped, records);
+
+    END_SAFE_CALL("Error in get_up_to: %s", NULL)
+}
+
+static PyObject*
+Queue_qsize(Queue *self)
+{
+    return PyLong_FromSize_t(_queued(self));
+}
+
+static PyObject*
+Queue_empty(Queue *self)
+{
+    if (_queued(self) == 0) {
+        Py_RETURN_TRUE;
+    }
+    Py_RETURN_FALSE;
+}
+
+static PyObject*
+Queue_full(Queue *self)
+{
+    if (self->maxweight > 0 and self->bridge->weight >= self->maxweight) {
+        Py_RETURN_TRUE;
+    }
+
+    if (self->maxsize == 0) {
+        Py_RETURN_FALSE;
+    }
+
+    if (_queued(self) < self->maxsize) {
+        Py_RETURN_FALSE;
+    }
+    Py_RETURN_TRUE;
+}
+
+static PyObject*
+Queue_put_nowait(Queue *self, PyObject *item)
+{
+    return _internal_put(self, item, false, 0);
+}
+
+static PyObject*
+Queue_get_nowait(Queue *self)
+{
+    return _internal_get(self, false, 0);
+}
+
+/* try_get(default=None) and try_put(item) are get_nowait/put_nowait for
+ * polling loops: a miss returns default/False instead of raising Empty/Full,
+ * so no exception is created. Positional arguments only (METH_FASTCALL).
+ */
+static PyObject*
+Queue_try_get(Queue *self, PyObject *const *args, Py_ssize_t nargs)
+{
+    if (nargs > 1) {
+        return PyErr_Format(
+                PyExc_TypeError,
+                "try_get expected at most 1 argument, got %zd",
+                nargs);
+    }
+    PyObject *default_value = nargs ? args[0] : Py_None;
+
+    Bridge *bridge = self->bridge;
+
+    /* An empty queue is answered without taking the lock */
+    if (bridge->size.load(std::memory_order_acquire) == 0) {
+        Py_INCREF(default_value);
+        return default_value;
+    }
+
+    PyObject *item;
+    SpillRecords records;
+
+    BEGIN_SAFE_CALL
+
+    {
+        Lock lock(bridge->mutex, std::try_to_lock);
+        if (not lock.owns_lock()) {
+            _wait_for_lock(lock, _stats_of(bridge));
+        }
+
+        if (_queued(self) == 0) {
+            Py_INCREF(default_value);
+            return default_value;
+        }
+
+        item = _pop_item(self, records);
+        _count_get(self, 1);
+        _update_notifiers(self);
+        bridge->full_cond.notify_one();
+    }
+    return _popped_item(self, item, records);
+
+    END_SAFE_CALL("Error in try_get: %s", NULL)
+}
+
+static PyObject*
+Queue_try_put(Queue *self, PyObject *const *args, Py_ssize_t nargs)
+{
+    if (nargs != 1) {
+        return PyErr_Format(
+                PyExc_TypeError,
+                "try_put expected 1 argument, got %zd",
+                nargs);
+    }
+    PyObject *item = args[0];
+
+    std::uint64_t weight;
+    if (_item_weight(self, item, weight) == -1) {
+        return NULL;
+    }
+
+    bool rejected = false;
+    PyObject *ret = _internal_put_items(
+            self, &item, self->weighted ? &weight : NULL, 1, false, 0, &rejected);
+    if (ret == NULL) {
+        return NULL;
+    }
+    Py_DECREF(ret);
+    return PyBool_FromLong(not rejected);
+}
+
+/* get_matching(key, block=True, timeout=None, attr=None, index=None)
+ *
+ * Removes and returns the first queued item matching key, the items before
+ * it keep their place. With attr getattr(item, attr) == key is compared,
+ * with index item[index] == key, otherwise item == key. Items without the
+ * attribute resp. index don't match. getattr, __getitem__ and __eq__ run
+ * under the queue lock, they must not use the queue itself. No hash is
+ * computed, == of str, bytes and int keys runs no python code.
+ */
+static const char *get_matching_kwlist[] = {"key", "block", "timeout", "attr", "index", NULL};
+
+/* 1 if item matches, 0 if not, -1 on error */
+static int
+_item_matches(PyObject *item, PyObject *key, PyObject *attr, PyObject *index)
+{
+    PyObject *value;
+    if (attr) {
+        if ((value = PyObject_GetAttr(item, attr)) == NULL) {
+            if (PyErr_ExceptionMatches(PyExc_AttributeError)) {
+                PyErr_Clear();
+                return 0;
+            }
+            return -1;
+        }
+    }
+    else if (index) {
+        /* TypeError: e.g. a None sentinel between the tuples */
+        if ((value = PyObject_GetItem(item, index)) == NULL) {
+            if (PyErr_ExceptionMatches(PyExc_LookupError) or
+                    PyErr_ExceptionMatches(PyExc_TypeError)) {
+                PyErr_Clear();
+                return 0;
+            }
+            return -1;
+        }
+    }
+    else {
+        value = item;
+        Py_INCREF(value);
+    }
+
+    int ret = PyObject_RichCompareBool(value, key, Py_EQ);
+    Py_DECREF(value);
+    return ret;
+}
+
+/* Waits until items were put, returns how many (0 on timeout) */
+static std::uint64_t
+_wait_for_new_items(Bridge *bridge, Lock &lock, bool timed, std::chrono::steady_clock::time_point abs_timeout)
+{
+    std::uint64_t pushes = bridge->pushes;
+    bool expired = false;
+
+    bridge->match_waiters += 1;
+    {
+        AllowThreads raii_lock;
+        while (bridge->pushes == pushes and not expired) {
+            if (timed) {
+                expired = bridge->match_cond.wait_until(lock, abs_timeout) == std::cv_status::timeout;
+            }
+            else {
+                bridge->match_cond.wait(lock);
+            }
+        }
+    }
+    bridge->match_waiters -= 1;
+
+    return bridge->pushes - pushes;
+}
+
+static PyObject*
+Queue_get_matching(Queue *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *key;
+    PyObject *py_block=NULL;
+    PyObject *py_timeout=NULL;
+    PyObject *attr=NULL;
+    PyObject *index=NULL;
+
+    bool block=true;
+    double timeout = 0;
+
+    if(not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "O|OOOO:get_matching",
+                                const_cast<char**>(get_matching_kwlist),
+                                &key,
+                                &py_block,
+                                &py_timeout,
+                                &attr,
+                                &index))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+
+    if (attr == Py_None) {
+        attr = NULL;
+    }
+    if (index == Py_None) {
+        index = NULL;
+    }
+
+    if (attr != NULL and not PyUnicode_Check(attr)) {
+        return PyErr_Format(PyExc_TypeError, "attr must be a string");
+    }
+
+    if (attr != NULL and index != NULL) {
+        return PyErr_Format(PyExc_ValueError, "attr and index can't be combined");
+    }
+
+    if (self->bridge->spill) {
+        return PyErr_Format(PyExc_NotImplementedError, "get_matching is not supported with spill_dir");
+    }
+
+    BEGIN_SAFE_CALL
+
+    Bridge *bridge = self->bridge;
+    Lock lock(bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock, _stats_of(bridge));
+    }
+
+    std::uint64_t timeout_millis = static_cast<std::uint64_t>(timeout*1000);
+    auto abs_timeout = std::chrono::steady_clock::now();
+    abs_timeout += std::chrono::milliseconds(timeout_millis);
+
+    /* After a wakeup only the new items at the end need to be compared */
+    size_t start = 0;
+    size_t found;
+    while (true) {
+        std::deque<PyObject*> &queue = bridge->queue;
+        for (found=start; found<queue.size(); found++) {
+            int ret = _item_matches(queue[found], key, attr, index);
+            if (ret == -1) {
+                return NULL;
+            }
+            if (ret == 1) {
+                break;
+            }
+        }
+
+        if (found < queue.size()) {
+            break;
+        }
+
+        if (not block) {
+            PyErr_Format(EmptyError, "Queue Empty");
+            return NULL;
+        }
+
+        std::uint64_t new_items = _wait_for_new_items(bridge, lock, timeout > 0, abs_timeout);
+        if (new_items == 0) {
+            PyErr_Format(EmptyError, "Queue Empty");
+            return NULL;
+        }
+        start = queue.size() - std::min<std::uint64_t>(queue.size(), new_items);
+    }
+
+    PyObject *item = bridge->queue[found];
+    bridge->queue.erase(bridge->queue.begin() + found);
+    if (self->weighted) {
+        bridge->weight -= bridge->weights[found];
+        bridge->weights.erase(bridge->weights.begin() + found);
+    }
+    bridge->size.store(_queued(self), std::memory_order_release);
+
+    _count_get(self, 1);
+    _update_notifiers(self);
+    bridge->full_cond.notify_one();
+    return item;
+
+    END_SAFE_CALL("Error in get_matching: %s", NULL)
+}
+
+/* drain() empties the queue with one lock and returns the items as a list.
+ * Without spilled items the deque is swapped out, the list is built after
+ * the lock is released.
+ */
+static PyObject*
+Queue_drain(Queue *self)
+{
+    std::deque<PyObject*> items;
+    std::vector<PyObject*> popped;
+    SpillRecords records;
+    bool spilled = false;
+
+    BEGIN_SAFE_CALL
+
+    {
+        Bridge *bridge = self->bridge;
+        Lock lock(bridge->mutex, std::try_to_lock);
+        if (not lock.owns_lock()) {
+            _wait_for_lock(lock, _stats_of(bridge));
+        }
+
+        size_t nb_of_items = _queued(self);
+        if (nb_of_items == 0) {
+            return PyList_New(0);
+        }
+
+        if (bridge->spill and bridge->spill->count) {
+            _pop_items(self, nb_of_items, popped, records);
+            spilled = true;
+        }
+        else {
+            items.swap(bridge->queue);
+            bridge->weights.clear();
+            bridge->weight = 0;
+            bridge->size.store(0, std::memory_order_release);
+        }
+
+        _count_get(self, nb_of_items);
+        _update_notifiers(self);
+        bridge->full_cond.notify_all();
+    }
+
+    if (spilled) {
+        PyObject *result_tuple = _popped_tuple(self, popped, records);
+        if (result_tuple == NULL) {
+            return NULL;
+        }
+        PyObject *result = PySequence_List(result_tuple);
+        Py_DECREF(result_tuple);
+        return result;
+    }
+
+    /* The list steals the references of the queue */
+    PyObject *result = PyList_New(items.size());
+    if (result == NULL) {
+        for (PyObject *item: items) {
+            Py_DECREF(item);
+        }
+        return NULL;
+    }
+
+    Py_ssize_t i = 0;
+    for (PyObject *item: items) {
+        PyList_SET_ITEM(result, i++, item);
+    }
+    return result;
+
+    END_SAFE_CALL("Error in drain: %s", NULL)
+}
+
+/* snapshot() returns a list of the queued items without removing them.
+ * Spilled items are unpickled after the lock is released, so they are
+ * copies.
+ */
+static PyObject*
+Queue_snapshot(Queue *self)
+{
+    std::vector<PyObject*> items;
+    SpillRecords records;
+
+    BEGIN_SAFE_CALL
+
+    {
+        Bridge *bridge = self->bridge;
+        Lock lock(bridge->mutex, std::try_to_lock);
+        if (not lock.owns_lock()) {
+            _wait_for_lock(lock, _stats_of(bridge));
+        }
+
+        items.assign(bridge->queue.begin(), bridge->queue.end());
+        for (PyObject *item: items) {
+            Py_INCREF(item);
+        }
+
+        if (bridge->spill) {
+            records.reserve(bridge->spill->count);
+            bridge->spill->for_each([&records](const char *data, std::uint64_t len) {
+                records.emplace_back(data, len);
+                return true;
+            });
+        }
+    }
+
+    PyObject *result = PyList_New(items.size() + records.size());
+    if (result != NULL) {
+        for (size_t i=0; i<items.size(); i++) {
+            PyList_SET_ITEM(result, i, items[i]);
+        }
+        items.clear();
+
+        size_t i = PyList_GET_SIZE(result) - records.size();
+        for (std::string &record: records) {
+            PyObject *item = _load_spilled(record.data(), record.size());
+            /* The slots which weren't filled are NULL, which the list tolerates */
+            if (item == NULL) {
+                Py_CLEAR(result);
+                break;
+            }
+            PyList_SET_ITEM(result, i++, item);
+        }
+    }
+
+    for (PyObject *item: items) {
+        Py_DECREF(item);
+    }
+    return result;
+
+    END_SAFE_CALL("Error in snapshot: %s", NULL)
+}
+
+/* task_done(n=1), one call (and one lock) for a whole batch */
+static int
+_parse_task_done_args(PyObject *args, PyObject *kwargs, std::uint64_t &nb_of_tasks)
+{
+    Py_ssize_t n = 1;
+    if (not PyArg_ParseTupleAndKeywords(
+                args,
+                kwargs,
+                "|n:task_done",
+                const_cast<char**>(task_done_kwlist),
+                &n))
+    {
+        return -1;
+    }
+
+    if (n < 0) {
+        PyErr_Format(PyExc_ValueError, "n must be greater or equal 0 but it is: %zd", n);
+        return -1;
+    }
+    nb_of_tasks = n;
+    return 0;
+}
+
+/* join(timeout=None) */
+static int
+_parse_join_args(PyObject *args, PyObject *kwargs, bool &block, double &timeout)
+{
+    PyObject *py_timeout=NULL;
+    if (not PyArg_ParseTupleAndKeywords(
+                args,
+                kwargs,
+                "|O:join",
+                const_cast<char**>(join_kwlist),
+                &py_timeout))
+    {
+        return -1;
+    }
+    return _parse_block_and_timeout(NULL, py_timeout, block, timeout);
+}
+
+template <typename T>
+static PyObject*
+_internal_task_done(T *self, std::uint64_t nb_of_tasks)
+{
+    BEGIN_SAFE_CALL
+
+    Lock lock(self->bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock, _stats_of(self->bridge));
+    }
+
+    if (self->unfinished_tasks < nb_of_tasks) {
+        return PyErr_Format(
+                    PyExc_ValueError, "task_done() called too many times");
+    }
+
+    self->unfinished_tasks -= nb_of_tasks;
+    if (nb_of_tasks > 0 and self->unfinished_tasks == 0) {
+        self->bridge->all_tasks_done_cond.notify_all();
+    }
+
+    END_SAFE_CALL("Error in task_done: %s", NULL)
+    Py_RETURN_NONE;
+}
+
+static PyObject*
+Queue_task_done(Queue *self, PyObject *args, PyObject *kwargs)
+{
+    std::uint64_t nb_of_tasks;
+    if (_parse_task_done_args(args, kwargs, nb_of_tasks) == -1) {
+        return NULL;
+    }
+    return _internal_task_done(self, nb_of_tasks);
+}
+
+/* SPSCQueue and ShardedQueue count their tasks atomically */
+template <typename T>
+static inline std::uint64_t
+_unfinished_tasks(T* self)
+{
+    return self->unfinished_tasks;
+}
+
+template <typename T>
+static void
+_blocked_wait_all_tasks_done(T* self, Lock& lock)
+{
+    AllowThreads raii_lock;
+    self->bridge->all_tasks_done_cond.wait(lock);
+}
+
+template <typename T>
+static bool
+_timed_wait_all_tasks_done(
+        T* self,
+        Lock& lock,
+        std::chrono::steady_clock::time_point timeout)
+{
+    AllowThreads raii_lock;
+    return self->bridge->all_tasks_done_cond.wait_until(lock, timeout) == std::cv_status::no_timeout;
+}
+
+/* Returns True if all tasks are done, False if the timeout expired first */
+template <typename T>
+static PyObject*
+_internal_join(T* self, bool block, double timeout)
+{
+    BEGIN_SAFE_CALL
+
+    std::uint64_t timeout_millis = static_cast<std::uint64_t>(timeout*1000);
+
+    Lock lock(self->bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock, _stats_of(self->bridge));
+    }
+
+    if (not block) {
+        /* Fall through the end of method */
+    }
+    else if (timeout > 0) {
+        auto abs_timeout = std::chrono::steady_clock::now();
+        abs_timeout += std::chrono::milliseconds(timeout_millis);
+        while (_unfinished_tasks(self)) {
+            if (not _timed_wait_all_tasks_done(self, lock, abs_timeout)) {
+                break;
+            }
+        }
+    }
+    else {
+        while (_unfinished_tasks(self)) {
+            _blocked_wait_all_tasks_done(self, lock);
+        }
+    }
+
+    if (_unfinished_tasks(self)) {
+        Py_RETURN_FALSE;
+    }
+
+    END_SAFE_CALL("Error in join: %s", NULL)
+    Py_RETURN_TRUE;
+}
+
+static PyObject*
+Queue_join(Queue* self, PyObject *args, PyObject *kwargs)
+{
+    bool block=true;
+    double timeout=0;
+    if (_parse_join_args(args, kwargs, block, timeout) == -1) {
+        return NULL;
+    }
+    return _internal_join(self, block, timeout);
+}
+
+static Notifier*
+_create_notifier(Queue *self, Notifier *&notifier)
+{
+    Lock lock(self->bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock, _stats_of(self->bridge));
+    }
+
+    if (notifier == NULL) {
+        Notifier *created = new Notifier();
+        if (not created->open()) {
+            delete created;
+            PyErr_SetFromErrno(PyExc_OSError);
+            return NULL;
+        }
+        notifier = created;
+        _update_notifiers(self);
+    }
+    return notifier;
+}
+
+/* fd which is readable while the queue is not empty, for select/poll/epoll.
+ * It is only created on the first call, get() and put() don't touch it
+ * before. Never read from it, the queue drains it when it gets empty.
+ */
+static PyObject*
+Queue_fileno(Queue *self)
+{
+    BEGIN_SAFE_CALL
+
+    Notifier *notifier = _create_notifier(self, self->bridge->readable);
+    if (notifier == NULL) {
+        return NULL;
+    }
+    return PyLong_FromLong(notifier->fileno());
+
+    END_SAFE_CALL("Error in fileno: %s", NULL)
+}
+
+/* fd which is readable while the queue is not full */
+static PyObject*
+Queue__writable_fd(Queue *self)
+{
+    BEGIN_SAFE_CALL
+
+    Notifier *notifier = _create_notifier(self, self->bridge->writable);
+    if (notifier == NULL) {
+        return NULL;
+    }
+    return PyLong_FromLong(notifier->fileno());
+
+    END_SAFE_CALL("Error in _writable_fd: %s", NULL)
+}
+
+static QueueStats*
+_check_stats(Queue *self)
+{
+    QueueStats *stats = _stats_of(self->bridge);
+    if (stats == NULL) {
+        PyErr_Format(PyExc_ValueError, "stats are not enabled, use Queue(stats=True)");
+    }
+    return stats;
+}
+
+static inline double
+_seconds(std::chrono::steady_clock::duration duration)
+{
+    return std::chrono::duration<double>(duration).count();
+}
+
+static PyObject*
+Queue_stats(Queue *self)
+{
+    BEGIN_SAFE_CALL
+
+    if (_check_stats(self) == NULL) {
+        return NULL;
+    }
+
+    Lock lock(self->bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock);
+    }
+
+    /* Copy, building the dict must not happen under the lock */
+    QueueStats stats = *self->bridge->stats;
+    lock.unlock();
+
+    return Py_BuildValue(
+            "{sKsKsKsKsKsKsKsKsdsdsKsdsdsKsK}",
+            "puts", stats.puts,
+            "items_put", stats.items_put,
+            "max_put_batch", stats.max_put_batch,
+            "gets", stats.gets,
+            "items_got", stats.items_got,
+            "max_get_batch", stats.max_get_batch,
+            "lock_contended", stats.lock_contended,
+            "blocked_empty", stats.blocked_empty.count,
+            "blocked_empty_time", _seconds(stats.blocked_empty.total),
+            "blocked_empty_max", _seconds(stats.blocked_empty.longest),
+            "blocked_full", stats.blocked_full.count,
+            "blocked_full_time", _seconds(stats.blocked_full.total),
+            "blocked_full_max", _seconds(stats.blocked_full.longest),
+            "high_watermark", stats.high_watermark,
+            "timeouts", stats.timeouts);
+
+    END_SAFE_CALL("Error in stats: %s", NULL)
+}
+
+static PyObject*
+Queue_reset_stats(Queue *self)
+{
+    BEGIN_SAFE_CALL
+
+    if (_check_stats(self) == NULL) {
+        return NULL;
+    }
+
+    Lock lock(self->bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock);
+    }
+
+    *self->bridge->stats = QueueStats();
+
+    END_SAFE_CALL("Error in reset_stats: %s", NULL)
+    Py_RETURN_NONE;
+}
+
+static PyMethodDef Queue_methods[] = {
+    {"put", (PyCFunction)Queue_put, METH_VARARGS|METH_KEYWORDS, ""},
+    {"get", (PyCFunction)Queue_get, METH_VARARGS|METH_KEYWORDS, ""},
+    {"qsize", (PyCFunction)Queue_qsize, METH_NOARGS, ""},
+    {"empty", (PyCFunction)Queue_empty, METH_NOARGS, ""},
+    {"full", (PyCFunction)Queue_full, METH_NOARGS, ""},
+    {"put_nowait", (PyCFunction)Queue_put_nowait, METH_O, ""},
+    {"get_nowait", (PyCFunction)Queue_get_nowait, METH_NOARGS, ""},
+    {"try_get", (PyCFunction)(void(*)(void))Queue_try_get, METH_FASTCALL, ""},
+    {"try_put", (PyCFunction)(void(*)(void))Queue_try_put, METH_FASTCALL, ""},
+    {"put_many", (PyCFunction)Queue_put_many, METH_VARARGS|METH_KEYWORDS, ""},
+    {"get_many", (PyCFunction)Queue_get_many, METH_VARARGS|METH_KEYWORDS, ""},
+    {"get_up_to", (PyCFunction)Queue_get_up_to, METH_VARARGS|METH_KEYWORDS, ""},
+    {"get_matching", (PyCFunction)Queue_get_matching, METH_VARARGS|METH_KEYWORDS, ""},
+    {"drain", (PyCFunction)Queue_drain, METH_NOARGS, ""},
+    {"snapshot", (PyCFunction)Queue_snapshot, METH_NOARGS, ""},
+    {"task_done", (PyCFunction)Queue_task_done, METH_VARARGS|METH_KEYWORDS, ""},
+    {"join", (PyCFunction)Queue_join, METH_VARARGS|METH_KEYWORDS, ""},
+    {"stats", (PyCFunction)Queue_stats, METH_NOARGS, ""},
+    {"reset_stats", (PyCFunction)Queue_reset_stats, METH_NOARGS, ""},
+    {"fileno", (PyCFunction)Queue_fileno, METH_NOARGS, ""},
+    {"_writable_fd", (PyCFunction)Queue__writable_fd, METH_NOARGS, ""},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyObject *
+Queue_maxsize_get(Queue *self, void *closure)
+{
+    return PyLong_FromSize_t(self->maxsize);
+}
+
+static PyObject *
+Queue_maxweight_get(Queue *self, void *closure)
+{
+    return PyLong_FromUnsignedLongLong(self->maxweight);
+}
+
+static PyObject *
+Queue_weight_get(Queue *self, void *closure)
+{
+    return PyLong_FromUnsignedLongLong(self->bridge->weight);
+}
+
+static PyObject *
+Queue_dropped_get(Queue *self, void *closure)
+{
+    return PyLong_FromUnsignedLongLong(self->bridge->dropped);
+}
+
+static PyObject *
+Queue_spilled_get(Queue *self, void *closure)
+{
+    Spill *spill = self->bridge->spill;
+    return PyLong_FromSize_t(spill ? spill->count : 0);
+}
+
+static PyObject *
+Queue_acyclic_get(Queue *self, void *closure)
+{
+    return PyBool_FromLong(self->acyclic);
+}
+
+static PyGetSetDef Queue_getsets[] = {
+    {const_cast<char*>("maxsize"), (getter)Queue_maxsize_get, NULL, const_cast<char*>(""), NULL},
+    {const_cast<char*>("maxweight"), (getter)Queue_maxweight_get, NULL, const_cast<char*>(""), NULL},
+    {const_cast<char*>("weight"), (getter)Queue_weight_get, NULL, const_cast<char*>(""), NULL},
+    {const_cast<char*>("dropped"), (getter)Queue_dropped_get, NULL, const_cast<char*>(""), NULL},
+    {const_cast<char*>("spilled"), (getter)Queue_spilled_get, NULL, const_cast<char*>(""), NULL},
+    {const_cast<char*>("acyclic"), (getter)Queue_acyclic_get, NULL, const_cast<char*>(""), NULL},
+    {NULL, NULL, NULL, NULL, NULL}
+};
+
+static PyTypeObject QueueType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "ax_utils.ax_queue.Queue", /*tp_name*/
+    sizeof(Queue),             /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)Queue_dealloc, /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC,/*tp_flags*/
+    "",                        /* tp_doc */
+    (traverseproc)Queue_traverse,   /* tp_traverse */
+    (inquiry)Queue_clear,           /* tp_clear */
+    0,                         /* tp_richcompare */
+    0,                         /* tp_weaklistoffset */
+    0,                         /* tp_iter */
+    0,                         /* tp_iternext */
+    Queue_methods,             /* tp_methods */
+    0,                         /* tp_members */
+    Queue_getsets,             /* tp_getset */
+    0,                         /* tp_base */
+    0,                         /* tp_dict */
+    0,                         /* tp_descr_get */
+    0,                         /* tp_descr_set */
+    0,                         /* tp_dictoffset */
+    (initproc)Queue_init,      /* tp_init */
+    0,                         /* tp_alloc */
+    Queue_new,                 /* tp_new */
+};
+
+/* wait_any(queues, timeout=None): blocks until one of the AXQueues has an
+ * item and returns (index, item). The queues are tried in order, so the
+ * first one with an item wins.
+ *
+ * While waiting an AnyWaiter is registered with every queue. A queue
+ * without registered waiters only pays an empty() check in
+ * _update_notifiers.
+ */
+static const char *wait_any_kwlist[] = {"queues", "timeout", NULL};
+
+static void
+_unregister_any_waiter(std::vector<Queue*> &queues, AnyWaiter *waiter)
+{
+    for (Queue *queue: queues) {
+        Bridge *bridge = queue->bridge;
+        Lock lock(bridge->mutex, std::try_to_lock);
+        if (not lock.owns_lock()) {
+            _wait_for_lock(lock, _stats_of(bridge));
+        }
+
+        std::vector<AnyWaiter*> &waiters = bridge->any_waiters;
+        waiters.erase(std::remove(waiters.begin(), waiters.end(), waiter), waiters.end());
+    }
+}
+
+/* Returns false (and registers nothing) if one of the queues has items */
+static bool
+_register_any_waiter(std::vector<Queue*> &queues, AnyWaiter *waiter)
+{
+    for (size_t i=0; i<queues.size(); i++) {
+        Bridge *bridge = queues[i]->bridge;
+        Lock lock(bridge->mutex, std::try_to_lock);
+        if (not lock.owns_lock()) {
+            _wait_for_lock(lock, _stats_of(bridge));
+        }
+
+        if (_queued(queues[i]) != 0) {
+            lock.unlock();
+            std::vector<Queue*> registered(queues.begin(), queues.begin() + i);
+            _unregister_any_waiter(registered, waiter);
+            return false;
+        }
+        bridge->any_waiters.push_back(waiter);
+    }
+    return true;
+}
+
+static PyObject*
+_internal_wait_any(std::vector<Queue*> &queues, bool block, double timeout)
+{
+    std::uint64_t timeout_millis = static_cast<std::uint64_t>(timeout*1000);
+    auto abs_timeout = std::chrono::steady_clock::time_point::max();
+    if (block and timeout > 0) {
+        abs_timeout = std::chrono::steady_clock::now() + std::chrono::milliseconds(timeout_millis);
+    }
+
+    BEGIN_SAFE_CALL
+
+    AnyWaiter waiter;
+    while (true) {
+        for (size_t i=0; i<queues.size(); i++) {
+            PyObject *item = _internal_get(queues[i], false, 0);
+            if (item != NULL) {
+                return Py_BuildValue("(nN)", static_cast<Py_ssize_t>(i), item);
+            }
+
+            if (not PyErr_ExceptionMatches(EmptyError)) {
+                return NULL;
+            }
+            PyErr_Clear();
+        }
+
+        if (not block or std::chrono::steady_clock::now() >= abs_timeout) {
+            PyErr_Format(EmptyError, "Queue Empty");
+            return NULL;
+        }
+
+        waiter.signaled = false;
+        if (not _register_any_waiter(queues, &waiter)) {
+            continue;
+        }
+
+        {
+            /* The GIL has to be taken after waiter.mutex is released,
+             * put() holds the GIL while it signals the waiter.
+             */
+            AllowThreads raii_lock;
+            std::unique_lock<std::mutex> lock(waiter.mutex);
+            if (abs_timeout == std::chrono::steady_clock::time_point::max()) {
+                waiter.cond.wait(lock, [&waiter]() { return waiter.signaled; });
+            }
+            else {
+                waiter.cond.wait_until(lock, abs_timeout, [&waiter]() { return waiter.signaled; });
+            }
+        }
+
+        _unregister_any_waiter(queues, &waiter);
+    }
+
+    END_SAFE_CALL("Error in wait_any: %s", NULL)
+}
+
+static PyObject*
+ax_queue_wait_any(PyObject *module, PyObject *args, PyObject *kwargs)
+{
+    PyObject *py_queues;
+    PyObject *py_timeout=NULL;
+
+    bool block=true;
+    double timeout = 0;
+
+    if (not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "O|O:wait_any",
+                                const_cast<char**>(wait_any_kwlist),
+                                &py_queues,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(NULL, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+
+    PyObject *sequence = PySequence_Fast(py_queues, "queues must be iterable");
+    if (sequence == NULL) {
+        return NULL;
+    }
+
+    Py_ssize_t nb_of_queues = PySequence_Fast_GET_SIZE(sequence);
+    if (nb_of_queues == 0) {
+        Py_DECREF(sequence);
+        return PyErr_Format(PyExc_ValueError, "queues must not be empty");
+    }
+
+    std::vector<Queue*> queues;
+    for (Py_ssize_t i=0; i<nb_of_queues; i++) {
+        PyObject *queue = PySequence_Fast_GET_ITEM(sequence, i);
+        if (not PyObject_TypeCheck(queue, &QueueType)) {
+            Py_DECREF(sequence);
+            return PyErr_Format(
+                    PyExc_TypeError,
+                    "wait_any() needs AXQueues, not '%.200s'",
+                    Py_TYPE(queue)->tp_name);
+        }
+        queues.push_back(reinterpret_cast<Queue*>(queue));
+    }
+
+    /* sequence keeps the queues alive while we wait */
+    PyObject *result = _internal_wait_any(queues, block, timeout);
+    Py_DECREF(sequence);
+    return result;
+}
+
+static PyMethodDef module_methods[] = {
+    {"wait_any", (PyCFunction)ax_queue_wait_any, METH_VARARGS|METH_KEYWORDS, ""},
+    {NULL, NULL, 0, NULL}
+};
+
+/* SPSCQueue: Lock free single-producer/single-consumer ring buffer.
+ *
+ * put() and get() only touch two atomic indices (tail is owned by the
+ * producer, head by the consumer). The mutex and the condition variables are
+ * only used to park a thread if the ring is empty (consumer) or full
+ * (producer). Every side publishes its index first and then checks if the
+ * other side is parked. The parked side registers itself first and then
+ * re-checks the index under the mutex. So no wakeup gets lost.
+ *
+ * The ring is only correct with at most one thread calling put*() and at most
+ * one thread calling get*() at the same time.
+ */
+class SPSCBridge {
+    public:
+        std::mutex mutex;
+        std::condition_variable empty_cond;
+        std::condition_variable full_cond;
+        std::condition_variable all_tasks_done_cond;
+        std::vector<PyObject*> ring;
+        size_t mask;
+        std::atomic<std::uint64_t> unfinished_tasks;
+        std::atomic<int> waiting_consumers;
+        std::atomic<int> waiting_producers;
+        /* head and tail are written by different threads, keep them on
+         * different cache lines */
+        char _pad0[64];
+        std::atomic<size_t> head;
+        char _pad1[64];
+        std::atomic<size_t> tail;
+        char _pad2[64];
+
+        SPSCBridge(size_t capacity)
+            : ring(capacity, NULL), mask(capacity - 1),
+              unfinished_tasks(0), waiting_consumers(0), waiting_producers(0),
+              head(0), tail(0) {}
+
+        size_t size() {
+            return this->tail.load() - this->head.load();
+        }
+};
+
+/* Registers a parked thread for the lifetime of the object */
+class WaitCounter {
+    private:
+        std::atomic<int> &counter;
+    public:
+        WaitCounter(std::atomic<int> &counter) : counter(counter) {counter++;}
+        ~WaitCounter(){counter--;}
+};
+
+typedef struct {
+    PyObject_HEAD
+    SPSCBridge *bridge;
+    size_t maxsize;
+} SPSCQueue;
+
+
+static PyObject *
+SPSCQueue_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    SPSCQueue *self;
+    self = reinterpret_cast<SPSCQueue*> (type->tp_alloc(type, 0));
+    self->bridge = NULL;
+    self->maxsize = 0;
+
+    return reinterpret_cast<PyObject*>(self);
+}
+
+static int
+SPSCQueue_init(SPSCQueue *self, PyObject *args, PyObject *kwargs)
+{
+    long int maxsize=0;
+    size_t capacity=1;
+
+    if(not PyArg_ParseTupleAndKeywords(
+                args,
+                kwargs,
+                "l",
+                const_cast<char**>(init_kwlist),
+                &maxsize))
+    {
+        return -1;
+    }
+
+    if (maxsize <= 0) {
+        PyErr_Format(
+                PyExc_ValueError,
+                "maxsize must be greater 0 but it is: %ld",
+                maxsize);
+        return -1;
+    }
+
+    /* A power of two allows masking instead of modulo */
+    while (capacity < static_cast<size_t>(maxsize)) {
+        capacity <<= 1;
+    }
+
+    self->maxsize = maxsize;
+
+    BEGIN_SAFE_CALL
+        self->bridge = new SPSCBridge(capacity);
+    END_SAFE_CALL("Error creating underlying queue: %s", -1)
+    return 0;
+}
+
+static int
+SPSCQueue_traverse(SPSCQueue *self, visitproc visit, void *arg)
+{
+    if (self->bridge == NULL) {
+        return 0;
+    }
+
+    SPSCBridge *bridge = self->bridge;
+    for (size_t i=bridge->head.load(); i != bridge->tail.load(); i++) {
+        Py_VISIT(bridge->ring[i & bridge->mask]);
+    }
+
+    return 0;
+}
+
+static int
+SPSCQueue_clear(SPSCQueue *self)
+{
+    if (self->bridge == NULL) {
+        return 0;
+    }
+
+    SPSCBridge *bridge = self->bridge;
+    size_t head = bridge->head.load();
+    size_t tail = bridge->tail.load();
+    bridge->head.store(tail);
+
+    for (size_t i=head; i != tail; i++) {
+        Py_CLEAR(bridge->ring[i & bridge->mask]);
+    }
+
+    return 0;
+}
+
+static void
+SPSCQueue_dealloc(SPSCQueue *self)
+{
+    if (self->bridge) {
+        SPSCQueue_clear(self);
+        delete self->bridge;
+    }
+    Py_TYPE(self)->tp_free(reinterpret_cast<PyObject*>(self));
+}
+
+static bool
+_spsc_wait_for_free_slots(
+        SPSCQueue *self,
+        bool block,
+        double timeout,
+        size_t nb_of_items)
+{
+    std::uint64_t timeout_millis = static_cast<std::uint64_t>(timeout*1000);
+    SPSCBridge *bridge = self->bridge;
+
+    if ((self->maxsize - bridge->size()) >= nb_of_items) {
+        return true;
+    }
+
+    if (not block) {
+        PyErr_Format(FullError, "Queue Full");
+        return false;
+    }
+
+    Lock lock(bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock);
+    }
+
+    WaitCounter parked(bridge->waiting_producers);
+    if (timeout > 0) {
+        auto abs_timeout = std::chrono::steady_clock::now();
+        abs_timeout += std::chrono::milliseconds(timeout_millis);
+        while (!((self->maxsize - bridge->size()) >= nb_of_items)) {
+            if (not _timed_wait_full(bridge, lock, abs_timeout)) {
+                PyErr_Format(FullError, "Queue Full");
+                return false;
+            }
+        }
+    }
+    else {
+        while (!((self->maxsize - bridge->size()) >= nb_of_items)) {
+            _blocked_wait_full(bridge, lock);
+        }
+    }
+    return true;
+}
+
+static bool
+_spsc_wait_for_items(
+        SPSCQueue *self,
+        bool block,
+        double timeout,
+        size_t nb_of_items)
+{
+    std::uint64_t timeout_millis = static_cast<std::uint64_t>(timeout*1000);
+    SPSCBridge *bridge = self->bridge;
+
+    if (bridge->size() >= nb_of_items) {
+        return true;
+    }
+
+    if (not block) {
+        PyErr_Format(EmptyError, "Queue Empty");
+        return false;
+    }
+
+    Lock lock(bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock);
+    }
+
+    WaitCounter parked(bridge->waiting_consumers);
+    if (timeout > 0) {
+        auto abs_timeout = std::chrono::steady_clock::now();
+        abs_timeout += std::chrono::milliseconds(timeout_millis);
+        while (bridge->size() < nb_of_items) {
+            if (not _timed_wait_empty(bridge, lock, abs_timeout)) {
+                PyErr_Format(EmptyError, "Queue Empty");
+                return false;
+            }
+        }
+    }
+    else {
+        while (bridge->size() < nb_of_items) {
+            _blocked_wait_empty(bridge, lock);
+        }
+    }
+    return true;
+}
+
+/* Wakes up the other side, but only if it is parked */
+static void
+_spsc_wake(SPSCBridge *bridge, std::atomic<int> &waiting, std::condition_variable &cond)
+{
+    if (waiting.load() == 0) {
+        return;
+    }
+
+    Lock lock(bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock);
+    }
+    cond.notify_all();
+}
+
+static PyObject*
+_spsc_internal_put(SPSCQueue *self, PyObject *item, bool block, double timeout)
+{
+    BEGIN_SAFE_CALL
+
+    SPSCBridge *bridge = self->bridge;
+    if (not _spsc_wait_for_free_slots(self, block, timeout, 1)) {
+        return NULL;
+    }
+
+    size_t tail = bridge->tail.load(std::memory_order_relaxed);
+    Py_INCREF(item);
+    bridge->ring[tail & bridge->mask] = item;
+
+    /* Count the task before the consumer can see the item */
+    bridge->unfinished_tasks++;
+    bridge->tail.store(tail + 1);
+
+    _spsc_wake(bridge, bridge->waiting_consumers, bridge->empty_cond);
+
+    END_SAFE_CALL("Error in put: %s", NULL)
+    Py_RETURN_NONE;
+}
+
+static PyObject*
+SPSCQueue_put(SPSCQueue *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *item;
+
+    PyObject *py_block=NULL;
+    bool block=true;
+
+    PyObject *py_timeout=NULL;
+    double timeout = 0;
+
+    if (not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "O|OO:put",
+                                const_cast<char**>(put_kwlist),
+                                &item,
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+    return _spsc_internal_put(self, item, block, timeout);
+}
+
+static PyObject*
+SPSCQueue_put_many(SPSCQueue *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *items;
+
+    PyObject *py_block=NULL;
+    bool block=true;
+
+    PyObject *py_timeout=NULL;
+    double timeout = 0;
+
+    PyObject *sequence=NULL;
+    Py_ssize_t items_len;
+
+    if (not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "O|OO:put",
+                                const_cast<char**>(put_many_kwlist),
+                                &items,
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+
+    if ((sequence = PySequence_Fast(items, "items must be iterable")) == NULL) {
+        return NULL;
+    }
+
+    items_len = PySequence_Fast_GET_SIZE(sequence);
+    if (items_len == 0) {
+        Py_DECREF(sequence);
+        Py_RETURN_NONE;
+    }
+
+    if (static_cast<size_t>(items_len) > self->maxsize) {
+        Py_DECREF(sequence);
+        return PyErr_Format(
+                    PyExc_ValueError,
+                    "items of size %i is bigger than maxsize: %i",
+                    items_len,
+                    self->maxsize);
+    }
+
+    BEGIN_SAFE_CALL
+
+    SPSCBridge *bridge = self->bridge;
+    if (not _spsc_wait_for_free_slots(self, block, timeout, items_len)) {
+        Py_DECREF(sequence);
+        return NULL;
+    }
+
+    size_t tail = bridge->tail.load(std::memory_order_relaxed);
+    PyObject **src = PySequence_Fast_ITEMS(sequence);
+    for (Py_ssize_t i=0; i<items_len; i++) {
+        Py_INCREF(src[i]);
+        bridge->ring[(tail + i) & bridge->mask] = src[i];
+    }
+    Py_DECREF(sequence);
+
+    bridge->unfinished_tasks += items_len;
+    bridge->tail.store(tail + items_len);
+
+    _spsc_wake(bridge, bridge->waiting_consumers, bridge->empty_cond);
+
+    END_SAFE_CALL("Error in put_many: %s", NULL)
+    Py_RETURN_NONE;
+}
+
+static PyObject*
+_spsc_internal_get(SPSCQueue *self, bool block, double timeout)
+{
+    BEGIN_SAFE_CALL
+
+    SPSCBridge *bridge = self->bridge;
+    if (not _spsc_wait_for_items(self, block, timeout, 1)) {
+        return NULL;
+    }
+
+    size_t head = bridge->head.load(std::memory_order_relaxed);
+    PyObject *item = bridge->ring[head & bridge->mask];
+    bridge->ring[head & bridge->mask] = NULL;
+    bridge->head.store(head + 1);
+
+    _spsc_wake(bridge, bridge->waiting_producers, bridge->full_cond);
+    return item;
+
+    END_SAFE_CALL("Error in get: %s", NULL)
+}
+
+static PyObject*
+SPSCQueue_get(SPSCQueue *self, PyObject *args, PyObject *kwargs)
+{
+
+    PyObject *py_block=NULL;
+    PyObject *py_timeout=NULL;
+
+    bool block=true;
+    double timeout = 0;
+
+    if(not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "|OO:get",
+                                const_cast<char**>(get_kwlist),
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+    return _spsc_internal_get(self, block, timeout);
+}
+
+static PyObject*
+SPSCQueue_get_many(SPSCQueue *self, PyObject *args, PyObject *kwargs)
+{
+
+    PyObject *py_block=NULL;
+    PyObject *py_timeout=NULL;
+    PyObject *result_tuple=NULL;
+
+    bool block=true;
+    double timeout = 0;
+    long int items=0;
+
+    if(not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "l|OO:get",
+                                const_cast<char**>(get_many_kwlist),
+                                &items,
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+
+    if (items == 0) {
+        return PyTuple_New(0);
+    }
+
+    if (items < 0) {
+        return PyErr_Format(
+                PyExc_ValueError,
+                "items must be greater or equal 0 but it is: %ld",
+                items);
+    }
+
+    if (static_cast<size_t>(items) > self->maxsize) {
+        return PyErr_Format(
+                PyExc_ValueError,
+                "you want to get %ld but maxsize is %i",
+                items,
+                self->maxsize);
+    }
+
+    BEGIN_SAFE_CALL
+
+    SPSCBridge *bridge = self->bridge;
+    if (not _spsc_wait_for_items(self, block, timeout, items)) {
+        return NULL;
+    }
+
+    if ((result_tuple = PyTuple_New(items)) == NULL) {
+        return NULL;
+    }
+
+    size_t head = bridge->head.load(std::memory_order_relaxed);
+    for (long int i=0; i<items; i++) {
+        size_t slot = (head + i) & bridge->mask;
+        PyTuple_SET_ITEM(result_tuple, i, bridge->ring[slot]);
+        bridge->ring[slot] = NULL;
+    }
+    bridge->head.store(head + items);
+
+    _spsc_wake(bridge, bridge->waiting_producers, bridge->full_cond);
+    return result_tuple;
+
+    END_SAFE_CALL("Error in get_many: %s", NULL)
+}
+
+static PyObject*
+SPSCQueue_qsize(SPSCQueue *self)
+{
+    return PyLong_FromSize_t(self->bridge->size());
+}
+
+static PyObject*
+SPSCQueue_empty(SPSCQueue *self)
+{
+    if (self->bridge->size() == 0) {
+        Py_RETURN_TRUE;
+    }
+    Py_RETURN_FALSE;
+}
+
+static PyObject*
+SPSCQueue_full(SPSCQueue *self)
+{
+    if (self->bridge->size() < self->maxsize) {
+        Py_RETURN_FALSE;
+    }
+    Py_RETURN_TRUE;
+}
+
+static PyObject*
+SPSCQueue_put_nowait(SPSCQueue *self, PyObject *item)
+{
+    return _spsc_internal_put(self, item, false, 0);
+}
+
+static PyObject*
+SPSCQueue_get_nowait(SPSCQueue *self)
+{
+    return _spsc_internal_get(self, false, 0);
+}
+
+template <typename B>
+static PyObject*
+_atomic_task_done(B *bridge, std::uint64_t nb_of_tasks)
+{
+    BEGIN_SAFE_CALL
+
+    std::uint64_t unfinished = bridge->unfinished_tasks.load();
+    do {
+        if (unfinished < nb_of_tasks) {
+            return PyErr_Format(
+                        PyExc_ValueError, "task_done() called too many times");
+        }
+    } while (not bridge->unfinished_tasks.compare_exchange_weak(
+                unfinished, unfinished - nb_of_tasks));
+
+    if (nb_of_tasks > 0 and unfinished == nb_of_tasks) {
+        Lock lock(bridge->mutex, std::try_to_lock);
+        if (not lock.owns_lock()) {
+            _wait_for_lock(lock);
+        }
+        bridge->all_tasks_done_cond.notify_all();
+    }
+
+    END_SAFE_CALL("Error in task_done: %s", NULL)
+    Py_RETURN_NONE;
+}
+
+static PyObject*
+SPSCQueue_task_done(SPSCQueue *self, PyObject *args, PyObject *kwargs)
+{
+    std::uint64_t nb_of_tasks;
+    if (_parse_task_done_args(args, kwargs, nb_of_tasks) == -1) {
+        return NULL;
+    }
+    return _atomic_task_done(self->bridge, nb_of_tasks);
+}
+
+static inline std::uint64_t
+_unfinished_tasks(SPSCQueue* self)
+{
+    return self->bridge->unfinished_tasks.load();
+}
+
+static PyObject*
+SPSCQueue_join(SPSCQueue* self, PyObject *args, PyObject *kwargs)
+{
+    bool block=true;
+    double timeout=0;
+    if (_parse_join_args(args, kwargs, block, timeout) == -1) {
+        return NULL;
+    }
+    return _internal_join(self, block, timeout);
+}
+
+static PyMethodDef SPSCQueue_methods[] = {
+    {"put", (PyCFunction)SPSCQueue_put, METH_VARARGS|METH_KEYWORDS, ""},
+    {"get", (PyCFunction)SPSCQueue_get, METH_VARARGS|METH_KEYWORDS, ""},
+    {"qsize", (PyCFunction)SPSCQueue_qsize, METH_NOARGS, ""},
+    {"empty", (PyCFunction)SPSCQueue_empty, METH_NOARGS, ""},
+    {"full", (PyCFunction)SPSCQueue_full, METH_NOARGS, ""},
+    {"put_nowait", (PyCFunction)SPSCQueue_put_nowait, METH_O, ""},
+    {"get_nowait", (PyCFunction)SPSCQueue_get_nowait, METH_NOARGS, ""},
+    {"put_many", (PyCFunction)SPSCQueue_put_many, METH_VARARGS|METH_KEYWORDS, ""},
+    {"get_many", (PyCFunction)SPSCQueue_get_many, METH_VARARGS|METH_KEYWORDS, ""},
+    {"task_done", (PyCFunction)SPSCQueue_task_done, METH_VARARGS|METH_KEYWORDS, ""},
+    {"join", (PyCFunction)SPSCQueue_join, METH_VARARGS|METH_KEYWORDS, ""},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyObject *
+SPSCQueue_maxsize_get(SPSCQueue *self, void *closure)
+{
+    return PyLong_FromSize_t(self->maxsize);
+}
+
+static PyGetSetDef SPSCQueue_getsets[] = {
+    {const_cast<char*>("maxsize"), (getter)SPSCQueue_maxsize_get, NULL, const_cast<char*>(""), NULL},
+    {NULL, NULL, NULL, NULL, NULL}
+};
+
+static PyTypeObject SPSCQueueType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "ax_utils.ax_queue.SPSCQueue", /*tp_name*/
+    sizeof(SPSCQueue),         /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)SPSCQueue_dealloc, /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC,/*tp_flags*/
+    "",                        /* tp_doc */
+    (traverseproc)SPSCQueue_traverse, /* tp_traverse */
+    (inquiry)SPSCQueue_clear,  /* tp_clear */
+    0,                         /* tp_richcompare */
+    0,                         /* tp_weaklistoffset */
+    0,                         /* tp_iter */
+    0,                         /* tp_iternext */
+    SPSCQueue_methods,         /* tp_methods */
+    0,                         /* tp_members */
+    SPSCQueue_getsets,         /* tp_getset */
+    0,                         /* tp_base */
+    0,                         /* tp_dict */
+    0,                         /* tp_descr_get */
+    0,                         /* tp_descr_set */
+    0,                         /* tp_dictoffset */
+    (initproc)SPSCQueue_init,  /* tp_init */
+    0,                         /* tp_alloc */
+    SPSCQueue_new,             /* tp_new */
+};
+
+/* PriorityQueue: Binary heap with the blocking semantics of Queue.
+ *
+ * put(item, priority=x) orders by the numeric priority (lowest first, FIFO
+ * for equal priorities) without calling back into python. Without a priority
+ * the items themselves are compared with '<', like queue.PriorityQueue does.
+ * Both kinds can't be mixed in the same queue at the same time. The items
+ * are compared under the lock, their __lt__ must not use the queue.
+ */
+static const char *priority_put_kwlist[] = {"item", "block", "timeout", "priority", NULL};
+static const char *priority_put_many_kwlist[] = {"items", "block", "timeout", "priorities", NULL};
+static const char *priority_put_nowait_kwlist[] = {"item", "priority", NULL};
+
+struct PriorityEntry {
+    PyObject *item;
+    double priority;
+    std::uint64_t seq;
+    bool has_priority;
+};
+
+class PriorityBridge {
+    public:
+        std::mutex mutex;
+        std::condition_variable empty_cond;
+        std::condition_variable full_cond;
+        std::condition_variable all_tasks_done_cond;
+        std::vector<PriorityEntry> queue;
+        std::uint64_t next_seq = 0;
+        size_t prioritized = 0;
+};
+
+typedef struct {
+    PyObject_HEAD
+    PriorityBridge *bridge;
+    size_t maxsize;
+    std::uint64_t unfinished_tasks;
+} PriorityQueue;
+
+
+/* Returns 1 if a has to be served before b, 0 if not and -1 on error */
+static int
+_priority_less(const PriorityEntry &a, const PriorityEntry &b)
+{
+    if (a.has_priority) {
+        if (a.priority != b.priority) {
+            return a.priority < b.priority;
+        }
+        return a.seq < b.seq;
+    }
+    return PyObject_RichCompareBool(a.item, b.item, Py_LT);
+}
+
+static int
+_heap_sift_up(std::vector<PriorityEntry> &heap, size_t pos)
+{
+    while (pos > 0) {
+        size_t parent = (pos - 1) >> 1;
+        int less = _priority_less(heap[pos], heap[parent]);
+        if (less == -1) {
+            return -1;
+        }
+        if (not less) {
+            break;
+        }
+        std::swap(heap[pos], heap[parent]);
+        pos = parent;
+    }
+    return 0;
+}
+
+/* path gets the index of every child swapped with its parent */
+static int
+_heap_sift_down(std::vector<PriorityEntry> &heap, size_t pos, std::vector<size_t> &path)
+{
+    size_t size = heap.size();
+    while (true) {
+        size_t child = 2 * pos + 1;
+        if (child >= size) {
+            break;
+        }
+        if (child + 1 < size) {
+            int less = _priority_less(heap[child + 1], heap[child]);
+            if (less == -1) {
+                return -1;
+            }
+            child += less;
+        }
+        int less = _priority_less(heap[child], heap[pos]);
+        if (less == -1) {
+            return -1;
+        }
+        if (not less) {
+            break;
+        }
+        std::swap(heap[pos], heap[child]);
+        path.push_back(child);
+        pos = child;
+    }
+    return 0;
+}
+
+/* Like heapq the item stays queued if a comparison fails */
+static int
+_priority_push(PriorityBridge *bridge, PyObject *item, double priority, bool has_priority)
+{
+    PriorityEntry entry = {item, priority, bridge->next_seq++, has_priority};
+
+    Py_INCREF(item);
+    bridge->queue.push_back(entry);
+    bridge->prioritized += has_priority;
+    return _heap_sift_up(bridge->queue, bridge->queue.size() - 1);
+}
+
+/* Puts back an entry popped by _priority_pop (the last one popped first):
+ * the swaps of its sift down are undone, which restores the heap exactly
+ * without comparing again.
+ */
+static void
+_priority_unpop(PriorityBridge *bridge, const PriorityEntry &entry, const std::vector<size_t> &path)
+{
+    std::vector<PriorityEntry> &heap = bridge->queue;
+    for (auto child = path.rbegin(); child != path.rend(); ++child) {
+        std::swap(heap[*child], heap[(*child - 1) >> 1]);
+    }
+
+    if (heap.empty()) {
+        heap.push_back(entry);
+    }
+    else {
+        heap.push_back(heap.front());
+        heap.front() = entry;
+    }
+    bridge->prioritized += entry.has_priority;
+}
+
+/* On error the heap is restored, so nothing gets lost */
+static int
+_priority_pop(PriorityBridge *bridge, PriorityEntry &entry, std::vector<size_t> &path)
+{
+    std::vector<PriorityEntry> &heap = bridge->queue;
+
+    entry = heap.front();
+    heap.front() = heap.back();
+    heap.pop_back();
+    bridge->prioritized -= entry.has_priority;
+
+    path.clear();
+    if (not heap.empty() and _heap_sift_down(heap, 0, path) == -1) {
+        _priority_unpop(bridge, entry, path);
+        return -1;
+    }
+    return 0;
+}
+
+static int
+_parse_priority(PyObject *py_priority, double &priority, bool &has_priority)
+{
+    if (py_priority == NULL or py_priority == Py_None) {
+        has_priority = false;
+        return 0;
+    }
+
+    priority = PyFloat_AsDouble(py_priority);
+    if (PyErr_Occurred()) {
+        PyErr_Format(PyExc_TypeError, "'priority' must be a number");
+        return -1;
+    }
+
+    if (priority != priority) {
+        PyErr_Format(PyExc_ValueError, "'priority' must not be NaN");
+        return -1;
+    }
+    has_priority = true;
+    return 0;
+}
+
+static bool
+_check_priority_kind(PriorityBridge *bridge, bool has_priority)
+{
+    size_t size = bridge->queue.size();
+    if (has_priority ? (bridge->prioritized == size) : (bridge->prioritized == 0)) {
+        return true;
+    }
+    PyErr_Format(
+            PyExc_TypeError,
+            "can't mix items with and without priority in one queue");
+    return false;
+}
+
+
+static PyObject *
+PriorityQueue_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    PriorityQueue *self;
+    self = reinterpret_cast<PriorityQueue*> (type->tp_alloc(type, 0));
+    self->bridge = NULL;
+    self->unfinished_tasks = 0;
+    self->maxsize = 0;
+
+    return reinterpret_cast<PyObject*>(self);
+}
+
+static int
+PriorityQueue_init(PriorityQueue *self, PyObject *args, PyObject *kwargs)
+{
+    long int maxsize=0;
+    if(not PyArg_ParseTupleAndKeywords(
+                args,
+                kwargs,
+                "|l",
+                const_cast<char**>(init_kwlist),
+                &maxsize))
+    {
+        return -1;
+    }
+
+    if (maxsize < 0) {
+        self->maxsize = 0;
+    }
+    else {
+        self->maxsize = maxsize;
+    }
+
+    BEGIN_SAFE_CALL
+        self->bridge = new PriorityBridge();
+    END_SAFE_CALL("Error creating underlying queue: %s", -1)
+    return 0;
+}
+
+static int
+PriorityQueue_traverse(PriorityQueue *self, visitproc visit, void *arg)
+{
+    if (self->bridge == NULL) {
+        return 0;
+    }
+
+    for (PriorityEntry &entry: self->bridge->queue) {
+        Py_VISIT(entry.item);
+    }
+
+    return 0;
+}
+
+static int
+PriorityQueue_clear(PriorityQueue *self)
+{
+    if (self->bridge == NULL) {
+        return 0;
+    }
+
+    std::vector<PriorityEntry> entries;
+    entries.swap(self->bridge->queue);
+    self->bridge->prioritized = 0;
+
+    for (PriorityEntry &entry: entries) {
+        Py_DECREF(entry.item);
+    }
+
+    return 0;
+}
+
+static void
+PriorityQueue_dealloc(PriorityQueue *self)
+{
+    if (self->bridge) {
+        PriorityQueue_clear(self);
+        delete self->bridge;
+    }
+    Py_TYPE(self)->tp_free(reinterpret_cast<PyObject*>(self));
+}
+
+static PyObject*
+_priority_internal_put(
+        PriorityQueue *self,
+        PyObject *item,
+        bool block,
+        double timeout,
+        double priority,
+        bool has_priority)
+{
+    int ret;
+
+    BEGIN_SAFE_CALL
+
+    Lock lock(self->bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock);
+    }
+
+    if (not _wait_for_free_slots(self, block, timeout, lock, 1)) {
+        return NULL;
+    }
+
+    if (not _check_priority_kind(self->bridge, has_priority)) {
+        return NULL;
+    }
+
+    ret = _priority_push(self->bridge, item, priority, has_priority);
+
+    self->unfinished_tasks += 1;
+    self->bridge->empty_cond.notify_one();
+
+    if (ret == -1) {
+        return NULL;
+    }
+
+    END_SAFE_CALL("Error in put: %s", NULL)
+    Py_RETURN_NONE;
+}
+
+static PyObject*
+PriorityQueue_put(PriorityQueue *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *item;
+
+    PyObject *py_block=NULL;
+    bool block=true;
+
+    PyObject *py_timeout=NULL;
+    double timeout = 0;
+
+    PyObject *py_priority=NULL;
+    double priority = 0;
+    bool has_priority;
+
+    if (not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "O|OOO:put",
+                                const_cast<char**>(priority_put_kwlist),
+                                &item,
+                                &py_block,
+                                &py_timeout,
+                                &py_priority))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+
+    if (_parse_priority(py_priority, priority, has_priority) == -1) {
+        return NULL;
+    }
+    return _priority_internal_put(self, item, block, timeout, priority, has_priority);
+}
+
+static PyObject*
+PriorityQueue_put_nowait(PriorityQueue *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *item;
+
+    PyObject *py_priority=NULL;
+    double priority = 0;
+    bool has_priority;
+
+    if (not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "O|O:put_nowait",
+                                const_cast<char**>(priority_put_nowait_kwlist),
+                                &item,
+                                &py_priority))
+    {
+        return NULL;
+    }
+
+    if (_parse_priority(py_priority, priority, has_priority) == -1) {
+        return NULL;
+    }
+    return _priority_internal_put(self, item, false, 0, priority, has_priority);
+}
+
+static PyObject*
+PriorityQueue_put_many(PriorityQueue *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *items;
+
+    PyObject *py_block=NULL;
+    bool block=true;
+
+    PyObject *py_timeout=NULL;
+    double timeout = 0;
+
+    PyObject *py_priorities=NULL;
+    std::vector<double> priorities;
+    bool has_priority = false;
+
+    PyObject *sequence=NULL;
+    Py_ssize_t items_len;
+    int ret = 0;
+
+    if (not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "O|OOO:put_many",
+                                const_cast<char**>(priority_put_many_kwlist),
+                                &items,
+                                &py_block,
+                                &py_timeout,
+                                &py_priorities))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+
+    if ((sequence = PySequence_Fast(items, "items must be iterable")) == NULL) {
+        return NULL;
+    }
+
+    items_len = PySequence_Fast_GET_SIZE(sequence);
+
+    if (py_priorities != NULL and py_priorities != Py_None) {
+        PyObject *prio_sequence = PySequence_Fast(
+                py_priorities, "priorities must be iterable");
+        if (prio_sequence == NULL) {
+            Py_DECREF(sequence);
+            return NULL;
+        }
+
+        if (PySequence_Fast_GET_SIZE(prio_sequence) != items_len) {
+            Py_DECREF(sequence);
+            Py_DECREF(prio_sequence);
+            return PyErr_Format(
+                    PyExc_ValueError,
+                    "priorities must have the same length as items");
+        }
+
+        for (Py_ssize_t i=0; i<items_len; i++) {
+            double priority = 0;
+            if (_parse_priority(PySequence_Fast_GET_ITEM(prio_sequence, i),
+                                priority, has_priority) == -1 or not has_priority) {
+                if (not PyErr_Occurred()) {
+                    PyErr_Format(PyExc_TypeError, "'priority' must be a number");
+                }
+                Py_DECREF(sequence);
+                Py_DECREF(prio_sequence);
+                return NULL;
+            }
+            priorities.push_back(priority);
+        }
+        Py_DECREF(prio_sequence);
+    }
+
+    if (items_len == 0) {
+        Py_DECREF(sequence);
+        Py_RETURN_NONE;
+    }
+
+    if (self->maxsize > 0 and static_cast<size_t>(items_len) > self->maxsize) {
+        Py_DECREF(sequence);
+        return PyErr_Format(
+                    PyExc_ValueError,
+                    "items of size %i is bigger than maxsize: %i",
+                    items_len,
+                    self->maxsize);
+    }
+
+    BEGIN_SAFE_CALL
+
+    Lock lock(self->bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock);
+    }
+
+    if (not _wait_for_free_slots(self, block, timeout, lock, static_cast<size_t>(items_len))) {
+        Py_DECREF(sequence);
+        return NULL;
+    }
+
+    if (not _check_priority_kind(self->bridge, has_priority)) {
+        Py_DECREF(sequence);
+        return NULL;
+    }
+
+    for (Py_ssize_t i=0; i<items_len and ret == 0; i++) {
+        ret = _priority_push(
+                self->bridge,
+                PySequence_Fast_GET_ITEM(sequence, i),
+                has_priority ? priorities[i] : 0,
+                has_priority);
+        self->unfinished_tasks += 1;
+    }
+    self->bridge->empty_cond.notify_all();
+    Py_DECREF(sequence);
+
+    if (ret == -1) {
+        return NULL;
+    }
+
+    END_SAFE_CALL("Error in put_many: %s", NULL)
+    Py_RETURN_NONE;
+}
+
+static PyObject*
+_priority_internal_get(PriorityQueue *self, bool block, double timeout)
+{
+    BEGIN_SAFE_CALL
+
+    PriorityEntry entry;
+    std::vector<size_t> path;
+
+    Lock lock(self->bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock);
+    }
+
+    if (not _wait_for_items(self, block, timeout, lock, 1)) {
+        return NULL;
+    }
+
+    if (_priority_pop(self->bridge, entry, path) == -1) {
+        return NULL;
+    }
+
+    self->bridge->full_cond.notify_one();
+    return entry.item;
+
+    END_SAFE_CALL("Error in get: %s", NULL)
+}
+
+static PyObject*
+PriorityQueue_get(PriorityQueue *self, PyObject *args, PyObject *kwargs)
+{
+
+    PyObject *py_block=NULL;
+    PyObject *py_timeout=NULL;
+
+    bool block=true;
+    double timeout = 0;
+
+    if(not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "|OO:get",
+                                const_cast<char**>(get_kwlist),
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+    return _priority_internal_get(self, block, timeout);
+}
+
+static PyObject*
+PriorityQueue_get_many(PriorityQueue *self, PyObject *args, PyObject *kwargs)
+{
+
+    PyObject *py_block=NULL;
+    PyObject *py_timeout=NULL;
+    PyObject *result_tuple=NULL;
+
+    bool block=true;
+    double timeout = 0;
+    long int items=0;
+
+    if(not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "l|OO:get_many",
+                                const_cast<char**>(get_many_kwlist),
+                                &items,
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+
+    if (items == 0) {
+        return PyTuple_New(0);
+    }
+
+    if (items < 0) {
+        return PyErr_Format(
+                PyExc_ValueError,
+                "items must be greater or equal 0 but it is: %ld",
+                items);
+    }
+
+    if (self->maxsize > 0 and static_cast<size_t>(items) > self->maxsize) {
+        return PyErr_Format(
+                PyExc_ValueError,
+                "you want to get %ld but maxsize is %i",
+                items,
+                self->maxsize);
+    }
+
+    BEGIN_SAFE_CALL
+
+    Lock lock(self->bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock);
+    }
+
+    if (not _wait_for_items(self, block, timeout, lock, items)) {
+        return NULL;
+    }
+
+    if ((result_tuple = PyTuple_New(items)) == NULL) {
+        return NULL;
+    }
+
+    {
+        std::vector<PriorityEntry> popped(items);
+        std::vector<std::vector<size_t>> paths(items);
+        for (long int i=0; i<items; i++) {
+            if (_priority_pop(self->bridge, popped[i], paths[i]) == -1) {
+                /* Give the already popped items back, last one first */
+                for (long int j=i-1; j>=0; j--) {
+                    _priority_unpop(self->bridge, popped[j], paths[j]);
+                }
+                Py_DECREF(result_tuple);
+                return NULL;
+            }
+        }
+
+        for (long int i=0; i<items; i++) {
+            PyTuple_SET_ITEM(result_tuple, i, popped[i].item);
+        }
+    }
+
+    self->bridge->full_cond.notify_all();
+    return result_tuple;
+
+    END_SAFE_CALL("Error in get_many: %s", NULL)
+}
+
+static PyObject*
+PriorityQueue_qsize(PriorityQueue *self)
+{
+    return PyLong_FromSize_t(self->bridge->queue.size());
+}
+
+static PyObject*
+PriorityQueue_empty(PriorityQueue *self)
+{
+    if (self->bridge->queue.size() == 0) {
+        Py_RETURN_TRUE;
+    }
+    Py_RETURN_FALSE;
+}
+
+static PyObject*
+PriorityQueue_full(PriorityQueue *self)
+{
+    if (self->maxsize == 0) {
+        Py_RETURN_FALSE;
+    }
+
+    if (self->bridge->queue.size() < self->maxsize) {
+        Py_RETURN_FALSE;
+    }
+    Py_RETURN_TRUE;
+}
+
+static PyObject*
+PriorityQueue_get_nowait(PriorityQueue *self)
+{
+    return _priority_internal_get(self, false, 0);
+}
+
+static PyObject*
+PriorityQueue_task_done(PriorityQueue *self, PyObject *args, PyObject *kwargs)
+{
+    std::uint64_t nb_of_tasks;
+    if (_parse_task_done_args(args, kwargs, nb_of_tasks) == -1) {
+        return NULL;
+    }
+    return _internal_task_done(self, nb_of_tasks);
+}
+
+static PyObject*
+PriorityQueue_join(PriorityQueue* self, PyObject *args, PyObject *kwargs)
+{
+    bool block=true;
+    double timeout=0;
+    if (_parse_join_args(args, kwargs, block, timeout) == -1) {
+        return NULL;
+    }
+    return _internal_join(self, block, timeout);
+}
+
+static PyMethodDef PriorityQueue_methods[] = {
+    {"put", (PyCFunction)PriorityQueue_put, METH_VARARGS|METH_KEYWORDS, ""},
+    {"get", (PyCFunction)PriorityQueue_get, METH_VARARGS|METH_KEYWORDS, ""},
+    {"qsize", (PyCFunction)PriorityQueue_qsize, METH_NOARGS, ""},
+    {"empty", (PyCFunction)PriorityQueue_empty, METH_NOARGS, ""},
+    {"full", (PyCFunction)PriorityQueue_full, METH_NOARGS, ""},
+    {"put_nowait", (PyCFunction)PriorityQueue_put_nowait, METH_VARARGS|METH_KEYWORDS, ""},
+    {"get_nowait", (PyCFunction)PriorityQueue_get_nowait, METH_NOARGS, ""},
+    {"put_many", (PyCFunction)PriorityQueue_put_many, METH_VARARGS|METH_KEYWORDS, ""},
+    {"get_many", (PyCFunction)PriorityQueue_get_many, METH_VARARGS|METH_KEYWORDS, ""},
+    {"task_done", (PyCFunction)PriorityQueue_task_done, METH_VARARGS|METH_KEYWORDS, ""},
+    {"join", (PyCFunction)PriorityQueue_join, METH_VARARGS|METH_KEYWORDS, ""},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyObject *
+PriorityQueue_maxsize_get(PriorityQueue *self, void *closure)
+{
+    return PyLong_FromSize_t(self->maxsize);
+}
+
+static PyGetSetDef PriorityQueue_getsets[] = {
+    {const_cast<char*>("maxsize"), (getter)PriorityQueue_maxsize_get, NULL, const_cast<char*>(""), NULL},
+    {NULL, NULL, NULL, NULL, NULL}
+};
+
+static PyTypeObject PriorityQueueType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "ax_utils.ax_queue.PriorityQueue", /*tp_name*/
+    sizeof(PriorityQueue),     /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)PriorityQueue_dealloc, /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC,/*tp_flags*/
+    "",                        /* tp_doc */
+    (traverseproc)PriorityQueue_traverse, /* tp_traverse */
+    (inquiry)PriorityQueue_clear, /* tp_clear */
+    0,                         /* tp_richcompare */
+    0,                         /* tp_weaklistoffset */
+    0,                         /* tp_iter */
+    0,                         /* tp_iternext */
+    PriorityQueue_methods,     /* tp_methods */
+    0,                         /* tp_members */
+    PriorityQueue_getsets,     /* tp_getset */
+    0,                         /* tp_base */
+    0,                         /* tp_dict */
+    0,                         /* tp_descr_get */
+    0,                         /* tp_descr_set */
+    0,                         /* tp_dictoffset */
+    (initproc)PriorityQueue_init, /* tp_init */
+    0,                         /* tp_alloc */
+    PriorityQueue_new,         /* tp_new */
+};
+
+/* DelayQueue: items become visible for get() at a scheduled time.
+ *
+ * put(item, delay=seconds) or put_at(item, deadline) with a deadline of
+ * time.monotonic(). Items are kept in a binary min-heap on the deadline
+ * (FIFO for equal deadlines). get() waits, GIL released, until the earliest
+ * deadline is due or a put() brings an earlier one.
+ */
+static const char *delay_put_kwlist[] = {"item", "block", "timeout", "delay", NULL};
+static const char *delay_put_at_kwlist[] = {"item", "deadline", "block", "timeout", NULL};
+
+/* time.monotonic, put_at() deadlines are relative to it */
+static PyObject *monotonic_func;
+
+struct DelayEntry {
+    PyObject *item;
+    std::chrono::steady_clock::time_point deadline;
+    std::uint64_t seq;
+};
+
+/* std heaps are max-heaps, the entry due last compares smallest */
+struct DelayLater {
+    bool operator()(const DelayEntry &a, const DelayEntry &b) const {
+        if (a.deadline != b.deadline) {
+            return a.deadline > b.deadline;
+        }
+        return a.seq > b.seq;
+    }
+};
+
+class DelayBridge {
+    public:
+        std::mutex mutex;
+        std::condition_variable empty_cond;
+        std::condition_variable full_cond;
+        std::condition_variable all_tasks_done_cond;
+        std::vector<DelayEntry> queue;
+        std::uint64_t next_seq = 0;
+
+        bool due(std::chrono::steady_clock::time_point now) {
+            return not this->queue.empty() and this->queue.front().deadline <= now;
+        }
+};
+
+typedef struct {
+    PyObject_HEAD
+    DelayBridge *bridge;
+    size_t maxsize;
+    std::uint64_t unfinished_tasks;
+} DelayQueue;
+
+
+static PyObject *
+DelayQueue_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    DelayQueue *self;
+    self = reinterpret_cast<DelayQueue*> (type->tp_alloc(type, 0));
+    self->bridge = NULL;
+    self->unfinished_tasks = 0;
+    self->maxsize = 0;
+
+    return reinterpret_cast<PyObject*>(self);
+}
+
+static int
+DelayQueue_init(DelayQueue *self, PyObject *args, PyObject *kwargs)
+{
+    long int maxsize=0;
+    if(not PyArg_ParseTupleAndKeywords(
+                args,
+                kwargs,
+                "|l",
+                const_cast<char**>(init_kwlist),
+                &maxsize))
+    {
+        return -1;
+    }
+
+    if (maxsize < 0) {
+        self->maxsize = 0;
+    }
+    else {
+        self->maxsize = maxsize;
+    }
+
+    BEGIN_SAFE_CALL
+        self->bridge = new DelayBridge();
+    END_SAFE_CALL("Error creating underlying queue: %s", -1)
+    return 0;
+}
+
+static int
+DelayQueue_traverse(DelayQueue *self, visitproc visit, void *arg)
+{
+    if (self->bridge == NULL) {
+        return 0;
+    }
+
+    for (DelayEntry &entry: self->bridge->queue) {
+        Py_VISIT(entry.item);
+    }
+
+    return 0;
+}
+
+static int
+DelayQueue_clear(DelayQueue *self)
+{
+    if (self->bridge == NULL) {
+        return 0;
+    }
+
+    std::vector<DelayEntry> entries;
+    entries.swap(self->bridge->queue);
+    for (DelayEntry &entry: entries) {
+        Py_DECREF(entry.item);
+    }
+
+    return 0;
+}
+
+static void
+DelayQueue_dealloc(DelayQueue *self)
+{
+    if (self->bridge) {
+        DelayQueue_clear(self);
+        delete self->bridge;
+    }
+    Py_TYPE(self)->tp_free(reinterpret_cast<PyObject*>(self));
+}
+
+/* Converts a delay in seconds to a steady_clock deadline */
+static int
+_parse_delay(double delay, std::chrono::steady_clock::time_point &deadline)
+{
+    if (std::isnan(delay)) {
+        PyErr_Format(PyExc_ValueError, "delay must not be NaN");
+        return -1;
+    }
+
+    if (std::fabs(delay) > static_cast<double>(std::numeric_limits<time_t>::max())) {
+        PyErr_Format(PyExc_OverflowError, "delay is too large");
+        return -1;
+    }
+
+    deadline = std::chrono::steady_clock::now() +
+        std::chrono::duration_cast<std::chrono::steady_clock::duration>(
+                std::chrono::duration<double>(delay));
+    return 0;
+}
+
+static PyObject*
+_delay_internal_put(
+        DelayQueue *self,
+        PyObject *item,
+        bool block,
+        double timeout,
+        std::chrono::steady_clock::time_point deadline)
+{
+    BEGIN_SAFE_CALL
+
+    DelayBridge *bridge = self->bridge;
+    Lock lock(bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock);
+    }
+
+    if (not _wait_for_free_slots(self, block, timeout, lock, 1)) {
+        return NULL;
+    }
+
+    Py_INCREF(item);
+    bridge->queue.push_back({item, deadline, bridge->next_seq++});
+    std::push_heap(bridge->queue.begin(), bridge->queue.end(), DelayLater());
+    self->unfinished_tasks += 1;
+
+    /* Only an earlier deadline changes anything for the waiting getters */
+    if (bridge->queue.front().item == item and
+            bridge->queue.front().deadline == deadline) {
+        bridge->empty_cond.notify_one();
+    }
+
+    END_SAFE_CALL("Error in put: %s", NULL)
+    Py_RETURN_NONE;
+}
+
+static PyObject*
+DelayQueue_put(DelayQueue *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *item;
+
+    PyObject *py_block=NULL;
+    bool block=true;
+
+    PyObject *py_timeout=NULL;
+    double timeout = 0;
+
+    double delay = 0;
+    std::chrono::steady_clock::time_point deadline;
+
+    if (not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "O|OOd:put",
+                                const_cast<char**>(delay_put_kwlist),
+                                &item,
+                                &py_block,
+                                &py_timeout,
+                                &delay))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+
+    if (_parse_delay(delay, deadline) == -1) {
+        return NULL;
+    }
+    return _delay_internal_put(self, item, block, timeout, deadline);
+}
+
+static PyObject*
+DelayQueue_put_at(DelayQueue *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *item;
+
+    PyObject *py_block=NULL;
+    bool block=true;
+
+    PyObject *py_timeout=NULL;
+    double timeout = 0;
+
+    double at = 0;
+    std::chrono::steady_clock::time_point deadline;
+
+    if (not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "Od|OO:put_at",
+                                const_cast<char**>(delay_put_at_kwlist),
+                                &item,
+                                &at,
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+
+    PyObject *py_now = PyObject_CallFunctionObjArgs(monotonic_func, NULL);
+    if (py_now == NULL) {
+        return NULL;
+    }
+    double now = PyFloat_AsDouble(py_now);
+    Py_DECREF(py_now);
+
+    if (_parse_delay(at - now, deadline) == -1) {
+        return NULL;
+    }
+    return _delay_internal_put(self, item, block, timeout, deadline);
+}
+
+static PyObject*
+DelayQueue_put_nowait(DelayQueue *self, PyObject *item)
+{
+    return _delay_internal_put(self, item, false, 0, std::chrono::steady_clock::now());
+}
+
+/* Waits until the earliest deadline is due, a timeout raises Empty */
+static bool
+_wait_for_due_items(DelayQueue *self, bool block, double timeout, Lock& lock)
+{
+    using Clock = std::chrono::steady_clock;
+    std::uint64_t timeout_millis = static_cast<std::uint64_t>(timeout*1000);
+    DelayBridge *bridge = self->bridge;
+
+    auto abs_timeout = Clock::time_point::max();
+    if (block and timeout > 0) {
+        abs_timeout = Clock::now() + std::chrono::milliseconds(timeout_millis);
+    }
+
+    while (true) {
+        auto now = Clock::now();
+        if (bridge->due(now)) {
+            return true;
+        }
+
+        if (not block or now >= abs_timeout) {
+            PyErr_Format(EmptyError, "Queue Empty");
+            return false;
+        }
+
+        /* Wake up for the next deadline, the timeout or an earlier put() */
+        auto wake_up = abs_timeout;
+        if (not bridge->queue.empty()) {
+            wake_up = std::min(wake_up, bridge->queue.front().deadline);
+        }
+
+        if (wake_up == Clock::time_point::max()) {
+            _blocked_wait_empty(bridge, lock);
+        }
+        else {
+            _timed_wait_empty(bridge, lock, wake_up);
+        }
+    }
+}
+
+static inline PyObject*
+_delay_pop(DelayQueue *self)
+{
+    std::vector<DelayEntry> &queue = self->bridge->queue;
+    std::pop_heap(queue.begin(), queue.end(), DelayLater());
+    PyObject *item = queue.back().item;
+    queue.pop_back();
+    return item;
+}
+
+static PyObject*
+_delay_internal_get(DelayQueue *self, bool block, double timeout)
+{
+    BEGIN_SAFE_CALL
+
+    Lock lock(self->bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock);
+    }
+
+    if (not _wait_for_due_items(self, block, timeout, lock)) {
+        return NULL;
+    }
+
+    PyObject *item = _delay_pop(self);
+    self->bridge->full_cond.notify_one();
+    return item;
+
+    END_SAFE_CALL("Error in get: %s", NULL)
+}
+
+static PyObject*
+DelayQueue_get(DelayQueue *self, PyObject *args, PyObject *kwargs)
+{
+
+    PyObject *py_block=NULL;
+    PyObject *py_timeout=NULL;
+
+    bool block=true;
+    double timeout = 0;
+
+    if(not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "|OO:get",
+                                const_cast<char**>(get_kwlist),
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+    return _delay_internal_get(self, block, timeout);
+}
+
+static PyObject*
+DelayQueue_get_nowait(DelayQueue *self)
+{
+    return _delay_internal_get(self, false, 0);
+}
+
+/* Waits like get() and returns all items which are due, in deadline order */
+static PyObject*
+DelayQueue_get_many(DelayQueue *self, PyObject *args, PyObject *kwargs)
+{
+
+    PyObject *py_block=NULL;
+    PyObject *py_timeout=NULL;
+    PyObject *result_tuple=NULL;
+
+    bool block=true;
+    double timeout = 0;
+
+    if(not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "|OO:get_many",
+                                const_cast<char**>(get_kwlist),
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+
+    BEGIN_SAFE_CALL
+
+    DelayBridge *bridge = self->bridge;
+    Lock lock(bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock);
+    }
+
+    if (not _wait_for_due_items(self, block, timeout, lock)) {
+        return NULL;
+    }
+
+    auto now = std::chrono::steady_clock::now();
+    size_t items = 0;
+    for (DelayEntry &entry: bridge->queue) {
+        if (entry.deadline <= now) {
+            items++;
+        }
+    }
+
+    if ((result_tuple = PyTuple_New(items)) == NULL) {
+        return NULL;
+    }
+
+    for (size_t i=0; i<items; i++) {
+        PyTuple_SET_ITEM(result_tuple, i, _delay_pop(self));
+    }
+
+    bridge->full_cond.notify_all();
+    return result_tuple;
+
+    END_SAFE_CALL("Error in get_many: %s", NULL)
+}
+
+static PyObject*
+DelayQueue_qsize(DelayQueue *self)
+{
+    return PyLong_FromSize_t(self->bridge->queue.size());
+}
+
+static PyObject*
+DelayQueue_empty(DelayQueue *self)
+{
+    if (self->bridge->queue.size() == 0) {
+        Py_RETURN_TRUE;
+    }
+    Py_RETURN_FALSE;
+}
+
+static PyObject*
+DelayQueue_full(DelayQueue *self)
+{
+    if (self->maxsize == 0) {
+        Py_RETURN_FALSE;
+    }
+
+    if (self->bridge->queue.size() < self->maxsize) {
+        Py_RETURN_FALSE;
+    }
+    Py_RETURN_TRUE;
+}
+
+static PyObject*
+DelayQueue_task_done(DelayQueue *self, PyObject *args, PyObject *kwargs)
+{
+    std::uint64_t nb_of_tasks;
+    if (_parse_task_done_args(args, kwargs, nb_of_tasks) == -1) {
+        return NULL;
+    }
+    return _internal_task_done(self, nb_of_tasks);
+}
+
+static PyObject*
+DelayQueue_join(DelayQueue* self, PyObject *args, PyObject *kwargs)
+{
+    bool block=true;
+    double timeout=0;
+    if (_parse_join_args(args, kwargs, block, timeout) == -1) {
+        return NULL;
+    }
+    return _internal_join(self, block, timeout);
+}
+
+static PyMethodDef DelayQueue_methods[] = {
+    {"put", (PyCFunction)DelayQueue_put, METH_VARARGS|METH_KEYWORDS, ""},
+    {"put_at", (PyCFunction)DelayQueue_put_at, METH_VARARGS|METH_KEYWORDS, ""},
+    {"get", (PyCFunction)DelayQueue_get, METH_VARARGS|METH_KEYWORDS, ""},
+    {"qsize", (PyCFunction)DelayQueue_qsize, METH_NOARGS, ""},
+    {"empty", (PyCFunction)DelayQueue_empty, METH_NOARGS, ""},
+    {"full", (PyCFunction)DelayQueue_full, METH_NOARGS, ""},
+    {"put_nowait", (PyCFunction)DelayQueue_put_nowait, METH_O, ""},
+    {"get_nowait", (PyCFunction)DelayQueue_get_nowait, METH_NOARGS, ""},
+    {"get_many", (PyCFunction)DelayQueue_get_many, METH_VARARGS|METH_KEYWORDS, ""},
+    {"task_done", (PyCFunction)DelayQueue_task_done, METH_VARARGS|METH_KEYWORDS, ""},
+    {"join", (PyCFunction)DelayQueue_join, METH_VARARGS|METH_KEYWORDS, ""},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyObject *
+DelayQueue_maxsize_get(DelayQueue *self, void *closure)
+{
+    return PyLong_FromSize_t(self->maxsize);
+}
+
+static PyGetSetDef DelayQueue_getsets[] = {
+    {const_cast<char*>("maxsize"), (getter)DelayQueue_maxsize_get, NULL, const_cast<char*>(""), NULL},
+    {NULL, NULL, NULL, NULL, NULL}
+};
+
+static PyTypeObject DelayQueueType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "ax_utils.ax_queue.DelayQueue", /*tp_name*/
+    sizeof(DelayQueue),        /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)DelayQueue_dealloc, /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC,/*tp_flags*/
+    "",                        /* tp_doc */
+    (traverseproc)DelayQueue_traverse, /* tp_traverse */
+    (inquiry)DelayQueue_clear, /* tp_clear */
+    0,                         /* tp_richcompare */
+    0,                         /* tp_weaklistoffset */
+    0,                         /* tp_iter */
+    0,                         /* tp_iternext */
+    DelayQueue_methods,        /* tp_methods */
+    0,                         /* tp_members */
+    DelayQueue_getsets,        /* tp_getset */
+    0,                         /* tp_base */
+    0,                         /* tp_dict */
+    0,                         /* tp_descr_get */
+    0,                         /* tp_descr_set */
+    0,                         /* tp_dictoffset */
+    (initproc)DelayQueue_init, /* tp_init */
+    0,                         /* tp_alloc */
+    DelayQueue_new,            /* tp_new */
+};
+
+/* CoalescingQueue: keyed queue which keeps only the latest value per key.
+ *
+ * put(key, value) appends the key in FIFO order, or, while the key is still
+ * queued, replaces its value in place (O(1), the order of the key doesn't
+ * change). get() returns (key, value). maxsize bounds the number of queued
+ * keys, replacing a value never blocks. A replaced value counts as done for
+ * task_done()/join().
+ *
+ * The dict calls __hash__ and __eq__ of the keys under the lock, they must
+ * not use the queue. Values are never released under the lock.
+ */
+static const char *coalescing_put_kwlist[] = {"key", "value", "block", "timeout", NULL};
+
+class CoalescingBridge {
+    public:
+        std::mutex mutex;
+        std::condition_variable empty_cond;
+        std::condition_variable full_cond;
+        std::condition_variable all_tasks_done_cond;
+        /* FIFO of the queued keys, the values live in the dict */
+        std::deque<PyObject*> queue;
+        PyObject *values = NULL;
+        std::uint64_t coalesced = 0;
+};
+
+typedef struct {
+    PyObject_HEAD
+    CoalescingBridge *bridge;
+    size_t maxsize;
+    std::uint64_t unfinished_tasks;
+} CoalescingQueue;
+
+
+static PyObject *
+CoalescingQueue_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    CoalescingQueue *self;
+    self = reinterpret_cast<CoalescingQueue*> (type->tp_alloc(type, 0));
+    self->bridge = NULL;
+    self->unfinished_tasks = 0;
+    self->maxsize = 0;
+
+    return reinterpret_cast<PyObject*>(self);
+}
+
+static int
+CoalescingQueue_init(CoalescingQueue *self, PyObject *args, PyObject *kwargs)
+{
+    long int maxsize=0;
+    if(not PyArg_ParseTupleAndKeywords(
+                args,
+                kwargs,
+                "|l",
+                const_cast<char**>(init_kwlist),
+                &maxsize))
+    {
+        return -1;
+    }
+
+    if (maxsize < 0) {
+        self->maxsize = 0;
+    }
+    else {
+        self->maxsize = maxsize;
+    }
+
+    PyObject *values = PyDict_New();
+    if (values == NULL) {
+        return -1;
+    }
+
+    BEGIN_SAFE_CALL
+        self->bridge = new CoalescingBridge();
+        self->bridge->values = values;
+    END_SAFE_CALL("Error creating underlying queue: %s", -1)
+    return 0;
+}
+
+static int
+CoalescingQueue_traverse(CoalescingQueue *self, visitproc visit, void *arg)
+{
+    if (self->bridge == NULL) {
+        return 0;
+    }
+
+    for (PyObject *key: self->bridge->queue) {
+        Py_VISIT(key);
+    }
+    Py_VISIT(self->bridge->values);
+
+    return 0;
+}
+
+static int
+CoalescingQueue_clear(CoalescingQueue *self)
+{
+    if (self->bridge == NULL) {
+        return 0;
+    }
+
+    std::deque<PyObject*> keys;
+    keys.swap(self->bridge->queue);
+    for (PyObject *key: keys) {
+        Py_DECREF(key);
+    }
+    Py_CLEAR(self->bridge->values);
+
+    return 0;
+}
+
+static void
+CoalescingQueue_dealloc(CoalescingQueue *self)
+{
+    if (self->bridge) {
+        CoalescingQueue_clear(self);
+        delete self->bridge;
+    }
+    Py_TYPE(self)->tp_free(reinterpret_cast<PyObject*>(self));
+}
+
+static PyObject*
+_coalescing_internal_put(
+        CoalescingQueue *self,
+        PyObject *key,
+        PyObject *value,
+        bool block,
+        double timeout)
+{
+    /* Fail on unhashable keys before taking the lock */
+    if (PyObject_Hash(key) == -1) {
+        return NULL;
+    }
+
+    /* The replaced value is released without the lock, its __del__ could
+     * use the queue.
+     */
+    PyObject *replaced = NULL;
+    bool failed = false;
+
+    BEGIN_SAFE_CALL
+
+    {
+        CoalescingBridge *bridge = self->bridge;
+        Lock lock(bridge->mutex, std::try_to_lock);
+        if (not lock.owns_lock()) {
+            _wait_for_lock(lock);
+        }
+
+        int queued = PyDict_Contains(bridge->values, key);
+        if (queued == -1) {
+            return NULL;
+        }
+
+        /* Waiting releases the lock, the key could have been queued meanwhile */
+        if (not queued) {
+            if (not _wait_for_free_slots(self, block, timeout, lock, 1)) {
+                return NULL;
+            }
+
+            if ((queued = PyDict_Contains(bridge->values, key)) == -1) {
+                return NULL;
+            }
+        }
+
+        if (queued) {
+            replaced = PyDict_GetItemWithError(bridge->values, key);
+            Py_XINCREF(replaced);
+        }
+
+        if (PyErr_Occurred() or PyDict_SetItem(bridge->values, key, value) == -1) {
+            failed = true;
+        }
+        else if (queued) {
+            bridge->coalesced += 1;
+        }
+        else {
+            Py_INCREF(key);
+            bridge->queue.push_back(key);
+            self->unfinished_tasks += 1;
+            bridge->empty_cond.notify_one();
+        }
+    }
+
+    Py_XDECREF(replaced);
+    if (failed) {
+        return NULL;
+    }
+
+    END_SAFE_CALL("Error in put: %s", NULL)
+    Py_RETURN_NONE;
+}
+
+static PyObject*
+CoalescingQueue_put(CoalescingQueue *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *key;
+    PyObject *value;
+
+    PyObject *py_block=NULL;
+    bool block=true;
+
+    PyObject *py_timeout=NULL;
+    double timeout = 0;
+
+    if (not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "OO|OO:put",
+                                const_cast<char**>(coalescing_put_kwlist),
+                                &key,
+                                &value,
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+    return _coalescing_internal_put(self, key, value, block, timeout);
+}
+
+static PyObject*
+CoalescingQueue_put_nowait(CoalescingQueue *self, PyObject *args)
+{
+    PyObject *key;
+    PyObject *value;
+
+    if (not PyArg_ParseTuple(args, "OO:put_nowait", &key, &value)) {
+        return NULL;
+    }
+    return _coalescing_internal_put(self, key, value, false, 0);
+}
+
+static PyObject*
+_coalescing_internal_get(CoalescingQueue *self, bool block, double timeout)
+{
+    BEGIN_SAFE_CALL
+
+    CoalescingBridge *bridge = self->bridge;
+    Lock lock(bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock);
+    }
+
+    if (not _wait_for_items(self, block, timeout, lock, 1)) {
+        return NULL;
+    }
+
+    PyObject *key = bridge->queue.front();
+    PyObject *value = PyDict_GetItemWithError(bridge->values, key);
+    if (value == NULL) {
+        if (not PyErr_Occurred()) {
+            PyErr_SetObject(PyExc_KeyError, key);
+        }
+        return NULL;
+    }
+
+    /* The tuple keeps key and value alive, nothing is released under the lock */
+    PyObject *result = PyTuple_Pack(2, key, value);
+    if (result == NULL) {
+        return NULL;
+    }
+
+    if (PyDict_DelItem(bridge->values, key) == -1) {
+        Py_DECREF(result);
+        return NULL;
+    }
+    bridge->queue.pop_front();
+    Py_DECREF(key);
+
+    bridge->full_cond.notify_one();
+    return result;
+
+    END_SAFE_CALL("Error in get: %s", NULL)
+}
+
+static PyObject*
+CoalescingQueue_get(CoalescingQueue *self, PyObject *args, PyObject *kwargs)
+{
+
+    PyObject *py_block=NULL;
+    PyObject *py_timeout=NULL;
+
+    bool block=true;
+    double timeout = 0;
+
+    if(not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "|OO:get",
+                                const_cast<char**>(get_kwlist),
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+    return _coalescing_internal_get(self, block, timeout);
+}
+
+static PyObject*
+CoalescingQueue_get_nowait(CoalescingQueue *self)
+{
+    return _coalescing_internal_get(self, false, 0);
+}
+
+static PyObject*
+CoalescingQueue_qsize(CoalescingQueue *self)
+{
+    return PyLong_FromSize_t(self->bridge->queue.size());
+}
+
+static PyObject*
+CoalescingQueue_empty(CoalescingQueue *self)
+{
+    if (self->bridge->queue.size() == 0) {
+        Py_RETURN_TRUE;
+    }
+    Py_RETURN_FALSE;
+}
+
+static PyObject*
+CoalescingQueue_full(CoalescingQueue *self)
+{
+    if (self->maxsize == 0) {
+        Py_RETURN_FALSE;
+    }
+
+    if (self->bridge->queue.size() < self->maxsize) {
+        Py_RETURN_FALSE;
+    }
+    Py_RETURN_TRUE;
+}
+
+static PyObject*
+CoalescingQueue_task_done(CoalescingQueue *self, PyObject *args, PyObject *kwargs)
+{
+    std::uint64_t nb_of_tasks;
+    if (_parse_task_done_args(args, kwargs, nb_of_tasks) == -1) {
+        return NULL;
+    }
+    return _internal_task_done(self, nb_of_tasks);
+}
+
+static PyObject*
+CoalescingQueue_join(CoalescingQueue* self, PyObject *args, PyObject *kwargs)
+{
+    bool block=true;
+    double timeout=0;
+    if (_parse_join_args(args, kwargs, block, timeout) == -1) {
+        return NULL;
+    }
+    return _internal_join(self, block, timeout);
+}
+
+static PyMethodDef CoalescingQueue_methods[] = {
+    {"put", (PyCFunction)CoalescingQueue_put, METH_VARARGS|METH_KEYWORDS, ""},
+    {"get", (PyCFunction)CoalescingQueue_get, METH_VARARGS|METH_KEYWORDS, ""},
+    {"qsize", (PyCFunction)CoalescingQueue_qsize, METH_NOARGS, ""},
+    {"empty", (PyCFunction)CoalescingQueue_empty, METH_NOARGS, ""},
+    {"full", (PyCFunction)CoalescingQueue_full, METH_NOARGS, ""},
+    {"put_nowait", (PyCFunction)CoalescingQueue_put_nowait, METH_VARARGS, ""},
+    {"get_nowait", (PyCFunction)CoalescingQueue_get_nowait, METH_NOARGS, ""},
+    {"task_done", (PyCFunction)CoalescingQueue_task_done, METH_VARARGS|METH_KEYWORDS, ""},
+    {"join", (PyCFunction)CoalescingQueue_join, METH_VARARGS|METH_KEYWORDS, ""},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyObject *
+CoalescingQueue_maxsize_get(CoalescingQueue *self, void *closure)
+{
+    return PyLong_FromSize_t(self->maxsize);
+}
+
+static PyObject *
+CoalescingQueue_coalesced_get(CoalescingQueue *self, void *closure)
+{
+    return PyLong_FromUnsignedLongLong(self->bridge->coalesced);
+}
+
+static PyGetSetDef CoalescingQueue_getsets[] = {
+    {const_cast<char*>("maxsize"), (getter)CoalescingQueue_maxsize_get, NULL, const_cast<char*>(""), NULL},
+    {const_cast<char*>("coalesced"), (getter)CoalescingQueue_coalesced_get, NULL, const_cast<char*>(""), NULL},
+    {NULL, NULL, NULL, NULL, NULL}
+};
+
+static PyTypeObject CoalescingQueueType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "ax_utils.ax_queue.CoalescingQueue", /*tp_name*/
+    sizeof(CoalescingQueue),   /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)CoalescingQueue_dealloc, /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC,/*tp_flags*/
+    "",                        /* tp_doc */
+    (traverseproc)CoalescingQueue_traverse, /* tp_traverse */
+    (inquiry)CoalescingQueue_clear, /* tp_clear */
+    0,                         /* tp_richcompare */
+    0,                         /* tp_weaklistoffset */
+    0,                         /* tp_iter */
+    0,                         /* tp_iternext */
+    CoalescingQueue_methods,   /* tp_methods */
+    0,                         /* tp_members */
+    CoalescingQueue_getsets,   /* tp_getset */
+    0,                         /* tp_base */
+    0,                         /* tp_dict */
+    0,                         /* tp_descr_get */
+    0,                         /* tp_descr_set */
+    0,                         /* tp_dictoffset */
+    (initproc)CoalescingQueue_init, /* tp_init */
+    0,                         /* tp_alloc */
+    CoalescingQueue_new,       /* tp_new */
+};
+
+/* BroadcastQueue: every subscriber sees every item.
+ *
+ * The items are kept once in a shared deque, each subscriber only has a
+ * cursor (the sequence number of its next item). An item is released as
+ * soon as the slowest subscriber has read it. New subscribers only see
+ * items put after subscribe(), without subscribers put() discards items.
+ *
+ * maxsize bounds the items the slowest subscriber is behind. If it is
+ * reached overflow decides: 'block' (default) waits for the slowest
+ * subscriber, 'drop_oldest' drops the oldest item for the subscribers which
+ * haven't read it yet and counts it in their dropped attribute.
+ */
+static const char *broadcast_init_kwlist[] = {"maxsize", "overflow", NULL};
+
+struct BroadcastCursor {
+    std::uint64_t seq;
+    std::uint64_t dropped;
+    bool closed;
+};
+
+class BroadcastBridge {
+    public:
+        std::mutex mutex;
+        std::condition_variable empty_cond;
+        std::condition_variable full_cond;
+        std::deque<PyObject*> queue;
+        /* Sequence number of queue.front() */
+        std::uint64_t head_seq = 0;
+        /* Owned by the subscribers */
+        std::vector<BroadcastCursor*> cursors;
+
+        std::uint64_t tail_seq() {
+            return this->head_seq + this->queue.size();
+        }
+
+        /* Pops the oldest item, the caller has to decref it without the lock */
+        PyObject* pop_front() {
+            PyObject *item = this->queue.front();
+            this->queue.pop_front();
+            this->head_seq += 1;
+            return item;
+        }
+
+        /* Pops the items every subscriber has read */
+        void trim(std::vector<PyObject*> &freed) {
+            std::uint64_t min_seq = this->tail_seq();
+            for (BroadcastCursor *cursor: this->cursors) {
+                min_seq = std::min(min_seq, cursor->seq);
+            }
+
+            while (this->head_seq < min_seq) {
+                freed.push_back(this->pop_front());
+            }
+        }
+};
+
+typedef struct {
+    PyObject_HEAD
+    BroadcastBridge *bridge;
+    size_t maxsize;
+    Overflow overflow;
+} BroadcastQueue;
+
+typedef struct {
+    PyObject_HEAD
+    BroadcastQueue *queue;
+    BroadcastCursor *cursor;
+} BroadcastSubscriber;
+
+/* Subscriber of a BroadcastQueue, created by subscribe() */
+
+/* Detaches the cursor, the items only this subscriber still had to read
+ * are released. Waiting get() calls raise ValueError.
+ */
+static void
+_subscriber_detach(BroadcastSubscriber *self)
+{
+    std::vector<PyObject*> freed;
+
+    {
+        BroadcastBridge *bridge = self->queue->bridge;
+        Lock lock(bridge->mutex, std::try_to_lock);
+        if (not lock.owns_lock()) {
+            _wait_for_lock(lock);
+        }
+
+        if (self->cursor->closed) {
+            return;
+        }
+
+        std::vector<BroadcastCursor*> &cursors = bridge->cursors;
+        cursors.erase(std::remove(cursors.begin(), cursors.end(), self->cursor), cursors.end());
+        self->cursor->closed = true;
+
+        bridge->trim(freed);
+        bridge->empty_cond.notify_all();
+        if (not freed.empty()) {
+            bridge->full_cond.notify_all();
+        }
+    }
+
+    for (PyObject *item: freed) {
+        Py_DECREF(item);
+    }
+}
+
+static int
+BroadcastSubscriber_traverse(BroadcastSubscriber *self, visitproc visit, void *arg)
+{
+    Py_VISIT(self->queue);
+    return 0;
+}
+
+static int
+BroadcastSubscriber_clear(BroadcastSubscriber *self)
+{
+    if (self->queue) {
+        _subscriber_detach(self);
+    }
+    Py_CLEAR(self->queue);
+    return 0;
+}
+
+static void
+BroadcastSubscriber_dealloc(BroadcastSubscriber *self)
+{
+    PyObject_GC_UnTrack(self);
+    BroadcastSubscriber_clear(self);
+    delete self->cursor;
+    Py_TYPE(self)->tp_free(reinterpret_cast<PyObject*>(self));
+}
+
+static PyObject*
+_subscriber_closed_error()
+{
+    return PyErr_Format(PyExc_ValueError, "subscriber is closed");
+}
+
+/* Waits until the subscriber has an unread item, like _wait_for_items */
+static bool
+_wait_for_broadcast(
+        BroadcastBridge *bridge,
+        BroadcastCursor *cursor,
+        bool block,
+        double timeout,
+        Lock& lock)
+{
+    std::uint64_t timeout_millis = static_cast<std::uint64_t>(timeout*1000);
+    auto ready = [bridge, cursor]() {
+        return cursor->closed or cursor->seq < bridge->tail_seq();
+    };
+
+    if (ready()) {
+        /* Fall through the end of method */
+    }
+    else if (not block) {
+        PyErr_Format(EmptyError, "Queue Empty");
+        return false;
+    }
+    else if (timeout > 0) {
+        auto abs_timeout = std::chrono::steady_clock::now();
+        abs_timeout += std::chrono::milliseconds(timeout_millis);
+        while (not ready()) {
+            if (not _timed_wait_empty(bridge, lock, abs_timeout)) {
+                PyErr_Format(EmptyError, "Queue Empty");
+                return false;
+            }
+        }
+    }
+    else {
+        while (not ready()) {
+            _blocked_wait_empty(bridge, lock);
+        }
+    }
+
+    if (cursor->closed) {
+        _subscriber_closed_error();
+        return false;
+    }
+    return true;
+}
+
+static PyObject*
+_subscriber_internal_get(BroadcastSubscriber *self, bool block, double timeout)
+{
+    std::vector<PyObject*> freed;
+    PyObject *item;
+
+    if (self->queue == NULL or self->cursor->closed) {
+        return _subscriber_closed_error();
+    }
+
+    BEGIN_SAFE_CALL
+
+    {
+        BroadcastBridge *bridge = self->queue->bridge;
+        BroadcastCursor *cursor = self->cursor;
+        Lock lock(bridge->mutex, std::try_to_lock);
+        if (not lock.owns_lock()) {
+            _wait_for_lock(lock);
+        }
+
+        if (not _wait_for_broadcast(bridge, cursor, block, timeout, lock)) {
+            return NULL;
+        }
+
+        item = bridge->queue[cursor->seq - bridge->head_seq];
+        Py_INCREF(item);
+
+        /* Only the slowest subscribers can release items */
+        if (cursor->seq++ == bridge->head_seq) {
+            bridge->trim(freed);
+            if (not freed.empty()) {
+                bridge->full_cond.notify_all();
+            }
+        }
+    }
+
+    for (PyObject *consumed: freed) {
+        Py_DECREF(consumed);
+    }
+
+    END_SAFE_CALL("Error in get: %s", NULL)
+    return item;
+}
+
+static PyObject*
+BroadcastSubscriber_get(BroadcastSubscriber *self, PyObject *args, PyObject *kwargs)
+{
+
+    PyObject *py_block=NULL;
+    PyObject *py_timeout=NULL;
+
+    bool block=true;
+    double timeout = 0;
+
+    if(not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "|OO:get",
+                                const_cast<char**>(get_kwlist),
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+    return _subscriber_internal_get(self, block, timeout);
+}
+
+static PyObject*
+BroadcastSubscriber_get_nowait(BroadcastSubscriber *self)
+{
+    return _subscriber_internal_get(self, false, 0);
+}
+
+/* Items this subscriber hasn't read yet */
+static PyObject*
+BroadcastSubscriber_qsize(BroadcastSubscriber *self)
+{
+    if (self->queue == NULL or self->cursor->closed) {
+        return PyLong_FromLong(0);
+    }
+    return PyLong_FromUnsignedLongLong(self->queue->bridge->tail_seq() - self->cursor->seq);
+}
+
+static PyObject*
+BroadcastSubscriber_empty(BroadcastSubscriber *self)
+{
+    if (self->queue == NULL or self->cursor->closed or
+            self->cursor->seq == self->queue->bridge->tail_seq()) {
+        Py_RETURN_TRUE;
+    }
+    Py_RETURN_FALSE;
+}
+
+static PyObject*
+BroadcastSubscriber_close(BroadcastSubscriber *self)
+{
+    if (self->queue) {
+        _subscriber_detach(self);
+    }
+    Py_RETURN_NONE;
+}
+
+static PyMethodDef BroadcastSubscriber_methods[] = {
+    {"get", (PyCFunction)BroadcastSubscriber_get, METH_VARARGS|METH_KEYWORDS, ""},
+    {"get_nowait", (PyCFunction)BroadcastSubscriber_get_nowait, METH_NOARGS, ""},
+    {"qsize", (PyCFunction)BroadcastSubscriber_qsize, METH_NOARGS, ""},
+    {"empty", (PyCFunction)BroadcastSubscriber_empty, METH_NOARGS, ""},
+    {"close", (PyCFunction)BroadcastSubscriber_close, METH_NOARGS, ""},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyObject *
+BroadcastSubscriber_dropped_get(BroadcastSubscriber *self, void *closure)
+{
+    return PyLong_FromUnsignedLongLong(self->cursor->dropped);
+}
+
+static PyObject *
+BroadcastSubscriber_closed_get(BroadcastSubscriber *self, void *closure)
+{
+    return PyBool_FromLong(self->queue == NULL or self->cursor->closed);
+}
+
+static PyGetSetDef BroadcastSubscriber_getsets[] = {
+    {const_cast<char*>("dropped"), (getter)BroadcastSubscriber_dropped_get, NULL, const_cast<char*>(""), NULL},
+    {const_cast<char*>("closed"), (getter)BroadcastSubscriber_closed_get, NULL, const_cast<char*>(""), NULL},
+    {NULL, NULL, NULL, NULL, NULL}
+};
+
+static PyTypeObject BroadcastSubscriberType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "ax_utils.ax_queue.BroadcastSubscriber", /*tp_name*/
+    sizeof(BroadcastSubscriber), /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)BroadcastSubscriber_dealloc, /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC,/*tp_flags*/
+    "",                        /* tp_doc */
+    (traverseproc)BroadcastSubscriber_traverse, /* tp_traverse */
+    (inquiry)BroadcastSubscriber_clear, /* tp_clear */
+    0,                         /* tp_richcompare */
+    0,                         /* tp_weaklistoffset */
+    0,                         /* tp_iter */
+    0,                         /* tp_iternext */
+    BroadcastSubscriber_methods, /* tp_methods */
+    0,                         /* tp_members */
+    BroadcastSubscriber_getsets, /* tp_getset */
+};
+
+static PyObject *
+BroadcastQueue_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    BroadcastQueue *self;
+    self = reinterpret_cast<BroadcastQueue*> (type->tp_alloc(type, 0));
+    self->bridge = NULL;
+    self->maxsize = 0;
+    self->overflow = OVERFLOW_BLOCK;
+
+    return reinterpret_cast<PyObject*>(self);
+}
+
+static int
+BroadcastQueue_init(BroadcastQueue *self, PyObject *args, PyObject *kwargs)
+{
+    long int maxsize=0;
+    const char *overflow="block";
+    if(not PyArg_ParseTupleAndKeywords(
+                args,
+                kwargs,
+                "|ls",
+                const_cast<char**>(broadcast_init_kwlist),
+                &maxsize,
+                &overflow))
+    {
+        return -1;
+    }
+
+    if (strcmp(overflow, "block") == 0) {
+        self->overflow = OVERFLOW_BLOCK;
+    }
+    else if (strcmp(overflow, "drop_oldest") == 0) {
+        self->overflow = OVERFLOW_DROP_OLDEST;
+    }
+    else {
+        PyErr_Format(
+                PyExc_ValueError,
+                "overflow must be 'block' or 'drop_oldest', not '%s'",
+                overflow);
+        return -1;
+    }
+
+    if (maxsize < 0) {
+        self->maxsize = 0;
+    }
+    else {
+        self->maxsize = maxsize;
+    }
+
+    if (self->overflow != OVERFLOW_BLOCK and self->maxsize == 0) {
+        PyErr_Format(PyExc_ValueError, "overflow '%s' needs maxsize", overflow);
+        return -1;
+    }
+
+    BEGIN_SAFE_CALL
+        self->bridge = new BroadcastBridge();
+    END_SAFE_CALL("Error creating underlying queue: %s", -1)
+    return 0;
+}
+
+static int
+BroadcastQueue_traverse(BroadcastQueue *self, visitproc visit, void *arg)
+{
+    if (self->bridge == NULL) {
+        return 0;
+    }
+
+    for (PyObject *item: self->bridge->queue) {
+        Py_VISIT(item);
+    }
+
+    return 0;
+}
+
+static int
+BroadcastQueue_clear(BroadcastQueue *self)
+{
+    if (self->bridge == NULL) {
+        return 0;
+    }
+
+    std::vector<PyObject*> freed;
+    BroadcastBridge *bridge = self->bridge;
+    while (not bridge->queue.empty()) {
+        freed.push_back(bridge->pop_front());
+    }
+    for (BroadcastCursor *cursor: bridge->cursors) {
+        cursor->seq = bridge->head_seq;
+    }
+
+    for (PyObject *item: freed) {
+        Py_DECREF(item);
+    }
+
+    return 0;
+}
+
+static void
+BroadcastQueue_dealloc(BroadcastQueue *self)
+{
+    if (self->bridge) {
+        BroadcastQueue_clear(self);
+        delete self->bridge;
+    }
+    Py_TYPE(self)->tp_free(reinterpret_cast<PyObject*>(self));
+}
+
+static PyObject*
+_broadcast_internal_put(BroadcastQueue *self, PyObject *item, bool block, double timeout)
+{
+    std::vector<PyObject*> freed;
+
+    BEGIN_SAFE_CALL
+
+    {
+        BroadcastBridge *bridge = self->bridge;
+        Lock lock(bridge->mutex, std::try_to_lock);
+        if (not lock.owns_lock()) {
+            _wait_for_lock(lock);
+        }
+
+        if (self->overflow == OVERFLOW_BLOCK) {
+            if (not _wait_for_free_slots(self, block, timeout, lock, 1)) {
+                return NULL;
+            }
+        }
+        else if (bridge->queue.size() >= self->maxsize) {
+            freed.push_back(bridge->pop_front());
+            for (BroadcastCursor *cursor: bridge->cursors) {
+                if (cursor->seq < bridge->head_seq) {
+                    cursor->seq = bridge->head_seq;
+                    cursor->dropped += 1;
+                }
+            }
+        }
+
+        /* Nobody would ever read it */
+        if (not bridge->cursors.empty()) {
+            Py_INCREF(item);
+            bridge->queue.push_back(item);
+            bridge->empty_cond.notify_all();
+        }
+    }
+
+    for (PyObject *dropped: freed) {
+        Py_DECREF(dropped);
+    }
+
+    END_SAFE_CALL("Error in put: %s", NULL)
+    Py_RETURN_NONE;
+}
+
+static PyObject*
+BroadcastQueue_put(BroadcastQueue *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *item;
+
+    PyObject *py_block=NULL;
+    bool block=true;
+
+    PyObject *py_timeout=NULL;
+    double timeout = 0;
+
+    if (not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "O|OO:put",
+                                const_cast<char**>(put_kwlist),
+                                &item,
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+    return _broadcast_internal_put(self, item, block, timeout);
+}
+
+static PyObject*
+BroadcastQueue_put_nowait(BroadcastQueue *self, PyObject *item)
+{
+    return _broadcast_internal_put(self, item, false, 0);
+}
+
+static PyObject*
+BroadcastQueue_subscribe(BroadcastQueue *self)
+{
+    BroadcastSubscriber *subscriber = reinterpret_cast<BroadcastSubscriber*>(
+            BroadcastSubscriberType.tp_alloc(&BroadcastSubscriberType, 0));
+    if (subscriber == NULL) {
+        return NULL;
+    }
+
+    BEGIN_SAFE_CALL
+
+    BroadcastBridge *bridge = self->bridge;
+    Lock lock(bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock);
+    }
+
+    subscriber->cursor = new BroadcastCursor{bridge->tail_seq(), 0, false};
+    bridge->cursors.push_back(subscriber->cursor);
+
+    END_SAFE_CALL("Error in subscribe: %s", NULL)
+
+    Py_INCREF(self);
+    subscriber->queue = self;
+    return reinterpret_cast<PyObject*>(subscriber);
+}
+
+static PyObject*
+BroadcastQueue_qsize(BroadcastQueue *self)
+{
+    return PyLong_FromSize_t(self->bridge->queue.size());
+}
+
+static PyObject*
+BroadcastQueue_empty(BroadcastQueue *self)
+{
+    if (self->bridge->queue.size() == 0) {
+        Py_RETURN_TRUE;
+    }
+    Py_RETURN_FALSE;
+}
+
+static PyObject*
+BroadcastQueue_full(BroadcastQueue *self)
+{
+    if (self->maxsize == 0) {
+        Py_RETURN_FALSE;
+    }
+
+    if (self->bridge->queue.size() < self->maxsize) {
+        Py_RETURN_FALSE;
+    }
+    Py_RETURN_TRUE;
+}
+
+static PyMethodDef BroadcastQueue_methods[] = {
+    {"put", (PyCFunction)BroadcastQueue_put, METH_VARARGS|METH_KEYWORDS, ""},
+    {"put_nowait", (PyCFunction)BroadcastQueue_put_nowait, METH_O, ""},
+    {"subscribe", (PyCFunction)BroadcastQueue_subscribe, METH_NOARGS, ""},
+    {"qsize", (PyCFunction)BroadcastQueue_qsize, METH_NOARGS, ""},
+    {"empty", (PyCFunction)BroadcastQueue_empty, METH_NOARGS, ""},
+    {"full", (PyCFunction)BroadcastQueue_full, METH_NOARGS, ""},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyObject *
+BroadcastQueue_maxsize_get(BroadcastQueue *self, void *closure)
+{
+    return PyLong_FromSize_t(self->maxsize);
+}
+
+static PyObject *
+BroadcastQueue_subscribers_get(BroadcastQueue *self, void *closure)
+{
+    return PyLong_FromSize_t(self->bridge->cursors.size());
+}
+
+static PyGetSetDef BroadcastQueue_getsets[] = {
+    {const_cast<char*>("maxsize"), (getter)BroadcastQueue_maxsize_get, NULL, const_cast<char*>(""), NULL},
+    {const_cast<char*>("subscribers"), (getter)BroadcastQueue_subscribers_get, NULL, const_cast<char*>(""), NULL},
+    {NULL, NULL, NULL, NULL, NULL}
+};
+
+static PyTypeObject BroadcastQueueType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "ax_utils.ax_queue.BroadcastQueue", /*tp_name*/
+    sizeof(BroadcastQueue),    /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)BroadcastQueue_dealloc, /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC,/*tp_flags*/
+    "",                        /* tp_doc */
+    (traverseproc)BroadcastQueue_traverse, /* tp_traverse */
+    (inquiry)BroadcastQueue_clear, /* tp_clear */
+    0,                         /* tp_richcompare */
+    0,                         /* tp_weaklistoffset */
+    0,                         /* tp_iter */
+    0,                         /* tp_iternext */
+    BroadcastQueue_methods,    /* tp_methods */
+    0,                         /* tp_members */
+    BroadcastQueue_getsets,    /* tp_getset */
+    0,                         /* tp_base */
+    0,                         /* tp_dict */
+    0,                         /* tp_descr_get */
+    0,                         /* tp_descr_set */
+    0,                         /* tp_dictoffset */
+    (initproc)BroadcastQueue_init, /* tp_init */
+    0,                         /* tp_alloc */
+    BroadcastQueue_new,        /* tp_new */
+};
+
+/* TypedQueue: a queue of unboxed numbers.
+ *
+ * TypedQueue(typecode) takes the typecodes of the array module and keeps
+ * the raw C values in a growing ring of bytes. The queue holds no python
+ * objects, so it is not tracked by the GC at all. put_many() copies buffers
+ * of the same type (array.array, numpy arrays) with a single memcpy,
+ * get_many(n, asarray=True) returns an array.array instead of a tuple.
+ */
+static const char *typed_init_kwlist[] = {"typecode", "maxsize", NULL};
+static const char *typed_get_many_kwlist[] = {"items", "block", "timeout", "asarray", NULL};
+
+/* array.array, imported on the first get_many(asarray=True) */
+static PyObject * array_type;
+
+template <typename C>
+static int
+_typed_pack_signed(PyObject *value, char *dest)
+{
+    long long v = PyLong_AsLongLong(value);
+    if (v == -1 and PyErr_Occurred()) {
+        return -1;
+    }
+    if (v < std::numeric_limits<C>::min() or v > std::numeric_limits<C>::max()) {
+        PyErr_Format(PyExc_OverflowError, "value %lld out of range", v);
+        return -1;
+    }
+    C c = static_cast<C>(v);
+    memcpy(dest, &c, sizeof(C));
+    return 0;
+}
+
+template <typename C>
+static int
+_typed_pack_unsigned(PyObject *value, char *dest)
+{
+    unsigned long long v = PyLong_AsUnsignedLongLong(value);
+    if (v == static_cast<unsigned long long>(-1) and PyErr_Occurred()) {
+        return -1;
+    }
+    if (v > std::numeric_limits<C>::max()) {
+        PyErr_Format(PyExc_OverflowError, "value %llu out of range", v);
+        return -1;
+    }
+    C c = static_cast<C>(v);
+    memcpy(dest, &c, sizeof(C));
+    return 0;
+}
+
+template <typename C>
+static int
+_typed_pack_float(PyObject *value, char *dest)
+{
+    double v = PyFloat_AsDouble(value);
+    if (v == -1.0 and PyErr_Occurred()) {
+        return -1;
+    }
+    C c = static_cast<C>(v);
+    memcpy(dest, &c, sizeof(C));
+    return 0;
+}
+
+template <typename C>
+static PyObject*
+_typed_unpack_signed(const char *src)
+{
+    C c;
+    memcpy(&c, src, sizeof(C));
+    return PyLong_FromLongLong(c);
+}
+
+template <typename C>
+static PyObject*
+_typed_unpack_unsigned(const char *src)
+{
+    C c;
+    memcpy(&c, src, sizeof(C));
+    return PyLong_FromUnsignedLongLong(c);
+}
+
+template <typename C>
+static PyObject*
+_typed_unpack_float(const char *src)
+{
+    C c;
+    memcpy(&c, src, sizeof(C));
+    return PyFloat_FromDouble(c);
+}
+
+/* kind is 'i' (signed), 'u' (unsigned) or 'f', used to match buffer formats */
+struct TypedCodec {
+    char typecode;
+    char kind;
+    size_t itemsize;
+    int (*pack)(PyObject*, char*);
+    PyObject* (*unpack)(const char*);
+};
+
+#define TYPED_CODEC(typecode, kind, C, variant) \
+    {typecode, kind, sizeof(C), _typed_pack_##variant<C>, _typed_unpack_##variant<C>}
+
+static const TypedCodec typed_codecs[] = {
+    TYPED_CODEC('b', 'i', signed char, signed),
+    TYPED_CODEC('B', 'u', unsigned char, unsigned),
+    TYPED_CODEC('h', 'i', short, signed),
+    TYPED_CODEC('H', 'u', unsigned short, unsigned),
+    TYPED_CODEC('i', 'i', int, signed),
+    TYPED_CODEC('I', 'u', unsigned int, unsigned),
+    TYPED_CODEC('l', 'i', long, signed),
+    TYPED_CODEC('L', 'u', unsigned long, unsigned),
+    TYPED_CODEC('q', 'i', long long, signed),
+    TYPED_CODEC('Q', 'u', unsigned long long, unsigned),
+    TYPED_CODEC('f', 'f', float, float),
+    TYPED_CODEC('d', 'f', double, float),
+};
+
+#undef TYPED_CODEC
+
+static const TypedCodec*
+_typed_codec(char typecode)
+{
+    for (const TypedCodec &codec: typed_codecs) {
+        if (codec.typecode == typecode) {
+            return &codec;
+        }
+    }
+    return NULL;
+}
+
+/* Kind of a native struct format like 'd', '@l' or '=q', 0 if it is none */
+static char
+_typed_format_kind(const char *format)
+{
+    if (format == NULL) {
+        return 'u';
+    }
+
+    if (format[0] == '@' or format[0] == '=') {
+        format++;
+    }
+
+    if (format[0] == '\0' or format[1] != '\0') {
+        return 0;
+    }
+
+    if (strchr("bhilqn", format[0])) {
+        return 'i';
+    }
+    if (strchr("BHILQN", format[0])) {
+        return 'u';
+    }
+    if (strchr("fd", format[0])) {
+        return 'f';
+    }
+    return 0;
+}
+
+/* Ring of fixed size items, grows on demand */
+class TypedRing {
+    public:
+        explicit TypedRing(size_t itemsize) : itemsize(itemsize) {}
+
+        size_t size() const {
+            return this->count;
+        }
+
+        void push(const char *src, size_t nb_of_items) {
+            this->reserve(nb_of_items);
+            size_t tail = (this->head + this->count) % this->capacity;
+            size_t first = std::min(nb_of_items, this->capacity - tail);
+            memcpy(this->slot(tail), src, first * this->itemsize);
+            memcpy(this->slot(0), src + first * this->itemsize, (nb_of_items - first) * this->itemsize);
+            this->count += nb_of_items;
+        }
+
+        void pop(char *dest, size_t nb_of_items) {
+            this->copy_out(dest, nb_of_items);
+            this->head = (this->head + nb_of_items) % this->capacity;
+            this->count -= nb_of_items;
+        }
+
+    private:
+        size_t itemsize;
+        size_t capacity = 0;
+        size_t head = 0;
+        size_t count = 0;
+        std::vector<char> buffer;
+
+        char* slot(size_t index) {
+            return this->buffer.data() + index * this->itemsize;
+        }
+
+        void copy_out(char *dest, size_t nb_of_items) {
+            size_t first = std::min(nb_of_items, this->capacity - this->head);
+            memcpy(dest, this->slot(this->head), first * this->itemsize);
+            memcpy(dest + first * this->itemsize, this->slot(0), (nb_of_items - first) * this->itemsize);
+        }
+
+        void reserve(size_t nb_of_items) {
+            if (this->count + nb_of_items <= this->capacity) {
+                return;
+            }
+
+            size_t capacity = std::max<size_t>(this->capacity, 64);
+            while (capacity < this->count + nb_of_items) {
+                capacity *= 2;
+            }
+
+            std::vector<char> buffer(capacity * this->itemsize);
+            if (this->count) {
+                this->copy_out(buffer.data(), this->count);
+            }
+            this->buffer.swap(buffer);
+            this->capacity = capacity;
+            this->head = 0;
+        }
+};
+
+class TypedBridge {
+    public:
+        explicit TypedBridge(size_t itemsize) : queue(itemsize) {}
+
+        std::mutex mutex;
+        std::condition_variable empty_cond;
+        std::condition_variable full_cond;
+        std::condition_variable all_tasks_done_cond;
+        TypedRing queue;
+};
+
+typedef struct {
+    PyObject_HEAD
+    TypedBridge *bridge;
+    const TypedCodec *codec;
+    size_t maxsize;
+    std::uint64_t unfinished_tasks;
+} TypedQueue;
+
+
+static PyObject *
+TypedQueue_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    TypedQueue *self;
+    self = reinterpret_cast<TypedQueue*> (type->tp_alloc(type, 0));
+    self->bridge = NULL;
+    self->codec = NULL;
+    self->unfinished_tasks = 0;
+    self->maxsize = 0;
+
+    return reinterpret_cast<PyObject*>(self);
+}
+
+static int
+TypedQueue_init(TypedQueue *self, PyObject *args, PyObject *kwargs)
+{
+    int typecode;
+    long int maxsize=0;
+    if(not PyArg_ParseTupleAndKeywords(
+                args,
+                kwargs,
+                "C|l",
+                const_cast<char**>(typed_init_kwlist),
+                &typecode,
+                &maxsize))
+    {
+        return -1;
+    }
+
+    if (typecode > 127 or (self->codec = _typed_codec(typecode)) == NULL) {
+        PyErr_Format(
+                PyExc_ValueError,
+                "typecode must be one of bBhHiIlLqQfd, not '%c'",
+                typecode);
+        return -1;
+    }
+
+    if (maxsize < 0) {
+        self->maxsize = 0;
+    }
+    else {
+        self->maxsize = maxsize;
+    }
+
+    BEGIN_SAFE_CALL
+        self->bridge = new TypedBridge(self->codec->itemsize);
+    END_SAFE_CALL("Error creating underlying queue: %s", -1)
+    return 0;
+}
+
+static void
+TypedQueue_dealloc(TypedQueue *self)
+{
+    delete self->bridge;
+    Py_TYPE(self)->tp_free(reinterpret_cast<PyObject*>(self));
+}
+
+static PyObject*
+_typed_internal_put(
+        TypedQueue *self,
+        const char *values,
+        size_t nb_of_items,
+        bool block,
+        double timeout)
+{
+    BEGIN_SAFE_CALL
+
+    TypedBridge *bridge = self->bridge;
+    Lock lock(bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock);
+    }
+
+    if (not _wait_for_free_slots(self, block, timeout, lock, nb_of_items)) {
+        return NULL;
+    }
+
+    bridge->queue.push(values, nb_of_items);
+    self->unfinished_tasks += nb_of_items;
+    if (nb_of_items == 1) {
+        bridge->empty_cond.notify_one();
+    }
+    else {
+        bridge->empty_cond.notify_all();
+    }
+
+    END_SAFE_CALL("Error in put: %s", NULL)
+    Py_RETURN_NONE;
+}
+
+static PyObject*
+TypedQueue_put(TypedQueue *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *item;
+
+    PyObject *py_block=NULL;
+    bool block=true;
+
+    PyObject *py_timeout=NULL;
+    double timeout = 0;
+
+    if (not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "O|OO:put",
+                                const_cast<char**>(put_kwlist),
+                                &item,
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+
+    char value[sizeof(long long)];
+    if (self->codec->pack(item, value) == -1) {
+        return NULL;
+    }
+    return _typed_internal_put(self, value, 1, block, timeout);
+}
+
+static PyObject*
+TypedQueue_put_nowait(TypedQueue *self, PyObject *item)
+{
+    char value[sizeof(long long)];
+    if (self->codec->pack(item, value) == -1) {
+        return NULL;
+    }
+    return _typed_internal_put(self, value, 1, false, 0);
+}
+
+/* Buffers of the same type are copied as they are, everything else is
+ * converted item by item.
+ */
+static PyObject*
+TypedQueue_put_many(TypedQueue *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *items;
+
+    PyObject *py_block=NULL;
+    bool block=true;
+
+    PyObject *py_timeout=NULL;
+    double timeout = 0;
+
+    if (not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "O|OO:put",
+                                const_cast<char**>(put_many_kwlist),
+                                &items,
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+
+    const TypedCodec *codec = self->codec;
+    PyObject *result = NULL;
+
+    if (PyObject_CheckBuffer(items)) {
+        Py_buffer view;
+        if (PyObject_GetBuffer(items, &view, PyBUF_FORMAT | PyBUF_C_CONTIGUOUS) == -1) {
+            return NULL;
+        }
+
+        if (static_cast<size_t>(view.itemsize) == codec->itemsize and
+                _typed_format_kind(view.format) == codec->kind) {
+            size_t items_len = view.len / view.itemsize;
+            if (self->maxsize > 0 and items_len > self->maxsize) {
+                PyErr_Format(
+                        PyExc_ValueError,
+                        "items of size %zu is bigger than maxsize: %zu",
+                        items_len,
+                        self->maxsize);
+            }
+            else if (items_len == 0) {
+                result = Py_None;
+                Py_INCREF(result);
+            }
+            else {
+                result = _typed_internal_put(
+                        self, static_cast<const char*>(view.buf), items_len, block, timeout);
+            }
+            PyBuffer_Release(&view);
+            return result;
+        }
+        PyBuffer_Release(&view);
+    }
+
+    PyObject *sequence = PySequence_Fast(items, "items must be iterable");
+    if (sequence == NULL) {
+        return NULL;
+    }
+
+    size_t items_len = PySequence_Fast_GET_SIZE(sequence);
+    PyObject **src = PySequence_Fast_ITEMS(sequence);
+
+    if (self->maxsize > 0 and items_len > self->maxsize) {
+        Py_DECREF(sequence);
+        return PyErr_Format(
+                PyExc_ValueError,
+                "items of size %zu is bigger than maxsize: %zu",
+                items_len,
+                self->maxsize);
+    }
+
+    if (items_len == 0) {
+        Py_DECREF(sequence);
+        Py_RETURN_NONE;
+    }
+
+    BEGIN_SAFE_CALL
+
+    /* Convert before taking the lock, conversion may run python code */
+    std::vector<char> values(items_len * codec->itemsize);
+    for (size_t i=0; i<items_len; i++) {
+        if (codec->pack(src[i], values.data() + i * codec->itemsize) == -1) {
+            Py_DECREF(sequence);
+            return NULL;
+        }
+    }
+    Py_DECREF(sequence);
+
+    return _typed_internal_put(self, values.data(), items_len, block, timeout);
+
+    END_SAFE_CALL("Error in put_many: %s", NULL)
+}
+
+/* Pops nb_of_items into dest, which has room for them */
+static int
+_typed_pop(TypedQueue *self, char *dest, size_t nb_of_items, bool block, double timeout)
+{
+    BEGIN_SAFE_CALL
+
+    TypedBridge *bridge = self->bridge;
+    Lock lock(bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock);
+    }
+
+    if (not _wait_for_items(self, block, timeout, lock, nb_of_items)) {
+        return -1;
+    }
+
+    bridge->queue.pop(dest, nb_of_items);
+    if (nb_of_items == 1) {
+        bridge->full_cond.notify_one();
+    }
+    else {
+        bridge->full_cond.notify_all();
+    }
+
+    END_SAFE_CALL("Error in get: %s", -1)
+    return 0;
+}
+
+static PyObject*
+_typed_internal_get(TypedQueue *self, bool block, double timeout)
+{
+    char value[sizeof(long long)];
+    if (_typed_pop(self, value, 1, block, timeout) == -1) {
+        return NULL;
+    }
+    return self->codec->unpack(value);
+}
+
+static PyObject*
+TypedQueue_get(TypedQueue *self, PyObject *args, PyObject *kwargs)
+{
+
+    PyObject *py_block=NULL;
+    PyObject *py_timeout=NULL;
+
+    bool block=true;
+    double timeout = 0;
+
+    if(not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "|OO:get",
+                                const_cast<char**>(get_kwlist),
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+    return _typed_internal_get(self, block, timeout);
+}
+
+static PyObject*
+TypedQueue_get_nowait(TypedQueue *self)
+{
+    return _typed_internal_get(self, false, 0);
+}
+
+/* array.array(typecode, data) */
+static PyObject*
+_typed_as_array(TypedQueue *self, PyObject *data)
+{
+    if (array_type == NULL) {
+        PyObject *array = PyImport_ImportModule("array");
+        if (array == NULL) {
+            return NULL;
+        }
+        array_type = PyObject_GetAttrString(array, "array");
+        Py_DECREF(array);
+        if (array_type == NULL) {
+            return NULL;
+        }
+    }
+    return PyObject_CallFunction(array_type, "CO", self->codec->typecode, data);
+}
+
+static PyObject*
+TypedQueue_get_many(TypedQueue *self, PyObject *args, PyObject *kwargs)
+{
+
+    PyObject *py_block=NULL;
+    PyObject *py_timeout=NULL;
+    PyObject *py_asarray=NULL;
+
+    bool block=true;
+    double timeout = 0;
+    long int items=0;
+
+    if(not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "l|OOO:get",
+                                const_cast<char**>(typed_get_many_kwlist),
+                                &items,
+                                &py_block,
+                                &py_timeout,
+                                &py_asarray))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+
+    int asarray = py_asarray ? PyObject_IsTrue(py_asarray) : 0;
+    if (asarray == -1) {
+        return NULL;
+    }
+
+    if (items < 0) {
+        return PyErr_Format(
+                PyExc_ValueError,
+                "items must be greater or equal 0 but it is: %ld",
+                items);
+    }
+
+    if (self->maxsize > 0 and static_cast<size_t>(items) > self->maxsize) {
+        return PyErr_Format(
+                PyExc_ValueError,
+                "you want to get %ld but maxsize is %zu",
+                items,
+                self->maxsize);
+    }
+
+    const TypedCodec *codec = self->codec;
+    PyObject *data = PyBytes_FromStringAndSize(NULL, items * codec->itemsize);
+    if (data == NULL) {
+        return NULL;
+    }
+
+    if (items > 0 and _typed_pop(self, PyBytes_AS_STRING(data), items, block, timeout) == -1) {
+        Py_DECREF(data);
+        return NULL;
+    }
+
+    PyObject *result;
+    if (asarray) {
+        result = _typed_as_array(self, data);
+    }
+    else if ((result = PyTuple_New(items)) != NULL) {
+        const char *src = PyBytes_AS_STRING(data);
+        for (long int i=0; i<items; i++) {
+            PyObject *value = codec->unpack(src + i * codec->itemsize);
+            if (value == NULL) {
+                Py_CLEAR(result);
+                break;
+            }
+            PyTuple_SET_ITEM(result, i, value);
+        }
+    }
+
+    Py_DECREF(data);
+    return result;
+}
+
+static PyObject*
+TypedQueue_qsize(TypedQueue *self)
+{
+    return PyLong_FromSize_t(self->bridge->queue.size());
+}
+
+static PyObject*
+TypedQueue_empty(TypedQueue *self)
+{
+    if (self->bridge->queue.size() == 0) {
+        Py_RETURN_TRUE;
+    }
+    Py_RETURN_FALSE;
+}
+
+static PyObject*
+TypedQueue_full(TypedQueue *self)
+{
+    if (self->maxsize == 0) {
+        Py_RETURN_FALSE;
+    }
+
+    if (self->bridge->queue.size() < self->maxsize) {
+        Py_RETURN_FALSE;
+    }
+    Py_RETURN_TRUE;
+}
+
+static PyObject*
+TypedQueue_task_done(TypedQueue *self, PyObject *args, PyObject *kwargs)
+{
+    std::uint64_t nb_of_tasks;
+    if (_parse_task_done_args(args, kwargs, nb_of_tasks) == -1) {
+        return NULL;
+    }
+    return _internal_task_done(self, nb_of_tasks);
+}
+
+static PyObject*
+TypedQueue_join(TypedQueue* self, PyObject *args, PyObject *kwargs)
+{
+    bool block=true;
+    double timeout=0;
+    if (_parse_join_args(args, kwargs, block, timeout) == -1) {
+        return NULL;
+    }
+    return _internal_join(self, block, timeout);
+}
+
+static PyMethodDef TypedQueue_methods[] = {
+    {"put", (PyCFunction)TypedQueue_put, METH_VARARGS|METH_KEYWORDS, ""},
+    {"put_many", (PyCFunction)TypedQueue_put_many, METH_VARARGS|METH_KEYWORDS, ""},
+    {"get", (PyCFunction)TypedQueue_get, METH_VARARGS|METH_KEYWORDS, ""},
+    {"get_many", (PyCFunction)TypedQueue_get_many, METH_VARARGS|METH_KEYWORDS, ""},
+    {"qsize", (PyCFunction)TypedQueue_qsize, METH_NOARGS, ""},
+    {"empty", (PyCFunction)TypedQueue_empty, METH_NOARGS, ""},
+    {"full", (PyCFunction)TypedQueue_full, METH_NOARGS, ""},
+    {"put_nowait", (PyCFunction)TypedQueue_put_nowait, METH_O, ""},
+    {"get_nowait", (PyCFunction)TypedQueue_get_nowait, METH_NOARGS, ""},
+    {"task_done", (PyCFunction)TypedQueue_task_done, METH_VARARGS|METH_KEYWORDS, ""},
+    {"join", (PyCFunction)TypedQueue_join, METH_VARARGS|METH_KEYWORDS, ""},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyObject *
+TypedQueue_maxsize_get(TypedQueue *self, void *closure)
+{
+    return PyLong_FromSize_t(self->maxsize);
+}
+
+static PyObject *
+TypedQueue_typecode_get(TypedQueue *self, void *closure)
+{
+    return PyUnicode_FromOrdinal(self->codec->typecode);
+}
+
+static PyObject *
+TypedQueue_itemsize_get(TypedQueue *self, void *closure)
+{
+    return PyLong_FromSize_t(self->codec->itemsize);
+}
+
+static PyGetSetDef TypedQueue_getsets[] = {
+    {const_cast<char*>("maxsize"), (getter)TypedQueue_maxsize_get, NULL, const_cast<char*>(""), NULL},
+    {const_cast<char*>("typecode"), (getter)TypedQueue_typecode_get, NULL, const_cast<char*>(""), NULL},
+    {const_cast<char*>("itemsize"), (getter)TypedQueue_itemsize_get, NULL, const_cast<char*>(""), NULL},
+    {NULL, NULL, NULL, NULL, NULL}
+};
+
+static PyTypeObject TypedQueueType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "ax_utils.ax_queue.TypedQueue", /*tp_name*/
+    sizeof(TypedQueue),        /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)TypedQueue_dealloc, /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE, /*tp_flags*/
+    "",                        /* tp_doc */
+    0,                         /* tp_traverse */
+    0,                         /* tp_clear */
+    0,                         /* tp_richcompare */
+    0,                         /* tp_weaklistoffset */
+    0,                         /* tp_iter */
+    0,                         /* tp_iternext */
+    TypedQueue_methods,        /* tp_methods */
+    0,                         /* tp_members */
+    TypedQueue_getsets,        /* tp_getset */
+    0,                         /* tp_base */
+    0,                         /* tp_dict */
+    0,                         /* tp_descr_get */
+    0,                         /* tp_descr_set */
+    0,                         /* tp_dictoffset */
+    (initproc)TypedQueue_init, /* tp_init */
+    0,                         /* tp_alloc */
+    TypedQueue_new,            /* tp_new */
+};
+
+/* ShardedQueue: Queue split into lanes to spread the lock contention.
+ *
+ * Every lane is a deque with its own mutex. A thread puts into and gets from
+ * its home lane (picked by its thread id) and steals from the other lanes if
+ * the home lane is empty. Order is FIFO per lane, so items of one producer
+ * thread stay in order, items of different producers may not.
+ *
+ * Free slots and available items are reserved with atomics before a lane is
+ * touched. A reserved item is guaranteed to be in one of the lanes, so a
+ * consumer never waits on a lane. The shared mutex is only used to park
+ * threads on an empty or full queue and for join().
+ */
+static const char *sharded_init_kwlist[] = {"maxsize", "lanes", NULL};
+
+class Lane {
+    public:
+        std::mutex mutex;
+        std::deque<PyObject*> queue;
+        /* Mirrors queue.size(), lets thieves skip empty lanes without lock */
+        std::atomic<size_t> size;
+        /* Lanes are locked by different threads, keep them apart */
+        char _pad[64];
+
+        Lane() : size(0) {}
+};
+
+class ShardedBridge {
+    public:
+        std::mutex mutex;
+        std::condition_variable empty_cond;
+        std::condition_variable full_cond;
+        std::condition_variable all_tasks_done_cond;
+        std::vector<Lane> lanes;
+        std::atomic<std::uint64_t> unfinished_tasks;
+        std::atomic<int> waiting_consumers;
+        std::atomic<int> waiting_producers;
+        char _pad0[64];
+        /* items which are put and not yet reserved by a consumer */
+        std::atomic<size_t> available;
+        char _pad1[64];
+        /* slots reserved by producers and not yet freed by a consumer */
+        std::atomic<size_t> used;
+        char _pad2[64];
+
+        ShardedBridge(size_t nb_of_lanes)
+            : lanes(nb_of_lanes), unfinished_tasks(0),
+              waiting_consumers(0), waiting_producers(0),
+              available(0), used(0) {}
+};
+
+typedef struct {
+    PyObject_HEAD
+    ShardedBridge *bridge;
+    size_t maxsize;
+} ShardedQueue;
+
+
+static PyObject *
+ShardedQueue_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    ShardedQueue *self;
+    self = reinterpret_cast<ShardedQueue*> (type->tp_alloc(type, 0));
+    self->bridge = NULL;
+    self->maxsize = 0;
+
+    return reinterpret_cast<PyObject*>(self);
+}
+
+static int
+ShardedQueue_init(ShardedQueue *self, PyObject *args, PyObject *kwargs)
+{
+    long int maxsize=0;
+    long int lanes=0;
+
+    if(not PyArg_ParseTupleAndKeywords(
+                args,
+                kwargs,
+                "|ll",
+                const_cast<char**>(sharded_init_kwlist),
+                &maxsize,
+                &lanes))
+    {
+        return -1;
+    }
+
+    if (lanes < 0) {
+        PyErr_Format(
+                PyExc_ValueError,
+                "lanes must be greater or equal 0 but it is: %ld",
+                lanes);
+        return -1;
+    }
+
+    /* lanes=0: one lane per cpu */
+    if (lanes == 0) {
+        lanes = std::max(1u, std::thread::hardware_concurrency());
+    }
+
+    if (maxsize < 0) {
+        self->maxsize = 0;
+    }
+    else {
+        self->maxsize = maxsize;
+    }
+
+    BEGIN_SAFE_CALL
+        self->bridge = new ShardedBridge(lanes);
+    END_SAFE_CALL("Error creating underlying queue: %s", -1)
+    return 0;
+}
+
+static int
+ShardedQueue_traverse(ShardedQueue *self, visitproc visit, void *arg)
+{
+    if (self->bridge == NULL) {
+        return 0;
+    }
+
+    for (Lane &lane: self->bridge->lanes) {
+        for (PyObject* entry: lane.queue) {
+            Py_VISIT(entry);
+        }
+    }
+
+    return 0;
+}
+
+static int
+ShardedQueue_clear(ShardedQueue *self)
+{
+    if (self->bridge == NULL) {
+        return 0;
+    }
+
+    ShardedBridge *bridge = self->bridge;
+    for (Lane &lane: bridge->lanes) {
+        std::deque<PyObject*> entries;
+        entries.swap(lane.queue);
+        lane.size.store(0);
+        for (PyObject* entry: entries) {
+            Py_DECREF(entry);
+        }
+    }
+    bridge->available.store(0);
+    bridge->used.store(0);
+
+    return 0;
+}
+
+static void
+ShardedQueue_dealloc(ShardedQueue *self)
+{
+    if (self->bridge) {
+        ShardedQueue_clear(self);
+        delete self->bridge;
+    }
+    Py_TYPE(self)->tp_free(reinterpret_cast<PyObject*>(self));
+}
+
+static size_t
+_home_lane(ShardedBridge *bridge)
+{
+    static thread_local size_t home = std::hash<std::thread::id>()(
+            std::this_thread::get_id());
+    return home % bridge->lanes.size();
+}
+
+static bool
+_reserve_slots(ShardedQueue *self, size_t nb_of_items)
+{
+    std::atomic<size_t> &used = self->bridge->used;
+    if (self->maxsize == 0) {
+        used += nb_of_items;
+        return true;
+    }
+
+    size_t current = used.load();
+    do {
+        if (self->maxsize - current < nb_of_items) {
+            return false;
+        }
+    } while (not used.compare_exchange_weak(current, current + nb_of_items));
+    return true;
+}
+
+static bool
+_reserve_items(ShardedQueue *self, size_t nb_of_items)
+{
+    std::atomic<size_t> &available = self->bridge->available;
+    size_t current = available.load();
+    do {
+        if (current < nb_of_items) {
+            return false;
+        }
+    } while (not available.compare_exchange_weak(current, current - nb_of_items));
+    return true;
+}
+
+/* Reserves slots or items, parks on cond until reserve() succeeds */
+static bool
+_sharded_wait(
+        ShardedBridge *bridge,
+        bool block,
+        double timeout,
+        std::function<bool()> reserve,
+        std::atomic<int> &waiting,
+        std::condition_variable &cond,
+        PyObject *error)
+{
+    std::uint64_t timeout_millis = static_cast<std::uint64_t>(timeout*1000);
+
+    if (reserve()) {
+        return true;
+    }
+
+    if (not block) {
+        PyErr_Format(error, error == FullError ? "Queue Full" : "Queue Empty");
+        return false;
+    }
+
+    Lock lock(bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock);
+    }
+
+    WaitCounter parked(waiting);
+    if (timeout > 0) {
+        auto abs_timeout = std::chrono::steady_clock::now();
+        abs_timeout += std::chrono::milliseconds(timeout_millis);
+        while (not reserve()) {
+            std::cv_status status;
+            {
+                AllowThreads raii_lock;
+                status = cond.wait_until(lock, abs_timeout);
+            }
+            if (status == std::cv_status::timeout) {
+                if (reserve()) {
+                    break;
+                }
+                PyErr_Format(error, error == FullError ? "Queue Full" : "Queue Empty");
+                return false;
+            }
+        }
+    }
+    else {
+        while (not reserve()) {
+            AllowThreads raii_lock;
+            cond.wait(lock);
+        }
+    }
+    return true;
+}
+
+/* Wakes up parked threads, but only if there are some */
+static void
+_sharded_wake(
+        ShardedBridge *bridge,
+        std::atomic<int> &waiting,
+        std::condition_variable &cond,
+        size_t nb_of_items)
+{
+    if (waiting.load() == 0) {
+        return;
+    }
+
+    Lock lock(bridge->mutex, std::try_to_lock);
+    if (not lock.owns_lock()) {
+        _wait_for_lock(lock);
+    }
+
+    if (nb_of_items == 1) {
+        cond.notify_one();
+    }
+    else {
+        cond.notify_all();
+    }
+}
+
+static void
+_sharded_push(ShardedQueue *self, PyObject **items, size_t nb_of_items)
+{
+    ShardedBridge *bridge = self->bridge;
+    Lane &lane = bridge->lanes[_home_lane(bridge)];
+    {
+        Lock lock(lane.mutex, std::try_to_lock);
+        if (not lock.owns_lock()) {
+            _wait_for_lock(lock);
+        }
+
+        for (size_t i=0; i<nb_of_items; i++) {
+            Py_INCREF(items[i]);
+            lane.queue.push_back(items[i]);
+        }
+        lane.size.store(lane.queue.size());
+    }
+
+    /* Count the tasks before a consumer can reserve the items */
+    bridge->unfinished_tasks += nb_of_items;
+    bridge->available += nb_of_items;
+
+    _sharded_wake(bridge, bridge->waiting_consumers, bridge->empty_cond, nb_of_items);
+}
+
+/* Pops already reserved items, home lane first, then steals */
+static void
+_sharded_pop(ShardedQueue *self, PyObject **items, size_t nb_of_items)
+{
+    ShardedBridge *bridge = self->bridge;
+    size_t nb_of_lanes = bridge->lanes.size();
+    size_t lane_idx = _home_lane(bridge);
+    size_t popped = 0;
+
+    while (popped < nb_of_items) {
+        Lane &lane = bridge->lanes[lane_idx];
+        lane_idx = (lane_idx + 1) % nb_of_lanes;
+        if (lane.size.load() == 0) {
+            continue;
+        }
+
+        Lock lock(lane.mutex, std::try_to_lock);
+        if (not lock.owns_lock()) {
+            _wait_for_lock(lock);
+        }
+
+        while (popped < nb_of_items and not lane.queue.empty()) {
+            items[popped++] = lane.queue.front();
+            lane.queue.pop_front();
+        }
+        lane.size.store(lane.queue.size());
+    }
+
+    bridge->used -= nb_of_items;
+    _sharded_wake(bridge, bridge->waiting_producers, bridge->full_cond, nb_of_items);
+}
+
+static PyObject*
+_sharded_internal_put(ShardedQueue *self, PyObject **items, size_t nb_of_items, bool block, double timeout)
+{
+    BEGIN_SAFE_CALL
+
+    ShardedBridge *bridge = self->bridge;
+    auto reserve = [self, nb_of_items]() {
+        return _reserve_slots(self, nb_of_items);
+    };
+    if (not _sharded_wait(bridge, block, timeout, reserve,
+                          bridge->waiting_producers, bridge->full_cond, FullError)) {
+        return NULL;
+    }
+
+    _sharded_push(self, items, nb_of_items);
+
+    END_SAFE_CALL("Error in put: %s", NULL)
+    Py_RETURN_NONE;
+}
+
+static PyObject*
+ShardedQueue_put(ShardedQueue *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *item;
+
+    PyObject *py_block=NULL;
+    bool block=true;
+
+    PyObject *py_timeout=NULL;
+    double timeout = 0;
+
+    if (not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "O|OO:put",
+                                const_cast<char**>(put_kwlist),
+                                &item,
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+    return _sharded_internal_put(self, &item, 1, block, timeout);
+}
+
+static PyObject*
+ShardedQueue_put_many(ShardedQueue *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *items;
+
+    PyObject *py_block=NULL;
+    bool block=true;
+
+    PyObject *py_timeout=NULL;
+    double timeout = 0;
+
+    PyObject *sequence=NULL;
+    Py_ssize_t items_len;
+
+    if (not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "O|OO:put",
+                                const_cast<char**>(put_many_kwlist),
+                                &items,
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+
+    if ((sequence = PySequence_Fast(items, "items must be iterable")) == NULL) {
+        return NULL;
+    }
+
+    items_len = PySequence_Fast_GET_SIZE(sequence);
+    if (items_len == 0) {
+        Py_DECREF(sequence);
+        Py_RETURN_NONE;
+    }
+
+    if (self->maxsize != 0 and static_cast<size_t>(items_len) > self->maxsize) {
+        Py_DECREF(sequence);
+        return PyErr_Format(
+                    PyExc_ValueError,
+                    "items of size %i is bigger than maxsize: %i",
+                    items_len,
+                    self->maxsize);
+    }
+
+    /* The whole batch goes into one lane, it keeps its order */
+    PyObject *ret = _sharded_internal_put(
+            self, PySequence_Fast_ITEMS(sequence), items_len, block, timeout);
+    Py_DECREF(sequence);
+    return ret;
+}
+
+static PyObject*
+_sharded_internal_get(ShardedQueue *self, bool block, double timeout)
+{
+    BEGIN_SAFE_CALL
+
+    ShardedBridge *bridge = self->bridge;
+    auto reserve = [self]() {
+        return _reserve_items(self, 1);
+    };
+    if (not _sharded_wait(bridge, block, timeout, reserve,
+                          bridge->waiting_consumers, bridge->empty_cond, EmptyError)) {
+        return NULL;
+    }
+
+    PyObject *item;
+    _sharded_pop(self, &item, 1);
+    return item;
+
+    END_SAFE_CALL("Error in get: %s", NULL)
+}
+
+static PyObject*
+ShardedQueue_get(ShardedQueue *self, PyObject *args, PyObject *kwargs)
+{
+
+    PyObject *py_block=NULL;
+    PyObject *py_timeout=NULL;
+
+    bool block=true;
+    double timeout = 0;
+
+    if(not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "|OO:get",
+                                const_cast<char**>(get_kwlist),
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+    return _sharded_internal_get(self, block, timeout);
+}
+
+static PyObject*
+ShardedQueue_get_many(ShardedQueue *self, PyObject *args, PyObject *kwargs)
+{
+
+    PyObject *py_block=NULL;
+    PyObject *py_timeout=NULL;
+    PyObject *result_tuple=NULL;
+
+    bool block=true;
+    double timeout = 0;
+    long int items=0;
+
+    if(not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "l|OO:get",
+                                const_cast<char**>(get_many_kwlist),
+                                &items,
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
+    }
+
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
+
+    if (items == 0) {
+        return PyTuple_New(0);
+    }
+
+    if (items < 0) {
+        return PyErr_Format(
+                PyExc_ValueError,
+                "items must be greater or equal 0 but it is: %ld",
+                items);
+    }
+
+    if (self->maxsize != 0 and static_cast<size_t>(items) > self->maxsize) {
+        return PyErr_Format(
+                PyExc_ValueError,
+                "you want to get %ld but maxsize is %i",
+                items,
+                self->maxsize);
+    }
+
+    if ((result_tuple = PyTuple_New(items)) == NULL) {
+        return NULL;
+    }
+
+    BEGIN_SAFE_CALL
+
+    ShardedBridge *bridge = self->bridge;
+    auto reserve = [self, items]() {
+        return _reserve_items(self, items);
+    };
+    if (not _sharded_wait(bridge, block, timeout, reserve,
+                          bridge->waiting_consumers, bridge->empty_cond, EmptyError)) {
+        Py_DECREF(result_tuple);
+        return NULL;
+    }
+
+    _sharded_pop(self, PySequence_Fast_ITEMS(result_tuple), items);
+    return result_tuple;
+
+    END_SAFE_CALL("Error in get_many: %s", NULL)
+}
+
+static PyObject*
+ShardedQueue_qsize(ShardedQueue *self)
+{
+    return PyLong_FromSize_t(self->bridge->available.load());
+}
+
+static PyObject*
+ShardedQueue_empty(ShardedQueue *self)
+{
+    if (self->bridge->available.load() == 0) {
+        Py_RETURN_TRUE;
+    }
+    Py_RETURN_FALSE;
+}
+
+static PyObject*
+ShardedQueue_full(ShardedQueue *self)
+{
+    if (self->maxsize == 0) {
+        Py_RETURN_FALSE;
+    }
+
+    if (self->bridge->used.load() >= self->maxsize) {
+        Py_RETURN_TRUE;
+    }
+    Py_RETURN_FALSE;
+}
+
+static PyObject*
+ShardedQueue_put_nowait(ShardedQueue *self, PyObject *item)
+{
+    return _sharded_internal_put(self, &item, 1, false, 0);
+}
+
+static PyObject*
+ShardedQueue_get_nowait(ShardedQueue *self)
+{
+    return _sharded_internal_get(self, false, 0);
+}
+
+static PyObject*
+ShardedQueue_task_done(ShardedQueue *self, PyObject *args, PyObject *kwargs)
+{
+    std::uint64_t nb_of_tasks;
+    if (_parse_task_done_args(args, kwargs, nb_of_tasks) == -1) {
+        return NULL;
+    }
+    return _atomic_task_done(self->bridge, nb_of_tasks);
+}
+
+static inline std::uint64_t
+_unfinished_tasks(ShardedQueue* self)
+{
+    return self->bridge->unfinished_tasks.load();
+}
+
+static PyObject*
+ShardedQueue_join(ShardedQueue* self, PyObject *args, PyObject *kwargs)
+{
+    bool block=true;
+    double timeout=0;
+    if (_parse_join_args(args, kwargs, block, timeout) == -1) {
+        return NULL;
+    }
+    return _internal_join(self, block, timeout);
+}
+
+static PyMethodDef ShardedQueue_methods[] = {
+    {"put", (PyCFunction)ShardedQueue_put, METH_VARARGS|METH_KEYWORDS, ""},
+    {"get", (PyCFunction)ShardedQueue_get, METH_VARARGS|METH_KEYWORDS, ""},
+    {"qsize", (PyCFunction)ShardedQueue_qsize, METH_NOARGS, ""},
+    {"empty", (PyCFunction)ShardedQueue_empty, METH_NOARGS, ""},
+    {"full", (PyCFunction)ShardedQueue_full, METH_NOARGS, ""},
+    {"put_nowait", (PyCFunction)ShardedQueue_put_nowait, METH_O, ""},
+    {"get_nowait", (PyCFunction)ShardedQueue_get_nowait, METH_NOARGS, ""},
+    {"put_many", (PyCFunction)ShardedQueue_put_many, METH_VARARGS|METH_KEYWORDS, ""},
+    {"get_many", (PyCFunction)ShardedQueue_get_many, METH_VARARGS|METH_KEYWORDS, ""},
+    {"task_done", (PyCFunction)ShardedQueue_task_done, METH_VARARGS|METH_KEYWORDS, ""},
+    {"join", (PyCFunction)ShardedQueue_join, METH_VARARGS|METH_KEYWORDS, ""},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyObject *
+ShardedQueue_maxsize_get(ShardedQueue *self, void *closure)
+{
+    return PyLong_FromSize_t(self->maxsize);
+}
+
+static PyObject *
+ShardedQueue_lanes_get(ShardedQueue *self, void *closure)
+{
+    return PyLong_FromSize_t(self->bridge->lanes.size());
+}
+
+static PyGetSetDef ShardedQueue_getsets[] = {
+    {const_cast<char*>("maxsize"), (getter)ShardedQueue_maxsize_get, NULL, const_cast<char*>(""), NULL},
+    {const_cast<char*>("lanes"), (getter)ShardedQueue_lanes_get, NULL, const_cast<char*>(""), NULL},
+    {NULL, NULL, NULL, NULL, NULL}
+};
+
+static PyTypeObject ShardedQueueType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "ax_utils.ax_queue.ShardedQueue", /*tp_name*/
+    sizeof(ShardedQueue),      /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)ShardedQueue_dealloc, /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC,/*tp_flags*/
+    "",                        /* tp_doc */
+    (traverseproc)ShardedQueue_traverse, /* tp_traverse */
+    (inquiry)ShardedQueue_clear, /* tp_clear */
+    0,                         /* tp_richcompare */
+    0,                         /* tp_weaklistoffset */
+    0,                         /* tp_iter */
+    0,                         /* tp_iternext */
+    ShardedQueue_methods,      /* tp_methods */
+    0,                         /* tp_members */
+    ShardedQueue_getsets,      /* tp_getset */
+    0,                         /* tp_base */
+    0,                         /* tp_dict */
+    0,                         /* tp_descr_get */
+    0,                         /* tp_descr_set */
+    0,                         /* tp_dictoffset */
+    (initproc)ShardedQueue_init, /* tp_init */
+    0,                         /* tp_alloc */
+    ShardedQueue_new,          /* tp_new */
+};
+
+#ifndef _WIN32
+/* SharedQueue: Bounded queue of bytes records shared between processes.
+ *
+ * The segment is either an anonymous shared mapping (inherited with fork) or
+ * a file (e.g. in /dev/shm) which unrelated processes can attach to. It
+ * starts with a SharedHeader holding a process shared (robust) mutex and two
+ * condition variables, followed by a ring of records:
+ *
+ *   [size: uint32][state: uint32][payload, padded to 8 bytes]
+ *
+ * All offsets are monotonic byte counters, head <= read <= tail:
+ *   head: oldest record which is not released yet
+ *   read: next record handed out to a consumer
+ *   tail: next free byte for a producer
+ * A record which doesn't fit before the end of the ring leaves a WRAP marker
+ * and starts at the beginning.
+ *
+ * get() copies the payload and releases the record immediately. get_view()
+ * hands out a memoryview pointing into the segment. Its record is released
+ * when the last view is gone, so a consumer holding views back-pressures the
+ * producers.
+ */
+#include <pthread.h>
+#include <sys/stat.h>
+#include <time.h>
+
+/* glibc declares PTHREAD_MUTEX_ROBUST as an enum value, #ifdef can't see it */
+#if defined(__linux__)
+#define AX_QUEUE_ROBUST_MUTEX
+#endif
+
+static const char *shared_init_kwlist[] = {"size", "path", NULL};
+static const std::uint64_t SHARED_MAGIC = 0x41585348514d454dULL;
+
+enum SharedRecordState : std::uint32_t {
+    RECORD_READY = 1,
+    RECORD_READING = 2,
+    RECORD_FREE = 3,
+    RECORD_WRAP = 4,
+};
+
+struct SharedRecordHeader {
+    std::uint32_t size;
+    std::uint32_t state;
+};
+
+struct SharedHeader {
+    std::uint64_t magic;
+    pthread_mutex_t mutex;
+    pthread_cond_t empty_cond;
+    pthread_cond_t full_cond;
+    std::uint64_t capacity;
+    std::uint64_t head;
+    std::uint64_t read;
+    std::uint64_t tail;
+    std::uint64_t count;
+};
+
+/* The ring starts at the next cache line after the header */
+static const size_t SHARED_DATA_OFFSET = (sizeof(SharedHeader) + 63) & ~static_cast<size_t>(63);
+
+typedef struct {
+    PyObject_HEAD
+    SharedHeader *header;
+    char *data;
+    size_t map_size;
+} SharedQueue;
+
+/* Keeps a record of the segment alive while a memoryview points to it */
+typedef struct {
+    PyObject_HEAD
+    SharedQueue *queue;
+    std::uint64_t offset;
+    std::uint32_t size;
+} SharedRecord;
+
+
+static inline size_t
+_record_total(size_t size)
+{
+    return sizeof(SharedRecordHeader) + ((size + 7) & ~static_cast<size_t>(7));
+}
+
+static inline SharedRecordHeader*
+_record_at(SharedQueue *self, std::uint64_t offset)
+{
+    return reinterpret_cast<SharedRecordHeader*>(
+            self->data + offset % self->header->capacity);
+}
+
+static inline std::uint64_t
+_shared_free_bytes(SharedHeader *header)
+{
+    return header->capacity - (header->tail - header->head);
+}
+
+/* RAII lock of the process shared mutex, releases the GIL if it has to wait */
+class SharedLock {
+    private:
+        pthread_mutex_t *mutex;
+    public:
+        SharedLock(pthread_mutex_t *mutex) : mutex(mutex) {
+            int ret = pthread_mutex_trylock(mutex);
+            if (ret == EBUSY) {
+                AllowThreads raii_lock;
+                ret = pthread_mutex_lock(mutex);
+            }
+            _recover(ret);
+        }
+        ~SharedLock() {
+            pthread_mutex_unlock(this->mutex);
+        }
+
+        /* The previous owner died while holding the lock. The ring only
+         * changes in small steps under the lock, take it as it is. */
+        void _recover(int ret) {
+#ifdef AX_QUEUE_ROBUST_MUTEX
+            if (ret == EOWNERDEAD) {
+                pthread_mutex_consistent(this->mutex);
+            }
+#endif
+        }
+
+        void wait(pthread_cond_t *cond) {
+            int ret;
+            {
+                AllowThreads raii_lock;
+                ret = pthread_cond_wait(cond, this->mutex);
+            }
+            _recover(ret);
+        }
+
+        /* Returns false on timeout */
+        bool wait_until(pthread_cond_t *cond, const struct timespec &deadline) {
+            int ret;
+            {
+                AllowThreads raii_lock;
+                ret = pthread_cond_timedwait(cond, this->mutex, &deadline);
+            }
+            _recover(ret);
+            return ret != ETIMEDOUT;
+        }
+};
+
+/* Absolute deadline in the clock used by the condition variables */
+static struct timespec
+_shared_deadline(double timeout)
+{
+    struct timespec deadline;
+#ifdef __linux__
+    clock_gettime(CLOCK_MONOTONIC, &deadline);
+#else
+    clock_gettime(CLOCK_REALTIME, &deadline);
+#endif
+    std::uint64_t timeout_nanos = static_cast<std::uint64_t>(timeout*1e9);
+    deadline.tv_sec += timeout_nanos / 1000000000;
+    deadline.tv_nsec += timeout_nanos % 1000000000;
+    if (deadline.tv_nsec >= 1000000000) {
+        deadline.tv_sec += 1;
+        deadline.tv_nsec -= 1000000000;
+    }
+    return deadline;
+}
+
+static int
+_shared_init_header(SharedHeader *header, std::uint64_t capacity)
+{
+    pthread_mutexattr_t mutex_attr;
+    pthread_condattr_t cond_attr;
+
+    pthread_mutexattr_init(&mutex_attr);
+    pthread_mutexattr_setpshared(&mutex_attr, PTHREAD_PROCESS_SHARED);
+#ifdef AX_QUEUE_ROBUST_MUTEX
+    pthread_mutexattr_setrobust(&mutex_attr, PTHREAD_MUTEX_ROBUST);
+#endif
+    int ret = pthread_mutex_init(&header->mutex, &mutex_attr);
+    pthread_mutexattr_destroy(&mutex_attr);
+    if (ret != 0) {
+        return ret;
+    }
+
+    pthread_condattr_init(&cond_attr);
+    pthread_condattr_setpshared(&cond_attr, PTHREAD_PROCESS_SHARED);
+#ifdef __linux__
+    pthread_condattr_setclock(&cond_attr, CLOCK_MONOTONIC);
+#endif
+    ret = pthread_cond_init(&header->empty_cond, &cond_attr);
+    if (ret == 0) {
+        ret = pthread_cond_init(&header->full_cond, &cond_attr);
+    }
+    pthread_condattr_destroy(&cond_attr);
+    if (ret != 0) {
+        return ret;
+    }
+
+    header->capacity = capacity;
+    header->head = 0;
+    header->read = 0;
+    header->tail = 0;
+    header->count = 0;
+    __atomic_store_n(&header->magic, SHARED_MAGIC, __ATOMIC_RELEASE);
+    return 0;
+}
+
+/* Creates the file or attaches to an existing one. Returns the fd or -1. */
+static int
+_shared_open_file(const char *path, size_t &map_size, bool &created)
+{
+    int fd = open(path, O_RDWR | O_CREAT | O_EXCL | O_CLOEXEC, 0600);
+    if (fd != -1) {
+        created = true;
+        if (ftruncate(fd, map_size) == -1) {
+            int saved = errno;
+            close(fd);
+            unlink(path);
+            errno = saved;
+            return -1;
+        }
+        return fd;
+    }
+
+    if (errno != EEXIST) {
+        return -1;
+    }
+
+    created = false;
+    if ((fd = open(path, O_RDWR | O_CLOEXEC)) == -1) {
+        return -1;
+    }
+
+    /* The creator might not have finished yet */
+    struct stat st;
+    for (int i=0; i<5000; i++) {
+        if (fstat(fd, &st) == -1) {
+            break;
+        }
+        if (static_cast<size_t>(st.st_size) >= SHARED_DATA_OFFSET) {
+            map_size = st.st_size;
+            return fd;
+        }
+        usleep(1000);
+    }
+    close(fd);
+    errno = EINVAL;
+    return -1;
+}
+
+static PyObject *
+SharedQueue_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    SharedQueue *self;
+    self = reinterpret_cast<SharedQueue*> (type->tp_alloc(type, 0));
+    self->header = NULL;
+    self->data = NULL;
+    self->map_size = 0;
+
+    return reinterpret_cast<PyObject*>(self);
+}
+
+static int
+SharedQueue_init(SharedQueue *self, PyObject *args, PyObject *kwargs)
+{
+    long int size=0;
+    PyObject *py_path=NULL;
+    PyObject *path_bytes=NULL;
+    bool created = true;
+    int fd = -1;
+    void *mem;
+
+    if(not PyArg_ParseTupleAndKeywords(
+                args,
+                kwargs,
+                "|lO",
+                const_cast<char**>(shared_init_kwlist),
+                &size,
+                &py_path))
+    {
+        return -1;
+    }
 
+    if (self->header != NULL) {
+        PyErr_Format(PyExc_RuntimeError, "SharedQueue is already initialized");
+        return -1;
+    }
 
-static int
-_parse_block_and_timeout(
-        PyObject *py_block,
-        PyObject *py_timeout,
-        bool & block,
-        double & timeout)
-{
+    if (py_path == Py_None) {
+        py_path = NULL;
+    }
 
-    if (py_block != NULL and PyObject_Not(py_block)) {
-        block = false;
+    if (size < 0 or (size == 0 and py_path == NULL)) {
+        PyErr_Format(PyExc_ValueError, "size must be greater 0 but it is: %ld", size);
+        return -1;
     }
 
-    /* timeout = None => only block is used
-     * timeout < 0 => Value Error
-     * timeout > 0 wait for timeout
-     * timeout == 0 => block = false
-     */
-    if (py_timeout != NULL and py_timeout != Py_None) {
-        timeout = PyFloat_AsDouble(py_timeout);
-        if (PyErr_Occurred()) {
-            PyErr_Format(PyExc_ValueError, "'timeout' is not a valid float");
+    /* At least one maximum sized header plus payload must fit */
+    std::uint64_t capacity = (std::max(size, 64L) + 7) & ~7L;
+    self->map_size = SHARED_DATA_OFFSET + capacity;
+
+    if (py_path != NULL) {
+        if (not PyUnicode_FSConverter(py_path, &path_bytes)) {
             return -1;
         }
 
-        if (timeout < 0) {
-            PyErr_Format(PyExc_ValueError, "'timeout' must be positive");
+        {
+            AllowThreads raii_lock;
+            fd = _shared_open_file(PyBytes_AS_STRING(path_bytes), self->map_size, created);
+        }
+        if (fd == -1) {
+            PyErr_SetFromErrnoWithFilenameObject(PyExc_OSError, py_path);
+            Py_DECREF(path_bytes);
             return -1;
         }
+        Py_DECREF(path_bytes);
+        mem = mmap(NULL, self->map_size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+        close(fd);
+    }
+    else {
+        mem = mmap(NULL, self->map_size, PROT_READ | PROT_WRITE,
+                   MAP_SHARED | MAP_ANONYMOUS, -1, 0);
+    }
 
-        if (timeout > static_cast<double>(std::numeric_limits<time_t>::max())) {
-            PyErr_Format(PyExc_OverflowError, "timeout is too large");
+    if (mem == MAP_FAILED) {
+        PyErr_SetFromErrno(PyExc_OSError);
+        return -1;
+    }
+
+    self->header = reinterpret_cast<SharedHeader*>(mem);
+    self->data = reinterpret_cast<char*>(mem) + SHARED_DATA_OFFSET;
+
+    if (created) {
+        int ret = _shared_init_header(self->header, capacity);
+        if (ret != 0) {
+            errno = ret;
+            PyErr_SetFromErrno(PyExc_OSError);
             return -1;
         }
+        return 0;
+    }
 
-        if (timeout == 0) {
-            block = false;
+    /* Attached: wait until the creator has set everything up */
+    for (int i=0; i<5000; i++) {
+        if (__atomic_load_n(&self->header->magic, __ATOMIC_ACQUIRE) == SHARED_MAGIC) {
+            break;
         }
+        AllowThreads raii_lock;
+        usleep(1000);
     }
-    return 1;
-}
 
-static void
-_wait_for_lock(Lock& lock)
-{
-    AllowThreads raii_lock;
-    lock.lock();
+    if (self->header->magic != SHARED_MAGIC or
+            SHARED_DATA_OFFSET + self->header->capacity != self->map_size) {
+        PyErr_Format(PyExc_ValueError, "%R is not a SharedQueue segment", py_path);
+        return -1;
+    }
+
+    if (size != 0 and capacity != self->header->capacity) {
+        PyErr_Format(
+                PyExc_ValueError,
+                "segment has a size of %llu, not %ld",
+                static_cast<unsigned long long>(self->header->capacity),
+                size);
+        return -1;
+    }
+    return 0;
 }
 
 static void
-_blocked_wait_full(Bridge* bridge, Lock& lock)
+SharedQueue_dealloc(SharedQueue *self)
 {
-    AllowThreads raii_lock;
-    bridge->full_cond.wait(lock);
+    /* The segment stays valid for all other processes */
+    if (self->header) {
+        munmap(self->header, self->map_size);
+    }
+    Py_TYPE(self)->tp_free(reinterpret_cast<PyObject*>(self));
 }
 
 static bool
-_timed_wait_full(
-        Bridge* bridge,
-        Lock& lock,
-        std::chrono::steady_clock::time_point timeout)
+_shared_check(SharedQueue *self)
 {
-    AllowThreads raii_lock;
-    const auto ret = bridge->full_cond.wait_until(lock, timeout);
-    return ret == std::cv_status::no_timeout;
+    if (self->header == NULL) {
+        PyErr_Format(PyExc_ValueError, "SharedQueue is not initialized");
+        return false;
+    }
+    return true;
 }
 
 static bool
-_wait_for_free_slots(
-        Queue *self,
+_shared_wait(
+        SharedQueue *self,
+        SharedLock &lock,
+        pthread_cond_t *cond,
         bool block,
         double timeout,
-        Lock& lock,
-        size_t nb_of_items)
+        std::function<bool()> ready,
+        PyObject *error)
 {
-    std::uint64_t timeout_millis = static_cast<std::uint64_t>(timeout*1000);
-
-    if(self->maxsize == 0) {
-        /* Fall through the end of method */
-    }
-    else if((self->maxsize - self->bridge->queue.size()) >= nb_of_items) {
-        /* Fall through the end of method */
+    if (ready()) {
+        return true;
     }
-    else if (not block) {
-        PyErr_Format(FullError, "Queue Full");
+
+    if (not block) {
+        PyErr_Format(error, error == FullError ? "Queue Full" : "Queue Empty");
         return false;
     }
-    else if (timeout > 0) {
-        auto abs_timeout = std::chrono::steady_clock::now();
-        abs_timeout += std::chrono::milliseconds(timeout_millis);
-        while (!((self->maxsize - self->bridge->queue.size()) >= nb_of_items)) {
-            if (not _timed_wait_full(self->bridge, lock, abs_timeout)) {
-                PyErr_Format(FullError, "Queue Full");
+
+    if (timeout > 0) {
+        struct timespec deadline = _shared_deadline(timeout);
+        while (not ready()) {
+            if (not lock.wait_until(cond, deadline)) {
+                if (ready()) {
+                    break;
+                }
+                PyErr_Format(error, error == FullError ? "Queue Full" : "Queue Empty");
                 return false;
             }
         }
     }
     else {
-        while (!((self->maxsize - self->bridge->queue.size()) >= nb_of_items)) {
-            _blocked_wait_full(self->bridge, lock);
+        while (not ready()) {
+            lock.wait(cond);
         }
     }
     return true;
 }
 
-static PyObject*
-_internal_put(Queue *self, PyObject *item, bool block, double timeout)
+/* Bytes needed to append records of the given sizes at the current tail */
+static std::uint64_t
+_shared_needed_bytes(SharedQueue *self, const std::vector<Py_buffer> &buffers)
 {
-    BEGIN_SAFE_CALL
+    std::uint64_t capacity = self->header->capacity;
+    std::uint64_t tail = self->header->tail;
 
-    Lock lock(self->bridge->mutex, std::try_to_lock);
-    if (not lock.owns_lock()) {
-        _wait_for_lock(lock);
+    /* An empty ring starts over at its beginning, no wrap needed */
+    if (self->header->head == tail) {
+        tail = ((tail + capacity - 1) / capacity) * capacity;
     }
 
-    if (not _wait_for_free_slots(self, block, timeout, lock, 1)) {
-        return NULL;
+    std::uint64_t start = tail;
+    for (const Py_buffer &buffer: buffers) {
+        std::uint64_t total = _record_total(buffer.len);
+        if (tail % capacity + total > capacity) {
+            tail += capacity - tail % capacity;
+        }
+        tail += total;
+    }
+    return tail - start;
+}
+
+static void
+_shared_append(SharedQueue *self, const Py_buffer &buffer)
+{
+    SharedHeader *header = self->header;
+    std::uint64_t capacity = header->capacity;
+    std::uint64_t total = _record_total(buffer.len);
+
+    if (header->head == header->tail and header->tail % capacity) {
+        header->tail += capacity - header->tail % capacity;
+        header->head = header->read = header->tail;
     }
 
-    self->bridge->queue.push_back(item);
-    Py_INCREF(item);
+    if (header->tail % capacity + total > capacity) {
+        SharedRecordHeader *marker = _record_at(self, header->tail);
+        marker->size = 0;
+        marker->state = RECORD_WRAP;
+        header->tail += capacity - header->tail % capacity;
+    }
 
-    self->unfinished_tasks += 1;
-    self->bridge->empty_cond.notify_one();
+    SharedRecordHeader *record = _record_at(self, header->tail);
+    record->size = static_cast<std::uint32_t>(buffer.len);
+    std::memcpy(reinterpret_cast<char*>(record + 1), buffer.buf, buffer.len);
+    record->state = RECORD_READY;
 
-    END_SAFE_CALL("Error in put: %s", NULL)
+    header->tail += total;
+    header->count += 1;
+}
+
+/* Hands out the next record, it stays in the ring until it is released */
+static std::uint64_t
+_shared_take(SharedQueue *self)
+{
+    SharedHeader *header = self->header;
+    SharedRecordHeader *record = _record_at(self, header->read);
+
+    if (record->state == RECORD_WRAP) {
+        header->read += header->capacity - header->read % header->capacity;
+        record = _record_at(self, header->read);
+    }
+
+    std::uint64_t offset = header->read;
+    record->state = RECORD_READING;
+    header->read += _record_total(record->size);
+    header->count -= 1;
+    return offset;
+}
+
+static void
+_shared_release(SharedQueue *self, std::uint64_t offset)
+{
+    SharedHeader *header = self->header;
+    std::uint64_t head = header->head;
+
+    _record_at(self, offset)->state = RECORD_FREE;
+
+    while (header->head < header->read) {
+        SharedRecordHeader *record = _record_at(self, header->head);
+        if (record->state == RECORD_WRAP) {
+            header->head += header->capacity - header->head % header->capacity;
+        }
+        else if (record->state == RECORD_FREE) {
+            header->head += _record_total(record->size);
+        }
+        else {
+            break;
+        }
+    }
+
+    if (header->head != head) {
+        pthread_cond_broadcast(&header->full_cond);
+    }
+}
+
+static void
+_release_buffers(std::vector<Py_buffer> &buffers)
+{
+    for (Py_buffer &buffer: buffers) {
+        PyBuffer_Release(&buffer);
+    }
+}
+
+static PyObject*
+_shared_internal_put_many(
+        SharedQueue *self,
+        std::vector<Py_buffer> &buffers,
+        bool block,
+        double timeout)
+{
+    std::uint64_t total = 0;
+    for (Py_buffer &buffer: buffers) {
+        if (buffer.len > std::numeric_limits<std::uint32_t>::max()) {
+            _release_buffers(buffers);
+            return PyErr_Format(PyExc_ValueError, "item is too large");
+        }
+        total += _record_total(buffer.len);
+    }
+
+    if (total > self->header->capacity) {
+        _release_buffers(buffers);
+        return PyErr_Format(
+                PyExc_ValueError,
+                "items of %llu bytes are bigger than the queue size: %llu",
+                static_cast<unsigned long long>(total),
+                static_cast<unsigned long long>(self->header->capacity));
+    }
+
+    {
+        SharedLock lock(&self->header->mutex);
+        auto ready = [self, &buffers]() {
+            return _shared_needed_bytes(self, buffers) <= _shared_free_bytes(self->header);
+        };
+        if (not _shared_wait(self, lock, &self->header->full_cond, block,
+                             timeout, ready, FullError)) {
+            _release_buffers(buffers);
+            return NULL;
+        }
+
+        for (Py_buffer &buffer: buffers) {
+            _shared_append(self, buffer);
+        }
+        pthread_cond_broadcast(&self->header->empty_cond);
+    }
+
+    _release_buffers(buffers);
     Py_RETURN_NONE;
 }
 
 static PyObject*
-Queue_put(Queue *self, PyObject *args, PyObject *kwargs)
+SharedQueue_put(SharedQueue *self, PyObject *args, PyObject *kwargs)
 {
     PyObject *item;
 
@@ -280,7 +8251,7 @@ Queue_put(Queue *self, PyObject *args, PyObject *kwargs)
 
     PyObject *py_timeout=NULL;
     double timeout = 0;
-    
+
     if (not PyArg_ParseTupleAndKeywords(
                                 args,
                                 kwargs,
@@ -293,14 +8264,43 @@ Queue_put(Queue *self, PyObject *args, PyObject *kwargs)
         return NULL;
     }
 
+    if (not _shared_check(self)) {
+        return NULL;
+    }
+
     if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
         return NULL;
     }
-    return _internal_put(self, item, block, timeout);
+
+    std::vector<Py_buffer> buffers(1);
+    if (PyObject_GetBuffer(item, &buffers[0], PyBUF_SIMPLE) == -1) {
+        return NULL;
+    }
+
+    BEGIN_SAFE_CALL
+    return _shared_internal_put_many(self, buffers, block, timeout);
+    END_SAFE_CALL("Error in put: %s", NULL)
 }
 
 static PyObject*
-Queue_put_many(Queue *self, PyObject *args, PyObject *kwargs)
+SharedQueue_put_nowait(SharedQueue *self, PyObject *item)
+{
+    if (not _shared_check(self)) {
+        return NULL;
+    }
+
+    std::vector<Py_buffer> buffers(1);
+    if (PyObject_GetBuffer(item, &buffers[0], PyBUF_SIMPLE) == -1) {
+        return NULL;
+    }
+
+    BEGIN_SAFE_CALL
+    return _shared_internal_put_many(self, buffers, false, 0);
+    END_SAFE_CALL("Error in put_nowait: %s", NULL)
+}
+
+static PyObject*
+SharedQueue_put_many(SharedQueue *self, PyObject *args, PyObject *kwargs)
 {
     PyObject *items;
 
@@ -310,14 +8310,12 @@ Queue_put_many(Queue *self, PyObject *args, PyObject *kwargs)
     PyObject *py_timeout=NULL;
     double timeout = 0;
 
-    PyObject *iterator=NULL;
-    PyObject *itertor_item=NULL;
-    Py_ssize_t items_len;
+    PyObject *sequence=NULL;
 
     if (not PyArg_ParseTupleAndKeywords(
                                 args,
                                 kwargs,
-                                "O|OO:put",
+                                "O|OO:put_many",
                                 const_cast<char**>(put_many_kwlist),
                                 &items,
                                 &py_block,
@@ -326,142 +8324,94 @@ Queue_put_many(Queue *self, PyObject *args, PyObject *kwargs)
         return NULL;
     }
 
-    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
-        return NULL;
-    }
-
-    if ((items_len = PyObject_Length(items)) == -1) {
-        return NULL;
-    }
-
-    if (items_len == 0) {
-        Py_RETURN_NONE;
-    }
-
-    /* Can happen if items is a custom object overloading __len__ */
-    if (items_len < 0) {
-        return PyErr_Format(
-                PyExc_ValueError,
-                "len of items is smaller 0: %i",
-                items_len);
-    }
-
-    if (self->maxsize > 0 and static_cast<size_t>(items_len) > self->maxsize) {
-        return PyErr_Format(
-                    PyExc_ValueError,
-                    "items of size %i is bigger than maxsize: %i",
-                    items_len,
-                    self->maxsize);
-    }
-
-    BEGIN_SAFE_CALL
-
-    Lock lock(self->bridge->mutex, std::try_to_lock);
-    if (not lock.owns_lock()) {
-        _wait_for_lock(lock);
-    }
-
-    if (not _wait_for_free_slots(self, block, timeout, lock, static_cast<size_t>(items_len))) {
-        return NULL;
-    }
-
-    if ((iterator = PyObject_GetIter(items)) == NULL) {
+    if (not _shared_check(self)) {
         return NULL;
     }
 
-    while ((itertor_item = PyIter_Next(iterator))) {
-        self->bridge->queue.push_back(itertor_item);
-        self->unfinished_tasks += 1;
-
-    }
-    self->bridge->empty_cond.notify_all();
-    Py_DECREF(iterator);
-
-    if (PyErr_Occurred()) {
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
         return NULL;
     }
-
-    END_SAFE_CALL("Error in put_many: %s", NULL)
-    Py_RETURN_NONE;
-}
-
-static void
-_blocked_wait_empty(Bridge* bridge, Lock& lock)
-{
-    AllowThreads raii_lock;
-    bridge->empty_cond.wait(lock);
-}
-
-static bool
-_timed_wait_empty(
-        Bridge* bridge,
-        Lock& lock,
-        std::chrono::steady_clock::time_point timeout)
-{
-    AllowThreads raii_lock;
-    const auto ret = bridge->empty_cond.wait_until(lock, timeout);
-    return ret == std::cv_status::no_timeout;
-}
-
-static bool
-_wait_for_items(
-        Queue *self,
-        bool block,
-        double timeout,
-        Lock& lock,
-        long int items_len)
-{
-    std::uint64_t timeout_millis = static_cast<std::uint64_t>(timeout*1000);
-
-    if (self->bridge->queue.size() >= static_cast<size_t>(items_len)) {
-        /* Fall through the end of method */
-    }
-    else if (not block) {
-        PyErr_Format(EmptyError, "Queue Empty");
-        return false;
-    }
-    else if (timeout > 0) {
-        auto abs_timeout = std::chrono::steady_clock::now();
-        abs_timeout += std::chrono::milliseconds(timeout_millis);
-        while (self->bridge->queue.size() < items_len) {
-            if (not _timed_wait_empty(self->bridge, lock, abs_timeout)) {
-                PyErr_Format(EmptyError, "Queue Empty");
-                return false;
-            }
-        }
+
+    if ((sequence = PySequence_Fast(items, "items must be iterable")) == NULL) {
+        return NULL;
     }
-    else {
-        while (not (self->bridge->queue.size() >= static_cast<size_t>(items_len))) {
-            _blocked_wait_empty(self->bridge, lock);
+
+    BEGIN_SAFE_CALL
+
+    Py_ssize_t items_len = PySequence_Fast_GET_SIZE(sequence);
+    std::vector<Py_buffer> buffers;
+    buffers.reserve(items_len);
+
+    for (Py_ssize_t i=0; i<items_len; i++) {
+        Py_buffer buffer;
+        if (PyObject_GetBuffer(PySequence_Fast_GET_ITEM(sequence, i),
+                               &buffer, PyBUF_SIMPLE) == -1) {
+            _release_buffers(buffers);
+            Py_DECREF(sequence);
+            return NULL;
         }
+        buffers.push_back(buffer);
     }
-    return true;
+
+    PyObject *ret = _shared_internal_put_many(self, buffers, block, timeout);
+    Py_DECREF(sequence);
+    return ret;
+
+    END_SAFE_CALL("Error in put_many: %s", NULL)
 }
 
+/* Takes nb_of_items records, copies them to bytes and releases them */
 static PyObject*
-_internal_get(Queue *self, bool block, double timeout)
+_shared_internal_get(
+        SharedQueue *self,
+        bool block,
+        double timeout,
+        long int nb_of_items,
+        bool as_tuple)
 {
+    PyObject *result=NULL;
+
     BEGIN_SAFE_CALL
 
-    Lock lock(self->bridge->mutex, std::try_to_lock);
-    if (not lock.owns_lock()) {
-        _wait_for_lock(lock);
+    SharedLock lock(&self->header->mutex);
+    SharedHeader *header = self->header;
+    auto ready = [header, nb_of_items]() {
+        return header->count >= static_cast<std::uint64_t>(nb_of_items);
+    };
+    if (not _shared_wait(self, lock, &header->empty_cond, block, timeout,
+                         ready, EmptyError)) {
+        return NULL;
     }
 
-    if (not _wait_for_items(self, block, timeout, lock, 1)) {
+    if (as_tuple and (result = PyTuple_New(nb_of_items)) == NULL) {
         return NULL;
     }
 
-    PyObject *item = self->bridge->queue.front();
-    self->bridge->queue.pop_front();
-    self->bridge->full_cond.notify_one();
-    return item;
+    for (long int i=0; i<nb_of_items; i++) {
+        std::uint64_t offset = _shared_take(self);
+        SharedRecordHeader *record = _record_at(self, offset);
+        PyObject *item = PyBytes_FromStringAndSize(
+                reinterpret_cast<char*>(record + 1), record->size);
+
+        /* Release it also on error, it's gone either way */
+        _shared_release(self, offset);
+        if (item == NULL) {
+            Py_XDECREF(result);
+            return NULL;
+        }
+
+        if (not as_tuple) {
+            return item;
+        }
+        PyTuple_SET_ITEM(result, i, item);
+    }
+    return result;
 
     END_SAFE_CALL("Error in get: %s", NULL)
 }
 
 static PyObject*
-Queue_get(Queue *self, PyObject *args, PyObject *kwargs)
+SharedQueue_get(SharedQueue *self, PyObject *args, PyObject *kwargs)
 {
 
     PyObject *py_block=NULL;
@@ -469,7 +8419,7 @@ Queue_get(Queue *self, PyObject *args, PyObject *kwargs)
 
     bool block=true;
     double timeout = 0;
-    
+
     if(not PyArg_ParseTupleAndKeywords(
                                 args,
                                 kwargs,
@@ -481,19 +8431,31 @@ Queue_get(Queue *self, PyObject *args, PyObject *kwargs)
         return NULL;
     }
 
+    if (not _shared_check(self)) {
+        return NULL;
+    }
+
     if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
         return NULL;
     }
-    return _internal_get(self, block, timeout);
+    return _shared_internal_get(self, block, timeout, 1, false);
 }
 
 static PyObject*
-Queue_get_many(Queue *self, PyObject *args, PyObject *kwargs)
+SharedQueue_get_nowait(SharedQueue *self)
+{
+    if (not _shared_check(self)) {
+        return NULL;
+    }
+    return _shared_internal_get(self, false, 0, 1, false);
+}
+
+static PyObject*
+SharedQueue_get_many(SharedQueue *self, PyObject *args, PyObject *kwargs)
 {
 
     PyObject *py_block=NULL;
     PyObject *py_timeout=NULL;
-    PyObject *result_tuple=NULL;
 
     bool block=true;
     double timeout = 0;
@@ -502,7 +8464,7 @@ Queue_get_many(Queue *self, PyObject *args, PyObject *kwargs)
     if(not PyArg_ParseTupleAndKeywords(
                                 args,
                                 kwargs,
-                                "l|OO:get",
+                                "l|OO:get_many",
                                 const_cast<char**>(get_many_kwlist),
                                 &items,
                                 &py_block,
@@ -511,6 +8473,10 @@ Queue_get_many(Queue *self, PyObject *args, PyObject *kwargs)
         return NULL;
     }
 
+    if (not _shared_check(self)) {
+        return NULL;
+    }
+
     if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
         return NULL;
     }
@@ -526,164 +8492,189 @@ Queue_get_many(Queue *self, PyObject *args, PyObject *kwargs)
                 items);
     }
 
-
-    if (self->maxsize > 0 and static_cast<size_t>(items) > self->maxsize) {
+    /* Every record takes at least its header, more can never fit */
+    std::uint64_t capacity = self->header->capacity;
+    if (static_cast<std::uint64_t>(items) > capacity / _record_total(0)) {
         return PyErr_Format(
                 PyExc_ValueError,
-                "you want to get %ld but maxsize is %i",
+                "%ld items are bigger than the queue size: %llu",
                 items,
-                self->maxsize);
-    }
-
-    BEGIN_SAFE_CALL
-
-    Lock lock(self->bridge->mutex, std::try_to_lock);
-    if (not lock.owns_lock()) {
-        _wait_for_lock(lock);
+                static_cast<unsigned long long>(capacity));
     }
-
-    if (not _wait_for_items(self, block, timeout, lock, items)) {
-        return NULL;
-    }
-
-    if ((result_tuple = PyTuple_New(items)) == NULL) {
-        return NULL;
-    }
-
-    for (long int i=0; i<items; i++) {
-        PyObject *item = self->bridge->queue.front();
-        PyTuple_SET_ITEM(result_tuple, i, item);
-
-        self->bridge->queue.pop_front();
-    }
-
-    self->bridge->full_cond.notify_all();
-    return result_tuple;
-
-
-    END_SAFE_CALL("Error in get_many: %s", NULL)
+    return _shared_internal_get(self, block, timeout, items, true);
 }
 
-static PyObject*
-Queue_qsize(Queue *self)
+static void
+SharedRecord_dealloc(SharedRecord *self)
 {
-    return PyLong_FromSize_t(self->bridge->queue.size());
+    if (self->queue) {
+        SharedLock lock(&self->queue->header->mutex);
+        _shared_release(self->queue, self->offset);
+    }
+    Py_XDECREF(self->queue);
+    PyObject_Del(self);
 }
 
-static PyObject*
-Queue_empty(Queue *self)
+static int
+SharedRecord_getbuffer(SharedRecord *self, Py_buffer *view, int flags)
 {
-    if (self->bridge->queue.size() == 0) {
-        Py_RETURN_TRUE;
-    }
-    Py_RETURN_FALSE;
+    SharedRecordHeader *record = _record_at(self->queue, self->offset);
+    return PyBuffer_FillInfo(
+            view,
+            reinterpret_cast<PyObject*>(self),
+            reinterpret_cast<char*>(record + 1),
+            self->size,
+            1,
+            flags);
 }
 
+static PyBufferProcs SharedRecord_as_buffer = {
+    (getbufferproc)SharedRecord_getbuffer, /* bf_getbuffer */
+    0,                                     /* bf_releasebuffer */
+};
+
+static PyTypeObject SharedRecordType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "ax_utils.ax_queue._SharedRecord", /*tp_name*/
+    sizeof(SharedRecord),      /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)SharedRecord_dealloc, /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    &SharedRecord_as_buffer,   /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT,        /*tp_flags*/
+    "",                        /* tp_doc */
+};
+/* Zero copy get: memoryview on the record inside the segment */
 static PyObject*
-Queue_full(Queue *self)
+SharedQueue_get_view(SharedQueue *self, PyObject *args, PyObject *kwargs)
 {
-    if (self->maxsize == 0) {
-        Py_RETURN_FALSE;
+
+    PyObject *py_block=NULL;
+    PyObject *py_timeout=NULL;
+
+    bool block=true;
+    double timeout = 0;
+    SharedRecord *record;
+
+    if(not PyArg_ParseTupleAndKeywords(
+                                args,
+                                kwargs,
+                                "|OO:get_view",
+                                const_cast<char**>(get_kwlist),
+                                &py_block,
+                                &py_timeout))
+    {
+        return NULL;
     }
 
-    if (self->bridge->queue.size() < self->maxsize) {
-        Py_RETURN_FALSE;
+    if (not _shared_check(self)) {
+        return NULL;
     }
-    Py_RETURN_TRUE;
-}
 
-static PyObject*
-Queue_put_nowait(Queue *self, PyObject *item)
-{
-    return _internal_put(self, item, false, 0);
-}
+    if (_parse_block_and_timeout(py_block, py_timeout, block, timeout) == -1) {
+        return NULL;
+    }
 
-static PyObject*
-Queue_get_nowait(Queue *self)
-{
-    return _internal_get(self, false, 0);
-}
+    record = PyObject_New(SharedRecord, &SharedRecordType);
+    if (record == NULL) {
+        return NULL;
+    }
+    record->queue = NULL;
 
-static PyObject*
-Queue_task_done(Queue *self)
-{
     BEGIN_SAFE_CALL
 
-    Lock lock(self->bridge->mutex, std::try_to_lock);
-    if (not lock.owns_lock()) {
-        _wait_for_lock(lock);
-    }
+    {
+        SharedLock lock(&self->header->mutex);
+        SharedHeader *header = self->header;
+        auto ready = [header]() {
+            return header->count > 0;
+        };
+        if (not _shared_wait(self, lock, &header->empty_cond, block, timeout,
+                             ready, EmptyError)) {
+            Py_DECREF(record);
+            return NULL;
+        }
 
-    if (self->unfinished_tasks == 0) {
-        return PyErr_Format(
-                    PyExc_ValueError, "task_done() called too many times");
+        record->offset = _shared_take(self);
+        record->size = _record_at(self, record->offset)->size;
+        Py_INCREF(self);
+        record->queue = self;
     }
 
-    if (--self->unfinished_tasks == 0) {
-        self->bridge->all_tasks_done_cond.notify_all();
-    }
+    PyObject *view = PyMemoryView_FromObject(reinterpret_cast<PyObject*>(record));
+    Py_DECREF(record);
+    return view;
 
-    END_SAFE_CALL("Error in task_done: %s", NULL)
-    Py_RETURN_NONE;
+    END_SAFE_CALL("Error in get_view: %s", NULL)
 }
 
-static void
-_blocked_wait_all_tasks_done(Queue* self, Lock& lock)
+static PyObject*
+SharedQueue_qsize(SharedQueue *self)
 {
-    AllowThreads raii_lock;
-    self->bridge->all_tasks_done_cond.wait(lock);
+    if (not _shared_check(self)) {
+        return NULL;
+    }
+    return PyLong_FromUnsignedLongLong(__atomic_load_n(&self->header->count, __ATOMIC_RELAXED));
 }
 
 static PyObject*
-Queue_join(Queue* self)
+SharedQueue_empty(SharedQueue *self)
 {
-    BEGIN_SAFE_CALL
-
-    Lock lock(self->bridge->mutex, std::try_to_lock);
-    if (not lock.owns_lock()) {
-        _wait_for_lock(lock);
+    if (not _shared_check(self)) {
+        return NULL;
     }
 
-    while (self->unfinished_tasks) {
-        _blocked_wait_all_tasks_done(self, lock);
+    if (__atomic_load_n(&self->header->count, __ATOMIC_RELAXED) == 0) {
+        Py_RETURN_TRUE;
     }
-
-    END_SAFE_CALL("Error in join: %s", NULL)
-    Py_RETURN_NONE;
+    Py_RETURN_FALSE;
 }
 
-static PyMethodDef Queue_methods[] = {
-    {"put", (PyCFunction)Queue_put, METH_VARARGS|METH_KEYWORDS, ""},
-    {"get", (PyCFunction)Queue_get, METH_VARARGS|METH_KEYWORDS, ""},
-    {"qsize", (PyCFunction)Queue_qsize, METH_NOARGS, ""},
-    {"empty", (PyCFunction)Queue_empty, METH_NOARGS, ""},
-    {"full", (PyCFunction)Queue_full, METH_NOARGS, ""},
-    {"put_nowait", (PyCFunction)Queue_put_nowait, METH_O, ""},
-    {"get_nowait", (PyCFunction)Queue_get_nowait, METH_NOARGS, ""},
-    {"put_many", (PyCFunction)Queue_put_many, METH_VARARGS|METH_KEYWORDS, ""},
-    {"get_many", (PyCFunction)Queue_get_many, METH_VARARGS|METH_KEYWORDS, ""},
-    {"task_done", (PyCFunction)Queue_task_done, METH_NOARGS, ""},
-    {"join", (PyCFunction)Queue_join, METH_NOARGS, ""},
+static PyMethodDef SharedQueue_methods[] = {
+    {"put", (PyCFunction)SharedQueue_put, METH_VARARGS|METH_KEYWORDS, ""},
+    {"get", (PyCFunction)SharedQueue_get, METH_VARARGS|METH_KEYWORDS, ""},
+    {"get_view", (PyCFunction)SharedQueue_get_view, METH_VARARGS|METH_KEYWORDS, ""},
+    {"qsize", (PyCFunction)SharedQueue_qsize, METH_NOARGS, ""},
+    {"empty", (PyCFunction)SharedQueue_empty, METH_NOARGS, ""},
+    {"put_nowait", (PyCFunction)SharedQueue_put_nowait, METH_O, ""},
+    {"get_nowait", (PyCFunction)SharedQueue_get_nowait, METH_NOARGS, ""},
+    {"put_many", (PyCFunction)SharedQueue_put_many, METH_VARARGS|METH_KEYWORDS, ""},
+    {"get_many", (PyCFunction)SharedQueue_get_many, METH_VARARGS|METH_KEYWORDS, ""},
     {NULL, NULL, 0, NULL}
 };
 
 static PyObject *
-Queue_maxsize_get(Queue *self, void *closure)
+SharedQueue_size_get(SharedQueue *self, void *closure)
 {
-    return PyLong_FromSize_t(self->maxsize);
+    if (not _shared_check(self)) {
+        return NULL;
+    }
+    return PyLong_FromUnsignedLongLong(self->header->capacity);
 }
 
-static PyGetSetDef Queue_getsets[] = {
-    {const_cast<char*>("maxsize"), (getter)Queue_maxsize_get, NULL, const_cast<char*>(""), NULL},
+static PyGetSetDef SharedQueue_getsets[] = {
+    {const_cast<char*>("size"), (getter)SharedQueue_size_get, NULL, const_cast<char*>(""), NULL},
     {NULL, NULL, NULL, NULL, NULL}
 };
 
-static PyTypeObject QueueType = {
+static PyTypeObject SharedQueueType = {
     PyVarObject_HEAD_INIT(NULL, 0)
-    "ax_utils.ax_queue.Queue", /*tp_name*/
-    sizeof(Queue),             /*tp_basicsize*/
+    "ax_utils.ax_queue.SharedQueue", /*tp_name*/
+    sizeof(SharedQueue),       /*tp_basicsize*/
     0,                         /*tp_itemsize*/
-    (destructor)Queue_dealloc, /*tp_dealloc*/
+    (destructor)SharedQueue_dealloc, /*tp_dealloc*/
     0,                         /*tp_print*/
     0,                         /*tp_getattr*/
     0,                         /*tp_setattr*/
@@ -698,33 +8689,35 @@ static PyTypeObject QueueType = {
     0,                         /*tp_getattro*/
     0,                         /*tp_setattro*/
     0,                         /*tp_as_buffer*/
-    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC,/*tp_flags*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE, /*tp_flags*/
     "",                        /* tp_doc */
-    (traverseproc)Queue_traverse,   /* tp_traverse */
-    (inquiry)Queue_clear,           /* tp_clear */
+    0,                         /* tp_traverse */
+    0,                         /* tp_clear */
     0,                         /* tp_richcompare */
     0,                         /* tp_weaklistoffset */
     0,                         /* tp_iter */
     0,                         /* tp_iternext */
-    Queue_methods,             /* tp_methods */
+    SharedQueue_methods,       /* tp_methods */
     0,                         /* tp_members */
-    Queue_getsets,             /* tp_getset */
+    SharedQueue_getsets,       /* tp_getset */
     0,                         /* tp_base */
     0,                         /* tp_dict */
     0,                         /* tp_descr_get */
     0,                         /* tp_descr_set */
     0,                         /* tp_dictoffset */
-    (initproc)Queue_init,      /* tp_init */
+    (initproc)SharedQueue_init, /* tp_init */
     0,                         /* tp_alloc */
-    Queue_new,                 /* tp_new */
+    SharedQueue_new,           /* tp_new */
 };
 
+#endif
+
 static struct PyModuleDef moduledef = {
     PyModuleDef_HEAD_INIT,          /* m_base */
     "_ax_queue",  /* m_name */
     "",                             /* m_doc */
     -1,                             /* m_size */
-    NULL,                           /* m_methods */
+    module_methods,                 /* m_methods */
 };
 
 
@@ -734,11 +8727,54 @@ MODULE_INIT_FUNC(_ax_queue)
     PyObject* std_lib_queue;
     PyObject* std_empty;
     PyObject* std_full;
+    PyObject* time_module;
 
     if (PyType_Ready(&QueueType) < 0) {
         return NULL;
     }
 
+    if (PyType_Ready(&SPSCQueueType) < 0) {
+        return NULL;
+    }
+
+    if (PyType_Ready(&PriorityQueueType) < 0) {
+        return NULL;
+    }
+
+    if (PyType_Ready(&ShardedQueueType) < 0) {
+        return NULL;
+    }
+
+    if (PyType_Ready(&DelayQueueType) < 0) {
+        return NULL;
+    }
+
+    if (PyType_Ready(&CoalescingQueueType) < 0) {
+        return NULL;
+    }
+
+    if (PyType_Ready(&BroadcastQueueType) < 0) {
+        return NULL;
+    }
+
+    if (PyType_Ready(&BroadcastSubscriberType) < 0) {
+        return NULL;
+    }
+
+    if (PyType_Ready(&TypedQueueType) < 0) {
+        return NULL;
+    }
+
+#ifndef _WIN32
+    if (PyType_Ready(&SharedQueueType) < 0) {
+        return NULL;
+    }
+
+    if (PyType_Ready(&SharedRecordType) < 0) {
+        return NULL;
+    }
+#endif
+
     module = PyModule_Create(&moduledef);
     if (module == NULL) {
         return NULL;
@@ -748,6 +8784,11 @@ MODULE_INIT_FUNC(_ax_queue)
         return NULL;
     }
 
+    if((time_module = PyImport_ImportModule("time")) == NULL) {
+        Py_DECREF(std_lib_queue);
+        return NULL;
+    }
+
     if((std_empty = PyObject_GetAttrString(std_lib_queue, "Empty")) == NULL) {
         Py_DECREF(std_lib_queue);
         return NULL;
@@ -774,11 +8815,43 @@ MODULE_INIT_FUNC(_ax_queue)
     Py_DECREF(std_empty);
     Py_DECREF(std_full);
 
+    if ((monotonic_func = PyObject_GetAttrString(time_module, "monotonic")) == NULL) {
+        Py_DECREF(time_module);
+        return NULL;
+    }
+    Py_DECREF(time_module);
+
     PyModule_AddObject(module, "Empty", EmptyError);
     PyModule_AddObject(module, "Full", FullError);
 
     Py_INCREF((PyObject*) &QueueType);
     PyModule_AddObject(module, "Queue", (PyObject*)&QueueType);
 
+    Py_INCREF((PyObject*) &SPSCQueueType);
+    PyModule_AddObject(module, "SPSCQueue", (PyObject*)&SPSCQueueType);
+
+    Py_INCREF((PyObject*) &PriorityQueueType);
+    PyModule_AddObject(module, "PriorityQueue", (PyObject*)&PriorityQueueType);
+
+    Py_INCREF((PyObject*) &ShardedQueueType);
+    PyModule_AddObject(module, "ShardedQueue", (PyObject*)&ShardedQueueType);
+
+    Py_INCREF((PyObject*) &DelayQueueType);
+    PyModule_AddObject(module, "DelayQueue", (PyObject*)&DelayQueueType);
+
+    Py_INCREF((PyObject*) &CoalescingQueueType);
+    PyModule_AddObject(module, "CoalescingQueue", (PyObject*)&CoalescingQueueType);
+
+    Py_INCREF((PyObject*) &BroadcastQueueType);
+    PyModule_AddObject(module, "BroadcastQueue", (PyObject*)&BroadcastQueueType);
+
+    Py_INCREF((PyObject*) &TypedQueueType);
+    PyModule_AddObject(module, "TypedQueue", (PyObject*)&TypedQueueType);
+
+#ifndef _WIN32
+    Py_INCREF((PyObject*) &SharedQueueType);
+    PyModule_AddObject(module, "SharedQueue", (PyObject*)&SharedQueueType);
+#endif
+
     return module;
 }
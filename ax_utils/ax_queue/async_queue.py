@@ -0,0 +1,95 @@
+"""asyncio adapter for AXQueue.
+
+threads keep using the native queue (`AsyncAXQueue.queue`) with the normal
+blocking calls, coroutines await `get()`/`put()` of the adapter:
+
+aq = AsyncAXQueue()
+
+# thread
+aq.queue.put(item)
+
+# coroutine
+item = await aq.get()
+
+Instead of parking an executor thread per waiting coroutine, the adapter
+registers a file descriptor of the queue with the event loop. It is readable
+as long as the queue is not empty (not full for `put()`), so a put() of any
+thread wakes up the loop. The fd is only created on first use, plain queues
+don't pay anything for it.
+"""
+
+import asyncio
+import collections
+
+from ._ax_queue import Empty, Full, Queue
+
+
+class AsyncAXQueue:
+    def __init__(self, maxsize=0, queue=None):
+        self.queue = Queue(maxsize) if queue is None else queue
+        self._getters = collections.deque()
+        self._putters = collections.deque()
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def empty(self):
+        return self.queue.empty()
+
+    def full(self):
+        return self.queue.full()
+
+    def put_nowait(self, item):
+        self.queue.put_nowait(item)
+
+    def get_nowait(self):
+        return self.queue.get_nowait()
+
+    def task_done(self, n=1):
+        self.queue.task_done(n)
+
+    async def get(self):
+        while True:
+            try:
+                return self.queue.get_nowait()
+            except Empty:
+                pass
+            await self._wait(self._getters, self.queue.fileno())
+
+    async def put(self, item):
+        while True:
+            try:
+                return self.queue.put_nowait(item)
+            except Full:
+                pass
+            await self._wait(self._putters, self.queue._writable_fd())
+
+    async def _wait(self, waiters, fd):
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        waiters.append(waiter)
+        if len(waiters) == 1:
+            loop.add_reader(fd, self._wakeup, loop, waiters, fd)
+
+        try:
+            await waiter
+        finally:
+            try:
+                waiters.remove(waiter)
+            except ValueError:
+                pass
+
+            if not waiters:
+                loop.remove_reader(fd)
+
+    def _wakeup(self, loop, waiters, fd):
+        # The fd is level triggered: wake up one waiter per loop iteration
+        # until the condition is gone or nobody waits anymore.
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+        if not waiters:
+            loop.remove_reader(fd)
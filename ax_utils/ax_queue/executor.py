@@ -0,0 +1,191 @@
+"""concurrent.futures.Executor running on an AXQueue.
+
+with Executor(max_workers=8) as executor:
+    future = executor.submit(fn, 1, 2)
+    results = list(executor.map(fn, range(1000)))
+
+Unlike ThreadPoolExecutor the workers don't take one work item per wakeup:
+they take up to `batch_size` items with a single `get_up_to()`, so the
+queue lock and the GIL hand-off are paid once per batch. A worker takes no
+more than its fair share of the backlog, so slow tasks still run in
+parallel. `map()` submits its
+work items with `put_many()` in chunks of `chunksize`. Besides the lock of
+each future nothing is locked on the Python level once the workers run.
+"""
+
+import concurrent.futures
+import itertools
+import os
+import threading
+import time
+import weakref
+
+from ._ax_queue import Queue
+
+# Ends a worker, every worker puts it back for the next one
+_SHUTDOWN = None
+
+# Like ThreadPoolExecutor the workers finish the queued work at interpreter
+# exit, although they are daemon threads
+_threads_queues = weakref.WeakKeyDictionary()
+_interpreter_shutdown = False
+_global_shutdown_lock = threading.Lock()
+
+
+def _python_exit():
+    global _interpreter_shutdown
+    with _global_shutdown_lock:
+        _interpreter_shutdown = True
+    items = list(_threads_queues.items())
+    for _, queue in items:
+        queue.put(_SHUTDOWN)
+    for t, _ in items:
+        t.join()
+
+
+threading._register_atexit(_python_exit)
+
+
+def _worker(executor_reference, queue, batch_size, threads):
+    while True:
+        # Wait for one item, then take the fair share of the backlog
+        batch = (queue.get(),)
+        share = min(batch_size, queue.qsize() // len(threads))
+        if share > 1 and batch[0] is not _SHUTDOWN:
+            batch += queue.get_up_to(share - 1, False)
+
+        for work_item in batch:
+            if work_item is _SHUTDOWN:
+                queue.put(_SHUTDOWN)
+                return
+
+            future, fn, args, kwargs = work_item
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as exc:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+        # don't keep the last batch (and its results) alive while waiting
+        batch = work_item = future = None
+
+        # The executor was collected without shutdown(), its weakref callback
+        # queued _SHUTDOWN. Pass it on as soon as the backlog is done.
+        if executor_reference() is None and queue.empty():
+            queue.put(_SHUTDOWN)
+            return
+
+
+class Executor(concurrent.futures.Executor):
+    def __init__(self, max_workers=None, thread_name_prefix='', batch_size=16):
+        if max_workers is None:
+            max_workers = min(32, (os.cpu_count() or 1) + 4)
+        if max_workers <= 0:
+            raise ValueError('max_workers must be greater than 0')
+        if batch_size <= 0:
+            raise ValueError('batch_size must be greater than 0')
+
+        self._max_workers = max_workers
+        self._batch_size = batch_size
+        self._thread_name_prefix = thread_name_prefix or 'AXExecutor-%d' % id(self)
+        self._queue = Queue()
+        self._threads = []
+        self._shutdown = False
+        self._shutdown_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = concurrent.futures.Future()
+        self._put_many([(future, fn, args, kwargs)])
+        return future
+
+    def map(self, fn, *iterables, timeout=None, chunksize=64):
+        if chunksize < 1:
+            raise ValueError('chunksize must be >= 1.')
+        end_time = None if timeout is None else timeout + time.monotonic()
+
+        futures = []
+        arguments = zip(*iterables)
+        while True:
+            chunk = [
+                (concurrent.futures.Future(), fn, args, {})
+                for args in itertools.islice(arguments, chunksize)
+            ]
+            if not chunk:
+                break
+            self._put_many(chunk)
+            futures.extend(work_item[0] for work_item in chunk)
+
+        def result_iterator():
+            try:
+                futures.reverse()
+                while futures:
+                    if end_time is None:
+                        yield futures.pop().result()
+                    else:
+                        yield futures.pop().result(end_time - time.monotonic())
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        return result_iterator()
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._shutdown_lock:
+            if not self._shutdown:
+                self._shutdown = True
+                if cancel_futures:
+                    self._cancel_pending()
+                self._queue.put(_SHUTDOWN)
+            threads = list(self._threads)
+
+        if wait:
+            for t in threads:
+                t.join()
+
+    def _put_many(self, work_items):
+        with self._shutdown_lock, _global_shutdown_lock:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            if _interpreter_shutdown:
+                raise RuntimeError(
+                    'cannot schedule new futures after interpreter shutdown'
+                )
+            if len(self._threads) < self._max_workers:
+                self._start_workers(len(work_items))
+            self._queue.put_many(work_items)
+
+    def _start_workers(self, nb_of_items):
+        # Like ThreadPoolExecutor start threads on demand, not all upfront
+        missing = min(nb_of_items, self._max_workers - len(self._threads))
+
+        # The workers must not keep the executor alive, when it is collected
+        # without shutdown() the callback ends them
+        def weakref_cb(_, queue=self._queue):
+            queue.put(_SHUTDOWN)
+
+        for _ in range(missing):
+            t = threading.Thread(
+                name='%s_%d' % (self._thread_name_prefix, len(self._threads)),
+                target=_worker,
+                args=(
+                    weakref.ref(self, weakref_cb),
+                    self._queue,
+                    self._batch_size,
+                    self._threads,
+                ),
+                daemon=True,
+            )
+            self._threads.append(t)
+            t.start()
+            _threads_queues[t] = self._queue
+
+    def _cancel_pending(self):
+        while True:
+            work_items = self._queue.get_up_to(1024, False)
+            if not work_items:
+                return
+            for future, _, _, _ in work_items:
+                future.cancel()
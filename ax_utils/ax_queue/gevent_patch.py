@@ -15,16 +15,307 @@ Which means: greenlet-2 never gets scheduled.
 Keep in mind. Gevent is cooperative multitasking. All greenlets run in the same
 thread and a blocking call needs to give control back to the event-loop.
 A C++ std::mutex is *NOT* doing that!!!
+
+Therefore `patch()` replaces AXQueue by the `Queue` subclass below. In a
+thread running a gevent hub it never blocks inside C++: it tries the
+non-blocking variant (the mutex is only held for the queue operation itself)
+and otherwise waits on the notifier fd of the queue with a hub io watcher.
+All other OS threads keep using the native blocking calls on the same queue
+and wake up the greenlets through that fd.
+
+AXPriorityQueue, AXDelayQueue, CoalescingQueue and TypedQueue have no fd,
+their subclasses below poll the non-blocking calls with a backoff of up to
+10ms. join() polls as well and wait_any() waits for the fds of the queues.
+SPSCQueue, ShardedQueue, BroadcastQueue and AXSharedQueue are not patched,
+their blocking calls still block the hub: only use them with block=False or
+from other OS threads.
 """
 
 import importlib
+import time
 
+import gevent
 import gevent.monkey
 import gevent.queue
+import gevent.select
+from gevent._hub_local import get_hub_if_exists
+from gevent.socket import wait_read
+
+try:
+    from ._ax_queue import (
+        CoalescingQueue as AXCoalescingQueue,
+        DelayQueue as AXDelayQueue,
+        Empty,
+        Full,
+        PriorityQueue as AXPriorityQueue,
+        Queue as AXQueue,
+        TypedQueue as AXTypedQueue,
+        wait_any as _wait_any,
+    )
+except ImportError:
+    AXQueue = None
+
+# Upper bound for the sleep between two attempts if there is no fd to wait on
+_MAX_BACKOFF = 0.01
+
+
+class _TimeoutExpired(Exception):
+    pass
+
+
+def _cooperative(block, timeout):
+    # No hub in this thread => nothing to yield to, block natively
+    return block and timeout != 0 and get_hub_if_exists() is not None
+
+
+def _polling(method, exc_type, *names):
+    """Cooperative variant of a blocking method by polling it non-blocking.
+
+    names are the parameters of method in order, the C++ methods carry no
+    signature. The arguments are bound to them and passed on as keywords.
+    """
+
+    def wrapper(self, *args, **kwargs):
+        if len(args) > len(names):
+            raise TypeError(
+                f'{method.__name__}() takes at most {len(names)} arguments '
+                f'({len(args)} given)'
+            )
+        for name in names[: len(args)]:
+            if name in kwargs:
+                raise TypeError(
+                    f'{method.__name__}() got multiple values for argument {name!r}'
+                )
+        kwargs.update(zip(names, args))
+        block = kwargs.pop('block', True)
+        timeout = kwargs.pop('timeout', None)
+        if not _cooperative(block, timeout):
+            return method(self, block=block, timeout=timeout, **kwargs)
+        return self._wait(
+            lambda: method(self, block=False, timeout=None, **kwargs),
+            (),
+            exc_type,
+            None,
+            timeout,
+        )
+
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+if AXQueue is not None:
+
+    class _Cooperative:
+        def join(self, timeout=None):
+            if not _cooperative(True, timeout):
+                return super().join(timeout)
+
+            deadline = None if timeout is None else time.monotonic() + timeout
+            backoff = 0
+            while not super().join(0):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                backoff = self._sleep(None, remaining, backoff)
+            return True
+
+        def _wait(self, attempt, args, exc_type, fd, timeout):
+            deadline = None if timeout is None else time.monotonic() + timeout
+            backoff = 0
+            while True:
+                try:
+                    return attempt(*args)
+                except exc_type:
+                    pass
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise exc_type('Queue Empty' if exc_type is Empty else 'Queue Full')
+                backoff = self._sleep(fd, remaining, backoff)
+
+        @staticmethod
+        def _sleep(fd, remaining, backoff):
+            """Yield to the hub until fd is readable or for a growing backoff.
+
+            The fds are level triggered ("not empty", "not full"). Batch calls
+            need more than one item or slot, hence they poll with a backoff.
+            """
+            if fd is not None:
+                try:
+                    wait_read(fd, remaining, _TimeoutExpired)
+                except _TimeoutExpired:
+                    pass
+                return 0
+
+            backoff = min(_MAX_BACKOFF, backoff * 2 or 0.0001)
+            gevent.sleep(backoff if remaining is None else min(backoff, remaining))
+            return backoff
+
+    class Queue(_Cooperative, AXQueue):
+        def get(self, block=True, timeout=None):
+            if not _cooperative(block, timeout):
+                return AXQueue.get(self, block, timeout)
+            return self._wait(
+                AXQueue.get_nowait, (self,), Empty, self.fileno(), timeout
+            )
+
+        def put(self, item, block=True, timeout=None):
+            if not _cooperative(block, timeout):
+                return AXQueue.put(self, item, block, timeout)
+            return self._wait(
+                AXQueue.put_nowait, (self, item), Full, self._writable_fd(), timeout
+            )
+
+        def get_many(self, items, block=True, timeout=None):
+            if not _cooperative(block, timeout):
+                return AXQueue.get_many(self, items, block, timeout)
+            return self._wait(
+                AXQueue.get_many, (self, items, False), Empty, None, timeout
+            )
+
+        def put_many(self, items, block=True, timeout=None, atomic=True):
+            if not _cooperative(block, timeout):
+                return AXQueue.put_many(self, items, block, timeout, atomic)
+            if not atomic:
+                return self._put_many_streaming(items, timeout)
+            return self._wait(
+                AXQueue.put_many, (self, items, False), Full, None, timeout
+            )
+
+        def _put_many_streaming(self, items, timeout):
+            # A non blocking attempt only pulls items from an iterator for free
+            # slots, so it is resumed where it stopped, a list at an index
+            is_sequence = isinstance(items, (list, tuple))
+            if not is_sequence and self.maxweight:
+                if timeout is not None:
+                    raise ValueError(
+                        'put_many(atomic=False) with block=False or a timeout '
+                        'needs a list or tuple on a queue with maxweight'
+                    )
+                items, is_sequence = list(items), True
+
+            exhausted = []
+            if not is_sequence:
+                items = self._until_exhausted(items, exhausted)
+
+            deadline = None if timeout is None else time.monotonic() + timeout
+            done = 0
+            backoff = 0
+            while True:
+                if is_sequence:
+                    done += AXQueue.put_many(self, items[done:], False, None, False)
+                    finished = done == len(items)
+                else:
+                    done += AXQueue.put_many(self, items, False, None, False)
+                    finished = bool(exhausted)
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if finished or (remaining is not None and remaining <= 0):
+                    return done
+                backoff = self._sleep(self._writable_fd(), remaining, backoff)
+
+        @staticmethod
+        def _until_exhausted(items, exhausted):
+            yield from items
+            exhausted.append(True)
+
+        def get_up_to(self, max_items, block=True, timeout=None, min_items=1):
+            if not _cooperative(block, timeout) or min_items == 0:
+                return AXQueue.get_up_to(self, max_items, block, timeout, min_items)
+
+            deadline = None if timeout is None else time.monotonic() + timeout
+            fd = self.fileno() if min_items == 1 else None
+            backoff = 0
+            while True:
+                # A timeout is not an error for get_up_to
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if self.qsize() >= min_items or (
+                    remaining is not None and remaining <= 0
+                ):
+                    return AXQueue.get_up_to(self, max_items, False, None, min_items)
+                backoff = self._sleep(fd, remaining, backoff)
+
+        def get_matching(self, key, block=True, timeout=None, attr=None, index=None):
+            if not _cooperative(block, timeout):
+                return AXQueue.get_matching(self, key, block, timeout, attr, index)
+            # readable only means "not empty", the match has to be polled
+            return self._wait(
+                AXQueue.get_matching,
+                (self, key, False, None, attr, index),
+                Empty,
+                None,
+                timeout,
+            )
+
+    _GET = ('block', 'timeout')
+    _GET_MANY = ('items', 'block', 'timeout')
+
+    class PriorityQueue(_Cooperative, AXPriorityQueue):
+        get = _polling(AXPriorityQueue.get, Empty, *_GET)
+        put = _polling(
+            AXPriorityQueue.put, Full, 'item', 'block', 'timeout', 'priority'
+        )
+        get_many = _polling(AXPriorityQueue.get_many, Empty, *_GET_MANY)
+        put_many = _polling(
+            AXPriorityQueue.put_many, Full, 'items', 'block', 'timeout', 'priorities'
+        )
+
+    class DelayQueue(_Cooperative, AXDelayQueue):
+        get = _polling(AXDelayQueue.get, Empty, *_GET)
+        put = _polling(AXDelayQueue.put, Full, 'item', 'block', 'timeout', 'delay')
+        put_at = _polling(
+            AXDelayQueue.put_at, Full, 'item', 'deadline', 'block', 'timeout'
+        )
+        # returns all due items, it takes no count
+        get_many = _polling(AXDelayQueue.get_many, Empty, *_GET)
+
+    class CoalescingQueue(_Cooperative, AXCoalescingQueue):
+        get = _polling(AXCoalescingQueue.get, Empty, *_GET)
+        put = _polling(AXCoalescingQueue.put, Full, 'key', 'value', 'block', 'timeout')
+
+    class TypedQueue(_Cooperative, AXTypedQueue):
+        get = _polling(AXTypedQueue.get, Empty, *_GET)
+        put = _polling(AXTypedQueue.put, Full, 'item', 'block', 'timeout')
+        get_many = _polling(
+            AXTypedQueue.get_many, Empty, 'items', 'block', 'timeout', 'asarray'
+        )
+        put_many = _polling(AXTypedQueue.put_many, Full, 'items', 'block', 'timeout')
+
+    def wait_any(queues, timeout=None):
+        """wait_any() which waits for the fds of the queues in the hub."""
+        if not _cooperative(True, timeout):
+            return _wait_any(queues, timeout)
+
+        queues = list(queues)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                return _wait_any(queues, 0)
+            except Empty:
+                pass
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise Empty('Queue Empty')
+            gevent.select.select(
+                [queue.fileno() for queue in queues], [], [], remaining
+            )
 
 
 def patch(event=None):
     to_patch = importlib.import_module('ax_utils.ax_queue')
-    gevent.monkey.patch_item(to_patch, 'AXQueue', gevent.queue.Queue)
-    gevent.monkey.patch_item(to_patch, 'Full', gevent.queue.Full)
-    gevent.monkey.patch_item(to_patch, 'Empty', gevent.queue.Empty)
+    if AXQueue is None:
+        # no C++ queue, fall back to the pure gevent implementation
+        gevent.monkey.patch_item(to_patch, 'AXQueue', gevent.queue.Queue)
+        gevent.monkey.patch_item(to_patch, 'Full', gevent.queue.Full)
+        gevent.monkey.patch_item(to_patch, 'Empty', gevent.queue.Empty)
+        return
+
+    # ax_queue.Empty/Full are subclasses of queue.Empty/Full, which gevent
+    # uses as well. So they are kept.
+    gevent.monkey.patch_item(to_patch, 'AXQueue', Queue)
+    gevent.monkey.patch_item(to_patch, 'AXPriorityQueue', PriorityQueue)
+    gevent.monkey.patch_item(to_patch, 'AXDelayQueue', DelayQueue)
+    gevent.monkey.patch_item(to_patch, 'CoalescingQueue', CoalescingQueue)
+    gevent.monkey.patch_item(to_patch, 'TypedQueue', TypedQueue)
+    gevent.monkey.patch_item(to_patch, 'wait_any', wait_any)
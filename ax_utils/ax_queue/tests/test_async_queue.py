@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import time
+from unittest import TestCase
+
+from ax_utils.ax_queue import AsyncAXQueue, AXQueue, Empty
+
+
+class TestAsyncAXQueue(TestCase):
+    def run_async(self, coro):
+        return asyncio.run(asyncio.wait_for(coro, 10))
+
+    def test_get_put(self):
+        async def main():
+            aq = AsyncAXQueue(2)
+            await aq.put(1)
+            await aq.put(2)
+            self.assertTrue(aq.full())
+            return [await aq.get(), await aq.get()]
+
+        self.assertEqual([1, 2], self.run_async(main()))
+
+    def test_thread_producer_wakes_coroutine(self):
+        aq = AsyncAXQueue()
+
+        def producer():
+            for x in range(100):
+                time.sleep(0.001)
+                aq.queue.put(x)
+
+        async def main():
+            t = threading.Thread(target=producer)
+            t.start()
+            result = [await aq.get() for _ in range(100)]
+            t.join()
+            return result
+
+        self.assertEqual(list(range(100)), self.run_async(main()))
+
+    def test_many_waiting_coroutines(self):
+        aq = AsyncAXQueue(queue=AXQueue())
+
+        async def main():
+            getters = [asyncio.ensure_future(aq.get()) for _ in range(50)]
+            await asyncio.sleep(0.01)
+            threading.Thread(target=aq.queue.put_many, args=(range(50),)).start()
+            return sorted(await asyncio.gather(*getters))
+
+        self.assertEqual(list(range(50)), self.run_async(main()))
+
+    def test_put_waits_for_thread_consumer(self):
+        aq = AsyncAXQueue(1)
+
+        async def main():
+            await aq.put(1)
+            putter = asyncio.ensure_future(aq.put(2))
+            await asyncio.sleep(0.01)
+            self.assertFalse(putter.done())
+
+            threading.Thread(target=aq.queue.get).start()
+            await putter
+            return aq.get_nowait()
+
+        self.assertEqual(2, self.run_async(main()))
+
+    def test_cancelled_getter_does_not_lose_items(self):
+        aq = AsyncAXQueue()
+
+        async def main():
+            getter = asyncio.ensure_future(aq.get())
+            await asyncio.sleep(0.01)
+            getter.cancel()
+            aq.put_nowait('x')
+            return await aq.get()
+
+        self.assertEqual('x', self.run_async(main()))
+        with self.assertRaises(Empty):
+            aq.get_nowait()
@@ -0,0 +1,173 @@
+import gc
+import os
+import threading
+import weakref
+from unittest import TestCase, skipIf
+
+from ax_utils.ax_queue import BroadcastQueue, Empty, Full
+
+in_gevent = os.environ.get('ENFORCE_GEVENT_DURING_BUILD_TESTS')
+
+
+class Item:
+    pass
+
+
+class TestBroadcastQueue(TestCase):
+    def test_every_subscriber_gets_every_item(self):
+        q = BroadcastQueue()
+        a = q.subscribe()
+        b = q.subscribe()
+        self.assertEqual(2, q.subscribers)
+
+        for i in range(3):
+            q.put(i)
+        self.assertEqual(3, q.qsize())
+
+        self.assertEqual([0, 1, 2], [a.get() for _ in range(3)])
+        self.assertTrue(a.empty())
+        self.assertEqual(3, b.qsize())
+        self.assertEqual(0, b.get_nowait())
+        self.assertEqual(2, q.qsize())
+
+        with self.assertRaises(Empty):
+            a.get_nowait()
+        with self.assertRaises(Empty):
+            a.get(True, 0.01)
+
+    def test_items_are_freed_by_the_slowest_subscriber(self):
+        q = BroadcastQueue()
+        a = q.subscribe()
+        b = q.subscribe()
+
+        item = Item()
+        ref = weakref.ref(item)
+        q.put(item)
+        del item
+
+        a.get()
+        self.assertIsNotNone(ref())
+        b.get()
+        self.assertIsNone(ref())
+        self.assertEqual(0, q.qsize())
+
+    def test_subscribe_close(self):
+        q = BroadcastQueue()
+        # nobody would read it
+        q.put(1)
+        self.assertEqual(0, q.qsize())
+
+        a = q.subscribe()
+        q.put(2)
+        b = q.subscribe()
+        q.put(3)
+        self.assertEqual(2, a.qsize())
+        self.assertEqual(1, b.qsize())
+
+        a.close()
+        self.assertTrue(a.closed)
+        self.assertEqual(1, q.subscribers)
+        self.assertEqual(1, q.qsize())
+        with self.assertRaises(ValueError):
+            a.get()
+        a.close()
+
+        self.assertEqual(3, b.get())
+        del b
+        self.assertEqual(0, q.subscribers)
+
+    def test_drop_oldest(self):
+        q = BroadcastQueue(2, overflow='drop_oldest')
+        slow = q.subscribe()
+        fast = q.subscribe()
+
+        for i in range(5):
+            q.put(i)
+            self.assertEqual(i, fast.get())
+        self.assertEqual(2, q.qsize())
+        self.assertEqual(3, slow.dropped)
+        self.assertEqual(0, fast.dropped)
+        self.assertEqual([3, 4], [slow.get(), slow.get()])
+
+        with self.assertRaises(ValueError):
+            BroadcastQueue(overflow='drop_oldest')
+        with self.assertRaises(ValueError):
+            BroadcastQueue(2, overflow='drop_newest')
+
+    def test_block_full(self):
+        q = BroadcastQueue(2)
+        a = q.subscribe()
+        b = q.subscribe()
+        q.put(1)
+        q.put_nowait(2)
+        self.assertTrue(q.full())
+
+        # b is not behind, a still holds the items
+        b.get()
+        b.get()
+        with self.assertRaises(Full):
+            q.put_nowait(3)
+        with self.assertRaises(Full):
+            q.put(3, True, 0.01)
+
+        a.get()
+        q.put_nowait(3)
+
+    def test_cycle_is_collected(self):
+        q = BroadcastQueue()
+        subscriber = q.subscribe()
+        item = Item()
+        item.subscriber = subscriber
+        q.put(item)
+        ref = weakref.ref(item)
+        del q, subscriber, item
+        gc.collect()
+        self.assertIsNone(ref())
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_threads(self):
+        q = BroadcastQueue(16)
+        subscribers = [q.subscribe() for _ in range(4)]
+        results = [[] for _ in subscribers]
+
+        def consume(subscriber, result):
+            while True:
+                item = subscriber.get()
+                if item is None:
+                    return
+                result.append(item)
+
+        threads = [
+            threading.Thread(target=consume, args=args)
+            for args in zip(subscribers, results)
+        ]
+        for t in threads:
+            t.start()
+        for i in range(1000):
+            q.put(i)
+        q.put(None)
+        for t in threads:
+            t.join()
+
+        for result in results:
+            self.assertEqual(list(range(1000)), result)
+        self.assertEqual(0, q.qsize())
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_close_wakes_up_get(self):
+        q = BroadcastQueue()
+        subscriber = q.subscribe()
+        errors = []
+
+        def consume():
+            try:
+                subscriber.get()
+            except ValueError as exc:
+                errors.append(exc)
+
+        t = threading.Thread(target=consume)
+        t.start()
+        t.join(0.05)
+        subscriber.close()
+        t.join()
+        self.assertEqual(1, len(errors))
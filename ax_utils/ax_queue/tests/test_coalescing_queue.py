@@ -0,0 +1,124 @@
+import os
+import threading
+from unittest import TestCase, skipIf
+
+from ax_utils.ax_queue import CoalescingQueue, Empty, Full
+
+in_gevent = os.environ.get('ENFORCE_GEVENT_DURING_BUILD_TESTS')
+
+
+class TestCoalescingQueue(TestCase):
+    def test_get_put(self):
+        q = CoalescingQueue()
+        q.put('a', 1)
+        q.put('b', 2)
+        q.put_nowait('c', 3)
+        self.assertEqual(3, q.qsize())
+        self.assertEqual(('a', 1), q.get())
+        self.assertEqual(('b', 2), q.get_nowait())
+        self.assertEqual(('c', 3), q.get(False))
+        self.assertTrue(q.empty())
+
+        with self.assertRaises(Empty):
+            q.get(True, 0.01)
+
+    def test_latest_value_wins(self):
+        q = CoalescingQueue()
+        q.put('a', 1)
+        q.put('b', 1)
+        q.put('a', 2)
+        q.put('a', 3)
+        self.assertEqual(2, q.qsize())
+        self.assertEqual(2, q.coalesced)
+
+        # 'a' keeps its place in the queue
+        self.assertEqual(('a', 3), q.get())
+        self.assertEqual(('b', 1), q.get())
+
+        # a consumed key is queued again
+        q.put('a', 4)
+        self.assertEqual(('a', 4), q.get())
+
+    def test_maxsize(self):
+        q = CoalescingQueue(1)
+        self.assertEqual(1, q.maxsize)
+        q.put('a', 1)
+        self.assertTrue(q.full())
+
+        with self.assertRaises(Full):
+            q.put('b', 1, True, 0.01)
+
+        with self.assertRaises(Full):
+            q.put_nowait('b', 1)
+
+        # replacing a queued value never blocks
+        q.put('a', 2, False)
+        self.assertEqual(('a', 2), q.get())
+
+    def test_replaced_value_is_released_without_lock(self):
+        q = CoalescingQueue()
+        released = []
+
+        class Value:
+            def __del__(self):
+                # join() takes the lock of the queue
+                released.append(q.join(0))
+
+        def replace():
+            q.put('a', Value())
+            q.put('a', 2)
+
+        t = threading.Thread(target=replace, daemon=True)
+        t.start()
+        t.join(5)
+        self.assertFalse(t.is_alive())
+        self.assertEqual([False], released)
+        self.assertEqual(('a', 2), q.get())
+
+    def test_unhashable_key(self):
+        q = CoalescingQueue()
+        with self.assertRaises(TypeError):
+            q.put([], 1)
+        self.assertTrue(q.empty())
+
+    def test_task_done_join(self):
+        q = CoalescingQueue()
+        with self.assertRaises(ValueError):
+            q.task_done()
+
+        q.put('a', 1)
+        q.put('a', 2)
+        q.get()
+        q.task_done()
+        q.join()
+
+        with self.assertRaises(ValueError):
+            q.task_done()
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_producer_consumer(self):
+        q = CoalescingQueue(4)
+        latest = {}
+
+        def producer():
+            for x in range(2000):
+                q.put(x % 8, x)
+
+        def consumer():
+            while True:
+                key, value = q.get(True, 10)
+                if key is None:
+                    return
+                self.assertGreater(value, latest.get(key, -1))
+                latest[key] = value
+
+        threads = [
+            threading.Thread(target=producer),
+            threading.Thread(target=consumer),
+        ]
+        [t.start() for t in threads]
+        threads[0].join()
+        q.put(None, None)
+        threads[1].join()
+
+        self.assertEqual(set(range(1992, 2000)), set(latest.values()))
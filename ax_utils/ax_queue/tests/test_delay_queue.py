@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from unittest import TestCase, skipIf
+
+from ax_utils.ax_queue import AXDelayQueue, Empty, Full
+
+in_gevent = os.environ.get('ENFORCE_GEVENT_DURING_BUILD_TESTS')
+
+
+class TestDelayQueue(TestCase):
+    def test_without_delay(self):
+        q = AXDelayQueue()
+        q.put(1)
+        q.put(2)
+        q.put_nowait(3)
+        self.assertEqual(3, q.qsize())
+        self.assertEqual(1, q.get())
+        self.assertEqual(2, q.get_nowait())
+        self.assertEqual(3, q.get(False))
+        self.assertTrue(q.empty())
+
+        with self.assertRaises(Empty):
+            q.get(True, 0.01)
+
+    def test_items_not_due(self):
+        q = AXDelayQueue()
+        q.put(1, delay=60)
+        self.assertEqual(1, q.qsize())
+        self.assertFalse(q.empty())
+
+        with self.assertRaises(Empty):
+            q.get_nowait()
+
+        start = time.monotonic()
+        with self.assertRaises(Empty):
+            q.get(True, 0.05)
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_deadline_order(self):
+        q = AXDelayQueue()
+        q.put('c', delay=0.06)
+        q.put('a', delay=-1)
+        q.put_at('b', time.monotonic() + 0.03)
+        q.put('d', delay=0.06)
+
+        start = time.monotonic()
+        self.assertEqual(['a', 'b', 'c', 'd'], [q.get() for _ in range(4)])
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+    def test_get_waits_for_deadline(self):
+        q = AXDelayQueue()
+        q.put_at(1, time.monotonic() + 0.05)
+        start = time.monotonic()
+        self.assertEqual(1, q.get(True, 5))
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+    def test_get_many(self):
+        q = AXDelayQueue()
+        q.put(1)
+        q.put(2, delay=-0.5)
+        q.put(3, delay=60)
+        self.assertEqual((2, 1), q.get_many())
+        self.assertEqual(1, q.qsize())
+
+        with self.assertRaises(Empty):
+            q.get_many(False)
+
+        q.put(4, delay=0.02)
+        self.assertEqual((4,), q.get_many(True, 5))
+
+    def test_maxsize(self):
+        q = AXDelayQueue(1)
+        self.assertEqual(1, q.maxsize)
+        q.put(1, delay=60)
+        self.assertTrue(q.full())
+
+        with self.assertRaises(Full):
+            q.put(2, False)
+
+        with self.assertRaises(Full):
+            q.put_nowait(2)
+
+    def test_invalid_delay(self):
+        q = AXDelayQueue()
+        with self.assertRaises(ValueError):
+            q.put(1, delay=float('nan'))
+
+        with self.assertRaises(OverflowError):
+            q.put(1, delay=1e300)
+
+        with self.assertRaises(TypeError):
+            q.put_at(1)
+        self.assertTrue(q.empty())
+
+    def test_task_done_join(self):
+        q = AXDelayQueue()
+        with self.assertRaises(ValueError):
+            q.task_done()
+
+        q.put(1)
+        q.get()
+        q.task_done()
+        q.join()
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_earlier_put_wakes_getter(self):
+        q = AXDelayQueue()
+        q.put('late', delay=60)
+        result = []
+
+        def getter():
+            result.append(q.get(True, 10))
+
+        t = threading.Thread(target=getter)
+        t.start()
+        time.sleep(0.05)
+        q.put('now')
+        t.join(5)
+        self.assertFalse(t.is_alive())
+        self.assertEqual(['now'], result)
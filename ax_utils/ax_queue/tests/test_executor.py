@@ -0,0 +1,145 @@
+import gc
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import CancelledError, TimeoutError, wait
+from unittest import TestCase, skipIf
+
+from ax_utils.ax_queue import Executor
+
+in_gevent = os.environ.get('ENFORCE_GEVENT_DURING_BUILD_TESTS')
+
+
+@skipIf(in_gevent, 'gevent, we cannot block on queue')
+class TestExecutor(TestCase):
+    def test_submit(self):
+        with Executor(max_workers=2) as executor:
+            future = executor.submit(pow, 2, exp=8)
+            self.assertEqual(256, future.result(5))
+
+    def test_exception(self):
+        with Executor(max_workers=2) as executor:
+            future = executor.submit(int, 'x')
+            with self.assertRaises(ValueError):
+                future.result(5)
+
+    def test_map(self):
+        with Executor(max_workers=4) as executor:
+            self.assertEqual(
+                [x * y for x, y in zip(range(1000), range(5, 1005))],
+                list(executor.map(lambda x, y: x * y, range(1000), range(5, 1005))),
+            )
+            self.assertEqual([], list(executor.map(abs, [])))
+
+            with self.assertRaises(ValueError):
+                executor.map(abs, [1], chunksize=0)
+
+    def test_map_timeout(self):
+        with Executor(max_workers=1) as executor:
+            results = executor.map(time.sleep, [0.5, 0])
+            with self.assertRaises(TimeoutError):
+                list(executor.map(time.sleep, [0.5], timeout=0.01))
+            list(results)
+
+    def test_workers_run_in_parallel(self):
+        barrier = threading.Barrier(3, timeout=5)
+        with Executor(max_workers=3, batch_size=1) as executor:
+            futures = [executor.submit(barrier.wait) for _ in range(3)]
+            self.assertEqual({0, 1, 2}, {f.result(5) for f in futures})
+        self.assertEqual(3, len(executor._threads))
+
+    def test_map_runs_blocking_tasks_in_parallel(self):
+        # a worker must not keep a whole batch while others are idle
+        barrier = threading.Barrier(4, timeout=5)
+        with Executor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: barrier.wait(), range(4)))
+        self.assertEqual([0, 1, 2, 3], sorted(results))
+
+        with Executor(max_workers=8) as executor:
+            start = time.monotonic()
+            list(executor.map(time.sleep, [0.2] * 8))
+            self.assertLess(time.monotonic() - start, 1)
+
+    def test_pending_work_finishes_at_exit(self):
+        code = (
+            'import time\n'
+            'from ax_utils.ax_queue import Executor\n'
+            'executor = Executor(max_workers=1)\n'
+            'for i in range(3):\n'
+            '    executor.submit(time.sleep, 0.05)\n'
+            'executor.submit(print, "done")\n'
+        )
+        out = subprocess.run(
+            [sys.executable, '-c', code], capture_output=True, timeout=30, check=True
+        )
+        self.assertEqual(b'done\n', out.stdout)
+
+    def test_shutdown(self):
+        executor = Executor(max_workers=2)
+        futures = [executor.submit(time.sleep, 0.001) for _ in range(20)]
+        executor.shutdown()
+        self.assertTrue(all(f.done() for f in futures))
+        self.assertFalse(any(t.is_alive() for t in executor._threads))
+
+        with self.assertRaises(RuntimeError):
+            executor.submit(abs, 1)
+
+        # twice is fine
+        executor.shutdown()
+
+    def test_collected_executor_ends_its_workers(self):
+        before = threading.active_count()
+        for _ in range(5):
+            executor = Executor(max_workers=4)
+            self.assertEqual(list(range(8)), list(executor.map(abs, range(8))))
+        del executor
+        gc.collect()
+
+        deadline = time.monotonic() + 5
+        while threading.active_count() > before and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(before, threading.active_count())
+
+        # the queued work still runs
+        executor = Executor(max_workers=1)
+        futures = [executor.submit(time.sleep, 0.01) for _ in range(5)]
+        del executor
+        gc.collect()
+        wait(futures, 5)
+        self.assertTrue(all(f.done() for f in futures))
+
+    def test_shutdown_cancel_futures(self):
+        executor = Executor(max_workers=1)
+        event = threading.Event()
+        first = executor.submit(event.wait, 5)
+        while not first.running():
+            time.sleep(0.001)
+
+        pending = [executor.submit(abs, 1) for _ in range(10)]
+        threading.Timer(0.05, event.set).start()
+        executor.shutdown(cancel_futures=True)
+
+        self.assertTrue(first.result())
+        self.assertTrue(all(f.cancelled() for f in pending))
+        with self.assertRaises(CancelledError):
+            pending[0].result()
+
+    def test_cancelled_future_is_skipped(self):
+        calls = []
+        event = threading.Event()
+        with Executor(max_workers=1) as executor:
+            blocker = executor.submit(event.wait, 5)
+            future = executor.submit(calls.append, 1)
+            self.assertTrue(future.cancel())
+            event.set()
+            wait([blocker])
+        self.assertEqual([], calls)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            Executor(max_workers=0)
+
+        with self.assertRaises(ValueError):
+            Executor(batch_size=0)
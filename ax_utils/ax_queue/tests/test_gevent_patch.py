@@ -0,0 +1,214 @@
+import threading
+import time
+from unittest import TestCase, skipIf
+
+try:
+    import gevent
+
+    from ax_utils.ax_queue import gevent_patch
+except ImportError:
+    gevent = None
+
+import ax_utils.ax_queue
+from ax_utils.ax_queue import Empty, Full
+
+
+@skipIf(gevent is None, 'gevent is not installed')
+class TestGeventQueue(TestCase):
+    def test_greenlets_do_not_block_the_loop(self):
+        q = gevent_patch.Queue()
+        consumer = gevent.spawn(q.get)
+        producer = gevent.spawn(q.put, 'x')
+
+        gevent.joinall([consumer, producer], timeout=5, raise_error=True)
+        self.assertEqual('x', consumer.value)
+
+    def test_bounded_put_yields(self):
+        q = gevent_patch.Queue(1)
+        q.put(1)
+        producer = gevent.spawn(q.put, 2)
+        gevent.sleep(0.01)
+        self.assertFalse(producer.ready())
+
+        self.assertEqual(1, q.get())
+        producer.join(5)
+        self.assertEqual(2, q.get())
+
+    def test_timeouts(self):
+        q = gevent_patch.Queue(1)
+        ticker = gevent.spawn(lambda: [gevent.sleep(0.01) for _ in range(2)])
+
+        with self.assertRaises(Empty):
+            q.get(timeout=0.05)
+        self.assertTrue(ticker.ready())
+
+        q.put(1)
+        with self.assertRaises(Full):
+            q.put(2, timeout=0.05)
+
+        q = gevent_patch.Queue()
+        q.put(1)
+        with self.assertRaises(Empty):
+            q.get_many(2, timeout=0.05)
+        self.assertEqual((1,), q.get_up_to(5, timeout=0.05, min_items=2))
+
+    def test_get_matching_yields(self):
+        q = gevent_patch.Queue()
+        q.put(('a', 1))
+        consumer = gevent.spawn(q.get_matching, 'b', index=0)
+        gevent.sleep(0.01)
+        self.assertFalse(consumer.ready())
+
+        q.put(('b', 2))
+        consumer.join(5)
+        self.assertEqual(('b', 2), consumer.value)
+        self.assertEqual(('a', 1), q.get_nowait())
+
+        with self.assertRaises(Empty):
+            q.get_matching('c', timeout=0.05)
+
+    def test_put_many_not_atomic_yields(self):
+        q = gevent_patch.Queue(3)
+        producer = gevent.spawn(q.put_many, (i for i in range(10)), atomic=False)
+        got = []
+        while len(got) < 10:
+            got.extend(q.get_many(1))
+        producer.join(5)
+        self.assertEqual(10, producer.value)
+        self.assertEqual(list(range(10)), got)
+
+        q.put_many([1, 2, 3])
+        self.assertEqual(0, q.put_many([4], timeout=0.05, atomic=False))
+
+    def test_put_many_not_atomic_resumes_iterator(self):
+        q = gevent_patch.Queue(3)
+        items = iter(range(10))
+        producer = gevent.spawn(q.put_many, items, timeout=0.05, atomic=False)
+        producer.join(5)
+        self.assertEqual(3, producer.value)
+        self.assertEqual([0, 1, 2], q.drain())
+        self.assertEqual(3, next(items))
+
+    def test_os_thread_wakes_greenlet(self):
+        q = gevent_patch.Queue()
+
+        def producer():
+            time.sleep(0.05)
+            q.put_many(range(10))
+
+        threading.Thread(target=producer).start()
+        consumer = gevent.spawn(q.get_many, 10)
+        consumer.join(5)
+        self.assertEqual(tuple(range(10)), consumer.value)
+
+    def test_os_thread_blocks_natively(self):
+        q = gevent_patch.Queue()
+        result = []
+        t = threading.Thread(target=lambda: result.append(q.get(True, 5)))
+        t.start()
+        gevent.spawn(q.put, 'y').join()
+        t.join()
+        self.assertEqual(['y'], result)
+
+    def test_join_yields(self):
+        q = gevent_patch.Queue()
+        q.put(1)
+        self.assertFalse(q.join(0.02))
+
+        waiter = gevent.spawn(q.join)
+        gevent.sleep(0.01)
+        self.assertFalse(waiter.ready())
+        q.get()
+        q.task_done()
+        waiter.join(5)
+        self.assertTrue(waiter.value)
+
+    def test_wait_any_yields(self):
+        queues = [gevent_patch.Queue(), gevent_patch.Queue()]
+        waiter = gevent.spawn(gevent_patch.wait_any, queues)
+        gevent.sleep(0.01)
+        self.assertFalse(waiter.ready())
+
+        gevent.spawn(queues[1].put, 'x').join()
+        waiter.join(5)
+        self.assertEqual((1, 'x'), waiter.value)
+
+        with self.assertRaises(Empty):
+            gevent_patch.wait_any(queues, 0.02)
+
+    def test_other_queues_yield(self):
+        priority = gevent_patch.PriorityQueue()
+        delay = gevent_patch.DelayQueue()
+        coalescing = gevent_patch.CoalescingQueue()
+        typed = gevent_patch.TypedQueue('d', 1)
+        consumers = [
+            gevent.spawn(priority.get),
+            gevent.spawn(delay.get),
+            gevent.spawn(coalescing.get),
+            gevent.spawn(typed.get_many, 1, True, None, False),
+        ]
+        gevent.sleep(0.01)
+        self.assertFalse(any(consumer.ready() for consumer in consumers))
+
+        priority.put('p', priority=1)
+        delay.put('d', delay=0.01)
+        coalescing.put('k', 'c')
+        typed.put(1.5)
+        producer = gevent.spawn(typed.put, 2.5)
+        gevent.joinall(consumers + [producer], timeout=5, raise_error=True)
+        self.assertEqual('p', consumers[0].value)
+        self.assertEqual('d', consumers[1].value)
+        self.assertEqual(('k', 'c'), consumers[2].value)
+        self.assertEqual([1.5], list(consumers[3].value))
+        self.assertEqual(2.5, typed.get(timeout=0.01))
+
+        typed.put(3.5)
+        with self.assertRaises(Full):
+            typed.put(4.5, timeout=0.02)
+        with self.assertRaises(Empty):
+            delay.get(True, 0.02)
+
+    def test_other_queues_take_keywords(self):
+        priority = gevent_patch.PriorityQueue()
+        priority.put(item=2)
+        priority.put(1, timeout=1)
+        self.assertEqual((1, 2), priority.get_many(items=2, timeout=1))
+
+        delay = gevent_patch.DelayQueue()
+        delay.put_at('x', deadline=time.monotonic())
+        delay.put(item='y', block=False)
+        self.assertEqual(('x', 'y'), delay.get_many(timeout=1))
+
+        coalescing = gevent_patch.CoalescingQueue()
+        coalescing.put('k', value='c')
+        coalescing.put(key='k', value='d', timeout=1)
+        self.assertEqual(('k', 'd'), coalescing.get(block=True, timeout=1))
+
+        typed = gevent_patch.TypedQueue('d')
+        typed.put_many(items=[1.5, 2.5])
+        self.assertEqual((1.5, 2.5), typed.get_many(2, timeout=1, asarray=False))
+
+        with self.assertRaises(TypeError):
+            coalescing.put('k', key='k')
+        with self.assertRaises(TypeError):
+            priority.put(1, True, None, None, 'extra')
+
+    def test_patch_keeps_native_queue(self):
+        names = [
+            'AXQueue',
+            'AXPriorityQueue',
+            'AXDelayQueue',
+            'CoalescingQueue',
+            'TypedQueue',
+            'wait_any',
+        ]
+        originals = {name: getattr(ax_utils.ax_queue, name) for name in names}
+        try:
+            gevent_patch.patch()
+            self.assertIs(gevent_patch.Queue, ax_utils.ax_queue.AXQueue)
+            self.assertIs(gevent_patch.DelayQueue, ax_utils.ax_queue.AXDelayQueue)
+            self.assertIs(gevent_patch.wait_any, ax_utils.ax_queue.wait_any)
+            self.assertIs(Empty, ax_utils.ax_queue.Empty)
+        finally:
+            for name, original in originals.items():
+                setattr(ax_utils.ax_queue, name, original)
@@ -0,0 +1,147 @@
+import os
+import threading
+from unittest import TestCase, skipIf
+
+from ax_utils.ax_queue import AXPriorityQueue as PriorityQueue, Empty, Full
+
+in_gevent = os.environ.get('ENFORCE_GEVENT_DURING_BUILD_TESTS')
+
+
+class Flaky:
+    # comparisons left before __lt__ raises, None => never
+    budget = None
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        if Flaky.budget is not None:
+            if Flaky.budget == 0:
+                raise RuntimeError('comparison failed')
+            Flaky.budget -= 1
+        return self.value < other.value
+
+
+class TestPriorityQueue(TestCase):
+    def test_numeric_priority(self):
+        q = PriorityQueue()
+        q.put('c', priority=3)
+        q.put('a', priority=1)
+        q.put('b', priority=2.5)
+        q.put('a2', priority=1)
+
+        self.assertEqual(['a', 'a2', 'b', 'c'], [q.get() for _ in range(4)])
+        self.assertTrue(q.empty())
+
+    def test_items_without_priority_are_compared(self):
+        q = PriorityQueue()
+        for x in (5, 1, 4, 2, 3):
+            q.put(x)
+        self.assertEqual((1, 2, 3, 4, 5), q.get_many(5))
+
+    def test_mixing_is_rejected(self):
+        q = PriorityQueue()
+        q.put('a', priority=1)
+        with self.assertRaises(TypeError):
+            q.put('b')
+
+        q.get()
+        q.put('b')
+        with self.assertRaises(TypeError):
+            q.put('a', priority=1)
+
+    def test_invalid_priority(self):
+        q = PriorityQueue()
+        with self.assertRaises(TypeError):
+            q.put('a', priority='high')
+
+        with self.assertRaises(ValueError):
+            q.put('a', priority=float('nan'))
+
+    def test_failing_comparison_keeps_items(self):
+        q = PriorityQueue()
+        q.put(1)
+        with self.assertRaises(TypeError):
+            q.put('a')
+        self.assertEqual(2, q.qsize())
+
+    def test_failing_comparison_keeps_the_heap(self):
+        q = PriorityQueue()
+        values = [5, 3, 8, 1, 9, 2, 7, 4, 6]
+        q.put_many([Flaky(x) for x in values])
+
+        try:
+            Flaky.budget = 0
+            with self.assertRaises(RuntimeError):
+                q.get()
+
+            # fails in a later pop, the popped items are given back
+            Flaky.budget = 5
+            with self.assertRaises(RuntimeError):
+                q.get_many(len(values))
+        finally:
+            Flaky.budget = None
+
+        self.assertEqual(len(values), q.qsize())
+        self.assertEqual(
+            sorted(values), [item.value for item in q.get_many(len(values))]
+        )
+
+    def test_full_and_empty(self):
+        q = PriorityQueue(2)
+        q.put_nowait('a', 1)
+        q.put('b', priority=0)
+        self.assertTrue(q.full())
+
+        with self.assertRaises(Full):
+            q.put('c', True, 0.1, 5)
+
+        self.assertEqual('b', q.get_nowait())
+        self.assertEqual('a', q.get())
+
+        with self.assertRaises(Empty):
+            q.get(True, 0.1)
+
+    def test_put_many_get_many(self):
+        q = PriorityQueue(10)
+        q.put_many(['x', 'y', 'z'], priorities=[3, 1, 2])
+        self.assertEqual(('y', 'z'), q.get_many(2))
+
+        with self.assertRaisesRegex(ValueError, 'same length'):
+            q.put_many(['x'], priorities=[1, 2])
+
+        with self.assertRaisesRegex(ValueError, 'bigger than maxsize'):
+            q.put_many(range(11))
+
+        with self.assertRaises(Empty):
+            q.get_many(2, block=False)
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_task_done_join(self):
+        q = PriorityQueue()
+        with self.assertRaises(ValueError):
+            q.task_done()
+
+        def worker():
+            while True:
+                item = q.get()
+                q.task_done()
+                if item is None:
+                    break
+
+        t = threading.Thread(target=worker)
+        t.start()
+        q.put_many([1, 2, 3], priorities=[1, 2, 3])
+        q.put(None, priority=10)
+        q.join()
+        t.join()
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_blocking_get(self):
+        q = PriorityQueue()
+        result = []
+        t = threading.Thread(target=lambda: result.append(q.get(True, 10)))
+        t.start()
+        q.put('x', priority=1)
+        t.join()
+        self.assertEqual(['x'], result)
@@ -1,11 +1,39 @@
+import gc
 import os
 import queue as std_queue
+import select
+import sys
+import tempfile
 import threading
 import time
 from subprocess import PIPE, Popen
-from unittest import TestCase
+from unittest import TestCase, skipIf
 
-from ax_utils.ax_queue import AXQueue as Queue, Empty, Full
+from ax_utils.ax_queue import AXQueue as Queue, Empty, Full, wait_any
+
+in_gevent = os.environ.get('ENFORCE_GEVENT_DURING_BUILD_TESTS')
+
+
+def _fail_loading():
+    raise ValueError('cannot load')
+
+
+class Unloadable:
+    def __reduce__(self):
+        return (_fail_loading, ())
+
+
+def _load_reentrant():
+    return ('loaded', Reentrant.queue.join(0))
+
+
+class Reentrant:
+    # pickle and unpickle use the queue, which must not hold its lock then
+    queue = None
+
+    def __reduce__(self):
+        Reentrant.queue.join(0)
+        return (_load_reentrant, ())
 
 
 class TestQueue(TestCase):
@@ -182,6 +210,38 @@ class TestQueue(TestCase):
         rss_usage = int(ps_output.split(b'\n')[1].strip())
         return rss_usage
 
+    def test_fallback_without_extension(self):
+        code = """if True:
+            import sys
+            sys.modules['ax_utils.ax_queue._ax_queue'] = None
+            import queue
+            import ax_utils.ax_queue as ax_queue
+            assert ax_queue.AXQueue is queue.Queue
+            try:
+                from ax_utils.ax_queue import AXDelayQueue
+            except ImportError as e:
+                print(e)
+        """
+        out = Popen([sys.executable, '-c', code], stdout=PIPE).communicate()[0]
+        self.assertIn(b'AXDelayQueue needs the compiled ax_queue extension', out)
+
+    def test_shared_queue_missing_on_windows(self):
+        code = """if True:
+            # import what checks sys.platform itself (gevent, asyncio) first
+            import asyncio
+            import sys
+            import ax_utils
+            sys.platform = 'win32'
+            import ax_utils.ax_queue as ax_queue
+            assert ax_queue.AXQueue is ax_queue._ax_queue.Queue
+            try:
+                from ax_utils.ax_queue import AXSharedQueue
+            except ImportError as e:
+                print(e)
+        """
+        out = Popen([sys.executable, '-c', code], stdout=PIPE).communicate()[0]
+        self.assertIn(b'AXSharedQueue is not available on Windows', out)
+
     def test_axos_237(self):
         """Regression test for AXOS-237 (memory leak in get_many)"""
         q = Queue(100000)
@@ -198,3 +258,795 @@ class TestQueue(TestCase):
         # Memory consumption must not have increased by more than 20 MB.
         # Previously, this would leak 80 MB on a 64 bit machine.
         self.assertLess(rss_after, rss_before + 20000)
+
+    def test_get_up_to_returns_what_is_available(self):
+        q = Queue(10)
+        q.put_many((1, 2, 3))
+
+        self.assertEqual((1, 2), q.get_up_to(2))
+        self.assertEqual((3,), q.get_up_to(5))
+        self.assertEqual((), q.get_up_to(5, block=False))
+        self.assertEqual((), q.get_up_to(5, True, 0.05))
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_get_up_to_waits_for_min_items(self):
+        q = Queue()
+
+        def producer():
+            for x in range(3):
+                time.sleep(0.05)
+                q.put(x)
+
+        t = threading.Thread(target=producer)
+        t.start()
+        self.assertEqual((0, 1), q.get_up_to(10, True, 5, min_items=2))
+        t.join()
+        self.assertEqual((2,), q.get_up_to(10))
+
+    def test_get_up_to_timeout_returns_partial_batch(self):
+        q = Queue()
+        q.put(1)
+        start = time.time()
+        self.assertEqual((1,), q.get_up_to(10, timeout=0.1, min_items=5))
+        self.assertGreaterEqual(time.time() - start, 0.09)
+
+    def test_get_up_to_invalid_arguments(self):
+        q = Queue(2)
+        with self.assertRaises(ValueError):
+            q.get_up_to(-1)
+
+        with self.assertRaisesRegex(ValueError, 'bigger than max_items'):
+            q.get_up_to(1, min_items=2)
+
+        with self.assertRaisesRegex(ValueError, 'maxsize is 2'):
+            q.get_up_to(5, min_items=3)
+
+    def test_stats_disabled(self):
+        q = Queue()
+        with self.assertRaisesRegex(ValueError, 'stats are not enabled'):
+            q.stats()
+
+        with self.assertRaisesRegex(ValueError, 'stats are not enabled'):
+            q.reset_stats()
+
+    def test_stats(self):
+        q = Queue(3, stats=True)
+        q.put(1)
+        q.put_many([2, 3])
+        q.get()
+        q.get_many(2)
+
+        with self.assertRaises(Empty):
+            q.get(timeout=0.01)
+
+        stats = q.stats()
+        self.assertEqual(2, stats['puts'])
+        self.assertEqual(3, stats['items_put'])
+        self.assertEqual(2, stats['max_put_batch'])
+        self.assertEqual(2, stats['gets'])
+        self.assertEqual(3, stats['items_got'])
+        self.assertEqual(2, stats['max_get_batch'])
+        self.assertEqual(3, stats['high_watermark'])
+        self.assertEqual(1, stats['timeouts'])
+        self.assertEqual(1, stats['blocked_empty'])
+        self.assertGreater(stats['blocked_empty_time'], 0)
+        self.assertEqual(stats['blocked_empty_time'], stats['blocked_empty_max'])
+        self.assertEqual(0, stats['blocked_full'])
+
+        q.reset_stats()
+        self.assertEqual(0, sum(q.stats().values()))
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_stats_blocked_full(self):
+        q = Queue(1, stats=True)
+        q.put(1)
+
+        def consumer():
+            time.sleep(0.05)
+            q.get()
+
+        t = threading.Thread(target=consumer)
+        t.start()
+        q.put(2)
+        t.join()
+
+        stats = q.stats()
+        self.assertEqual(1, stats['blocked_full'])
+        self.assertGreater(stats['blocked_full_max'], 0.01)
+        self.assertEqual(0, stats['timeouts'])
+
+    def test_maxweight_bytes(self):
+        q = Queue(maxweight=10)
+        self.assertEqual(10, q.maxweight)
+        q.put(b'12345')
+        q.put(bytearray(b'1234'))
+        self.assertEqual(9, q.weight)
+        self.assertFalse(q.full())
+
+        with self.assertRaises(Full):
+            q.put(b'12', timeout=0.01)
+
+        # anything not bytes-like weighs 1
+        q.put('x')
+        self.assertEqual(10, q.weight)
+        self.assertTrue(q.full())
+
+        self.assertEqual(b'12345', q.get())
+        self.assertEqual(5, q.weight)
+        q.get_many(2)
+        self.assertEqual(0, q.weight)
+
+    def test_maxweight_heavy_item_fits_into_empty_queue(self):
+        q = Queue(maxweight=10)
+        q.put(b'x' * 100)
+        self.assertEqual(100, q.weight)
+
+        with self.assertRaises(Full):
+            q.put_nowait(b'x')
+
+        q.get()
+        q.put_many([b'x' * 6, b'x' * 6])
+        self.assertEqual(12, q.weight)
+
+    def test_weigher(self):
+        q = Queue(maxweight=10, weigher=lambda item: item['size'])
+        q.put_many([{'size': 4}, {'size': 4}])
+        self.assertEqual(8, q.weight)
+
+        with self.assertRaises(Full):
+            q.put_many([{'size': 1}, {'size': 2}], block=False)
+
+        self.assertEqual(({'size': 4},), q.get_up_to(1))
+        self.assertEqual(4, q.weight)
+
+        with self.assertRaises(KeyError):
+            q.put({})
+
+        with self.assertRaisesRegex(ValueError, 'weight must be greater'):
+            q.put({'size': -1})
+        self.assertEqual(1, q.qsize())
+
+    def test_weigher_without_maxweight(self):
+        q = Queue(weigher=len)
+        q.put([1, 2, 3])
+        self.assertEqual(3, q.weight)
+        self.assertEqual(0, Queue().weight)
+
+        with self.assertRaises(TypeError):
+            Queue(weigher=1)
+
+        with self.assertRaises(ValueError):
+            Queue(maxweight=-1)
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_maxweight_blocks_producer(self):
+        q = Queue(maxweight=10)
+        q.put(b'x' * 8)
+
+        def consumer():
+            time.sleep(0.05)
+            q.get()
+
+        t = threading.Thread(target=consumer)
+        t.start()
+        q.put(b'x' * 8, timeout=5)
+        t.join()
+        self.assertEqual(8, q.weight)
+
+    def test_overflow_drop_oldest(self):
+        q = Queue(3, overflow='drop_oldest')
+        for x in range(5):
+            q.put_nowait(x)
+
+        self.assertEqual(2, q.dropped)
+        self.assertEqual((2, 3, 4), q.get_many(3))
+
+        q.put_many(range(3))
+        q.put_many([10, 11])
+        self.assertEqual(4, q.dropped)
+        self.assertEqual((2, 10, 11), q.get_many(3))
+
+        # a batch bigger than maxsize keeps its newest items
+        q.put_many(range(5))
+        self.assertEqual(6, q.dropped)
+        self.assertEqual((2, 3, 4), q.get_many(3))
+
+    def test_overflow_drop_newest(self):
+        q = Queue(3, overflow='drop_newest')
+        for x in range(5):
+            q.put(x)
+
+        self.assertEqual(2, q.dropped)
+        self.assertEqual((0, 1, 2), q.get_many(3))
+
+        q.put(0)
+        q.put_many(range(1, 5))
+        self.assertEqual(4, q.dropped)
+        self.assertEqual((0, 1, 2), q.get_many(3))
+
+    def test_overflow_with_maxweight(self):
+        q = Queue(maxweight=10, overflow='drop_oldest')
+        q.put_many([b'x' * 4, b'y' * 4])
+        q.put(b'z' * 4)
+        self.assertEqual(1, q.dropped)
+        self.assertEqual(8, q.weight)
+        self.assertEqual((b'y' * 4, b'z' * 4), q.get_many(2))
+
+    def test_overflow_dropped_items_are_done(self):
+        q = Queue(2, overflow='drop_oldest')
+        q.put_many(range(4))
+        q.get_many(2)
+        q.task_done()
+        q.task_done()
+        q.join()
+
+        with self.assertRaises(ValueError):
+            q.task_done()
+
+        q = Queue(1, overflow='drop_newest')
+        q.put_many(range(4))
+        q.get()
+        q.task_done()
+        q.join()
+
+    def test_overflow_invalid(self):
+        with self.assertRaisesRegex(ValueError, 'overflow must be'):
+            Queue(1, overflow='ring')
+
+        with self.assertRaisesRegex(ValueError, 'needs maxsize or maxweight'):
+            Queue(overflow='drop_oldest')
+
+    def test_spin_us_invalid(self):
+        with self.assertRaises(ValueError):
+            Queue(spin_us=-1)
+
+    def test_spin_us_timeout(self):
+        q = Queue(1, spin_us=1000)
+        start = time.time()
+        with self.assertRaises(Empty):
+            q.get(timeout=0.05)
+        self.assertGreaterEqual(time.time() - start, 0.04)
+
+        q.put(1)
+        with self.assertRaises(Full):
+            q.put(2, timeout=0.01)
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_spin_us_hand_off(self):
+        count = 2000
+        ping = Queue(1, spin_us=200)
+        pong = Queue(1, spin_us=200)
+
+        def echo():
+            for _ in range(count):
+                pong.put(ping.get())
+
+        t = threading.Thread(target=echo)
+        t.start()
+        for x in range(count):
+            ping.put(x)
+            self.assertEqual(x, pong.get(timeout=5))
+        t.join()
+
+    def _readable(self, q):
+        return bool(select.select([q], [], [], 0)[0])
+
+    def test_fileno(self):
+        q = Queue()
+        fd = q.fileno()
+        self.assertEqual(fd, q.fileno())
+        self.assertFalse(self._readable(q))
+
+        q.put(1)
+        q.put(2)
+        self.assertTrue(self._readable(q))
+        self.assertTrue(self._readable(q))
+
+        q.get()
+        self.assertTrue(self._readable(q))
+        q.get()
+        self.assertFalse(self._readable(q))
+
+        q.put_many(range(3))
+        self.assertTrue(self._readable(q))
+        q.get_many(2)
+        self.assertTrue(self._readable(q))
+        q.get_up_to(5)
+        self.assertFalse(self._readable(q))
+
+    def test_fileno_created_on_demand(self):
+        # items already queued make the new fd readable right away
+        q = Queue(1, overflow='drop_oldest')
+        q.put_many([1, 2])
+        self.assertTrue(self._readable(q))
+        q.get()
+        self.assertFalse(self._readable(q))
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_fileno_wakes_up_poll(self):
+        q = Queue()
+        poller = select.poll()
+        poller.register(q.fileno(), select.POLLIN)
+
+        t = threading.Timer(0.05, q.put, args=('x',))
+        t.start()
+        self.assertTrue(poller.poll(5000))
+        self.assertEqual('x', q.get_nowait())
+        self.assertFalse(poller.poll(0))
+        t.join()
+
+    def test_acyclic(self):
+        items = [[1], [2]]
+        q = Queue()
+        q.put_many(items)
+        self.assertFalse(q.acyclic)
+        self.assertEqual(items, gc.get_referents(q))
+
+        q = Queue(acyclic=True)
+        q.put_many(items)
+        self.assertTrue(q.acyclic)
+        self.assertEqual([], gc.get_referents(q))
+        self.assertEqual(tuple(items), q.get_many(2))
+
+    def test_try_get_try_put(self):
+        q = Queue(2)
+        self.assertIsNone(q.try_get())
+        sentinel = object()
+        self.assertIs(sentinel, q.try_get(sentinel))
+
+        self.assertTrue(q.try_put(1))
+        self.assertTrue(q.try_put(2))
+        self.assertFalse(q.try_put(3))
+        self.assertEqual(2, q.qsize())
+
+        self.assertEqual(1, q.try_get(sentinel))
+        self.assertEqual(2, q.try_get(sentinel))
+        self.assertIs(sentinel, q.try_get(sentinel))
+        q.task_done(2)
+        self.assertTrue(q.join(0))
+
+        with self.assertRaises(TypeError):
+            q.try_get(1, 2)
+        with self.assertRaises(TypeError):
+            q.try_put()
+        with self.assertRaises(TypeError):
+            q.try_get(default=1)
+
+    def test_try_put_overflow_and_weight(self):
+        q = Queue(1, overflow='drop_newest')
+        self.assertTrue(q.try_put(1))
+        self.assertFalse(q.try_put(2))
+        self.assertEqual(1, q.dropped)
+
+        q = Queue(1, overflow='drop_oldest')
+        self.assertTrue(q.try_put(1))
+        self.assertTrue(q.try_put(2))
+        self.assertEqual(2, q.try_get())
+
+        q = Queue(maxweight=4)
+        self.assertTrue(q.try_put(b'abc'))
+        self.assertFalse(q.try_put(b'ab'))
+        self.assertEqual(b'abc', q.try_get())
+        self.assertTrue(q.try_put(b'ab'))
+
+    def test_get_matching(self):
+        class Reply:
+            def __init__(self, request_id):
+                self.request_id = request_id
+
+        q = Queue()
+        replies = [Reply(i) for i in range(3)]
+        q.put_many(replies)
+        q.put_many([(4, 'x'), None, (5, 'y'), 'z'])
+
+        self.assertIs(replies[1], q.get_matching(1, attr='request_id'))
+        self.assertEqual((5, 'y'), q.get_matching(5, index=0))
+        self.assertEqual('z', q.get_matching('z'))
+
+        # the other items keep their order
+        self.assertEqual((replies[0], replies[2], (4, 'x'), None), q.get_many(4))
+
+        with self.assertRaises(Empty):
+            q.get_matching(1, False)
+        with self.assertRaises(Empty):
+            q.get_matching(1, timeout=0.01)
+
+        # unhashable keys and items are compared with ==
+        q.put_many([[1], {'id': 2}])
+        self.assertEqual({'id': 2}, q.get_matching(2, index='id'))
+        self.assertEqual([1], q.get_matching([1]))
+
+        with self.assertRaises(ValueError):
+            q.get_matching(1, attr='a', index=0)
+        with self.assertRaises(TypeError):
+            q.get_matching(1, attr=1)
+
+    def test_get_matching_errors_propagate(self):
+        class Broken:
+            def __eq__(self, other):
+                raise RuntimeError('eq')
+
+            __hash__ = None
+
+        q = Queue()
+        q.put(Broken())
+        with self.assertRaises(RuntimeError):
+            q.get_matching(1)
+        self.assertEqual(1, q.qsize())
+
+    def test_get_matching_weighted(self):
+        q = Queue(maxweight=10)
+        q.put_many([b'aaa', b'bb', b'c'])
+        self.assertEqual(b'bb', q.get_matching(b'bb'))
+        self.assertEqual(4, q.weight)
+        self.assertEqual((b'aaa', b'c'), q.get_many(2))
+        self.assertEqual(0, q.weight)
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_get_matching_waits_for_new_items(self):
+        q = Queue()
+        q.put(('other', 0))
+        results = []
+
+        def consumer(request_id):
+            results.append(q.get_matching(request_id, index=0, timeout=5))
+
+        threads = [threading.Thread(target=consumer, args=(i,)) for i in range(3)]
+        for t in threads:
+            t.start()
+        time.sleep(0.05)
+        for i in reversed(range(3)):
+            q.put((i, 'reply'))
+            time.sleep(0.01)
+        for t in threads:
+            t.join()
+
+        self.assertEqual([(i, 'reply') for i in reversed(range(3))], results)
+        self.assertEqual(('other', 0), q.get_nowait())
+
+    def test_drain_snapshot(self):
+        q = Queue(3)
+        self.assertEqual([], q.drain())
+        self.assertEqual([], q.snapshot())
+
+        q.put_many([1, 2, 3])
+        self.assertEqual([1, 2, 3], q.snapshot())
+        self.assertEqual(3, q.qsize())
+
+        self.assertEqual([1, 2, 3], q.drain())
+        self.assertTrue(q.empty())
+        q.put_many([4, 5, 6])
+        self.assertEqual((4, 5, 6), q.get_many(3))
+
+        # drained items have to be marked as done like got ones
+        self.assertFalse(q.join(0))
+        q.task_done(6)
+        self.assertTrue(q.join(0))
+
+    def test_drain_weighted(self):
+        q = Queue(maxweight=5)
+        q.put_many([b'ab', b'cde'])
+        self.assertEqual([b'ab', b'cde'], q.drain())
+        self.assertEqual(0, q.weight)
+        q.put(b'abcde', False)
+
+    def test_drain_spilled(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            q = Queue(spill_dir=spill_dir, spill_after=2)
+            q.put_many(range(5))
+            self.assertEqual(3, q.spilled)
+            self.assertEqual(list(range(5)), q.snapshot())
+            self.assertEqual(5, q.qsize())
+            self.assertEqual(list(range(5)), q.drain())
+            self.assertEqual(0, q.spilled)
+            self.assertTrue(q.empty())
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_drain_wakes_producers(self):
+        q = Queue(2)
+        q.put_many([1, 2])
+        t = threading.Thread(target=q.put_many, args=([3, 4],))
+        t.start()
+        time.sleep(0.05)
+        self.assertEqual([1, 2], q.drain())
+        t.join(5)
+        self.assertEqual([3, 4], q.drain())
+
+    def test_put_many_not_atomic(self):
+        q = Queue(10)
+        self.assertEqual(0, q.put_many([], atomic=False))
+        self.assertEqual(0, q.put_many(iter([]), atomic=False))
+
+        # bigger than maxsize: put what fits and report it
+        items = list(range(25))
+        self.assertEqual(10, q.put_many(items, False, atomic=False))
+        self.assertEqual(tuple(range(10)), q.get_many(10))
+        self.assertEqual(10, q.put_many(items[10:], timeout=0.01, atomic=False))
+        self.assertEqual(tuple(range(10, 20)), q.get_many(10))
+
+        self.assertEqual(5, q.put_many((i for i in range(5)), atomic=False))
+        self.assertEqual(tuple(range(5)), q.get_many(5))
+
+        with self.assertRaises(TypeError):
+            q.put_many(1, atomic=False)
+
+        def broken():
+            yield 1
+            raise RuntimeError('generator')
+
+        with self.assertRaises(RuntimeError):
+            q.put_many(broken(), atomic=False)
+        self.assertEqual(1, q.get_nowait())
+
+    def test_put_many_not_atomic_weighted(self):
+        q = Queue(maxweight=10)
+        self.assertEqual(
+            3, q.put_many([b'aaaa', b'bbbb', b'cc', b'd'], False, atomic=False)
+        )
+        self.assertEqual(10, q.weight)
+        q.get_many(3)
+
+        # an item heavier than maxweight still goes into an empty queue
+        self.assertEqual(1, q.put_many([b'x' * 20, b'y'], False, atomic=False))
+
+        # an iterator can't be resumed after the weight of a pulled item didn't fit
+        with self.assertRaises(ValueError):
+            q.put_many(iter([b'a']), False, atomic=False)
+
+    def test_put_many_not_atomic_resumes_iterator(self):
+        q = Queue(10)
+        items = iter(range(3000))
+        self.assertEqual(10, q.put_many(items, False, atomic=False))
+        self.assertEqual(0, q.put_many(items, timeout=0.01, atomic=False))
+        self.assertEqual(list(range(10)), q.drain())
+
+        self.assertEqual(10, q.put_many(items, False, atomic=False))
+        self.assertEqual(list(range(10, 20)), q.drain())
+        self.assertEqual(20, next(items))
+
+        # reserved slots which are not used are given back
+        self.assertEqual(3, q.put_many(iter(range(3)), False, atomic=False))
+        self.assertEqual(7, q.put_many(items, False, atomic=False))
+        self.assertTrue(q.full())
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_put_many_streams_into_bounded_queue(self):
+        q = Queue(100)
+        result = []
+
+        def consumer():
+            while len(result) < 10000:
+                result.extend(q.get_up_to(7))
+
+        t = threading.Thread(target=consumer)
+        t.start()
+        self.assertEqual(10000, q.put_many((i for i in range(10000)), atomic=False))
+        t.join()
+        self.assertEqual(list(range(10000)), result)
+
+    def test_spill(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            q = Queue(spill_dir=spill_dir, spill_after=3)
+            q.put_many([{'x': x} for x in range(10)])
+            self.assertEqual(10, q.qsize())
+            self.assertEqual(7, q.spilled)
+            # the segment files are unlinked right away
+            self.assertEqual([], os.listdir(spill_dir))
+
+            self.assertEqual([0, 1, 2, 3], [q.get()['x'] for _ in range(4)])
+            self.assertEqual(6, q.spilled)
+
+            # spilled items are still in the queue, new ones go after them
+            q.put({'x': 10})
+            self.assertEqual(7, q.spilled)
+            self.assertEqual([4, 5, 6], [item['x'] for item in q.get_many(3)])
+            self.assertEqual([7, 8, 9, 10], [item['x'] for item in q.get_up_to(10)])
+            self.assertTrue(q.empty())
+            self.assertEqual(0, q.spilled)
+
+            q.put(1)
+            self.assertEqual(0, q.spilled)
+            self.assertEqual(1, q.get())
+
+    def test_spill_maxsize_counts_spilled_items(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            q = Queue(3, spill_dir=spill_dir, spill_after=1)
+            q.put_many([1, 2, 3])
+            self.assertTrue(q.full())
+            with self.assertRaises(Full):
+                q.put_nowait(4)
+
+    def test_spill_big_items(self):
+        # bigger than a segment
+        big = b'x' * (20 << 20)
+        with tempfile.TemporaryDirectory() as spill_dir:
+            q = Queue(spill_dir=spill_dir, spill_after=0)
+            q.put_many([big, 1, big])
+            self.assertEqual(3, q.spilled)
+            self.assertEqual((big, 1, big), q.get_many(3))
+
+    def test_spill_unpicklable_item(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            q = Queue(spill_dir=spill_dir, spill_after=1)
+            q.put(1)
+            with self.assertRaises(TypeError):
+                q.put(threading.Lock())
+            self.assertEqual(1, q.qsize())
+
+            q.get()
+            q.task_done()
+            q.join()
+
+            # put_many stays all or nothing
+            with self.assertRaises(AttributeError):
+                q.put_many([1, 2, lambda: 0, 3])
+            self.assertEqual(0, q.qsize())
+            self.assertEqual(3, q.put_many(iter([1, 2, 3]), atomic=False))
+            self.assertEqual([1, 2, 3], q.drain())
+
+    def test_spill_unloadable_record(self):
+        unraisable = []
+        hook = sys.unraisablehook
+        sys.unraisablehook = unraisable.append
+        try:
+            with tempfile.TemporaryDirectory() as spill_dir:
+                q = Queue(spill_dir=spill_dir, spill_after=1)
+                q.put_many(['a', 'b', 'c', Unloadable(), 'e'])
+
+                # the good items are returned, the bad one counts as done
+                self.assertEqual(('a', 'b', 'c'), q.get_many(4))
+                self.assertEqual(1, len(unraisable))
+                self.assertEqual(['e'], q.drain())
+                q.task_done(4)
+                self.assertTrue(q.join(0.01))
+
+                q.put_many(['d', Unloadable(), 'f'])
+                self.assertEqual('d', q.get())
+                with self.assertRaisesRegex(ValueError, 'cannot load'):
+                    q.get()
+                self.assertEqual(['f'], q.snapshot())
+                self.assertEqual(('f',), q.get_up_to(2))
+        finally:
+            sys.unraisablehook = hook
+
+    def test_spill_pickle_reenters_queue(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            q = Reentrant.queue = Queue(spill_dir=spill_dir, spill_after=0)
+            try:
+                q.put(Reentrant())
+                q.put_many([Reentrant(), Reentrant()])
+                self.assertEqual([('loaded', False)] * 3, q.snapshot())
+                self.assertEqual(('loaded', False), q.get())
+                self.assertEqual((('loaded', False),) * 2, q.get_many(2))
+            finally:
+                Reentrant.queue = None
+
+    def test_spill_invalid_arguments(self):
+        with self.assertRaisesRegex(ValueError, 'spill_after needs a spill_dir'):
+            Queue(spill_after=1)
+
+        with tempfile.TemporaryDirectory() as spill_dir:
+            with self.assertRaisesRegex(ValueError, 'spill_dir needs spill_after'):
+                Queue(spill_dir=spill_dir)
+
+            with self.assertRaises(ValueError):
+                Queue(1, spill_dir=spill_dir, spill_after=1, overflow='drop_oldest')
+
+            with self.assertRaises(ValueError):
+                Queue(spill_dir=spill_dir, spill_after=1, maxweight=10)
+
+            with self.assertRaises(FileNotFoundError):
+                Queue(spill_dir=os.path.join(spill_dir, 'missing'), spill_after=1)
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_spill_producer_consumer(self):
+        count = 20000
+        received = []
+        with tempfile.TemporaryDirectory() as spill_dir:
+            q = Queue(spill_dir=spill_dir, spill_after=100)
+
+            def producer():
+                for x in range(0, count, 10):
+                    q.put_many([(x + i, 'payload') for i in range(10)])
+
+            def consumer():
+                for _ in range(count):
+                    received.append(q.get(True, 10)[0])
+
+            threads = [
+                threading.Thread(target=producer),
+                threading.Thread(target=consumer),
+            ]
+            [t.start() for t in threads]
+            [t.join() for t in threads]
+
+        self.assertEqual(list(range(count)), received)
+
+    def test_task_done_batch(self):
+        q = Queue()
+        q.put_many(range(5))
+        q.get_many(5)
+        q.task_done(0)
+        q.task_done(3)
+        self.assertFalse(q.join(timeout=0))
+
+        with self.assertRaisesRegex(ValueError, 'called too many times'):
+            q.task_done(3)
+
+        q.task_done(n=2)
+        self.assertTrue(q.join())
+
+        with self.assertRaises(ValueError):
+            q.task_done(-1)
+
+    def test_join_timeout(self):
+        q = Queue()
+        self.assertTrue(q.join(0.01))
+
+        q.put(1)
+        start = time.monotonic()
+        self.assertFalse(q.join(0.05))
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+        with self.assertRaises(ValueError):
+            q.join(-1)
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_join_timeout_wakes_up(self):
+        q = Queue()
+        q.put_many(range(3))
+        q.get_many(3)
+
+        t = threading.Timer(0.05, q.task_done, args=(3,))
+        t.start()
+        self.assertTrue(q.join(timeout=5))
+        t.join()
+
+    def test_wait_any(self):
+        high, low = Queue(), Queue()
+        low.put('low')
+        high.put('high')
+
+        # the first queue with an item wins
+        self.assertEqual((0, 'high'), wait_any([high, low]))
+        self.assertEqual((1, 'low'), wait_any((high, low), timeout=1))
+
+        with self.assertRaises(Empty):
+            wait_any([high, low], timeout=0)
+
+        start = time.monotonic()
+        with self.assertRaises(Empty):
+            wait_any([high, low], 0.05)
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+    def test_wait_any_invalid(self):
+        with self.assertRaises(ValueError):
+            wait_any([])
+
+        with self.assertRaises(TypeError):
+            wait_any([Queue(), std_queue.Queue()])
+
+        with self.assertRaises(ValueError):
+            wait_any([Queue()], -1)
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_wait_any_wakes_up(self):
+        queues = [Queue() for _ in range(3)]
+        count = 3000
+        received = []
+
+        def producer(index):
+            for x in range(count):
+                queues[index].put(x)
+
+        threads = [threading.Thread(target=producer, args=(i,)) for i in range(3)]
+        [t.start() for t in threads]
+        for _ in range(3 * count):
+            received.append(wait_any(queues, timeout=10))
+        [t.join() for t in threads]
+
+        for index in range(3):
+            self.assertEqual(
+                list(range(count)), [item for i, item in received if i == index]
+            )
+        self.assertTrue(all(q.empty() for q in queues))
@@ -0,0 +1,131 @@
+import os
+import queue as std_queue
+import threading
+from unittest import TestCase, skipIf
+
+from ax_utils.ax_queue import Empty, Full, ShardedQueue
+
+in_gevent = os.environ.get('ENFORCE_GEVENT_DURING_BUILD_TESTS')
+
+
+class TestShardedQueue(TestCase):
+    def test_lanes(self):
+        self.assertEqual(4, ShardedQueue(lanes=4).lanes)
+        self.assertGreaterEqual(ShardedQueue().lanes, 1)
+
+        with self.assertRaises(ValueError):
+            ShardedQueue(lanes=-1)
+
+    def test_maxsize_get(self):
+        self.assertEqual(0, ShardedQueue().maxsize)
+        self.assertEqual(100, ShardedQueue(100).maxsize)
+
+    def test_get_put(self):
+        q = ShardedQueue(3, lanes=4)
+        q.put(1)
+        q.put(2)
+        q.put(3)
+        self.assertTrue(q.full())
+        self.assertEqual(3, q.qsize())
+
+        with self.assertRaises(Full):
+            q.put(None, True, 0.1)
+
+        # same thread => same lane => FIFO
+        self.assertEqual(1, q.get())
+        self.assertEqual(2, q.get())
+        self.assertEqual(3, q.get())
+        self.assertTrue(q.empty())
+
+        with self.assertRaises(Empty):
+            q.get(True, 0.1)
+
+    def test_except_with_std_queue(self):
+        q = ShardedQueue(1)
+        with self.assertRaises(std_queue.Empty):
+            q.get_nowait()
+
+        q.put_nowait(1)
+        with self.assertRaises(std_queue.Full):
+            q.put_nowait(1)
+
+    def test_put_many_get_many(self):
+        q = ShardedQueue(lanes=2)
+        q.put_many([1, 2, 3])
+        self.assertEqual((1, 2), q.get_many(2))
+        self.assertEqual((), q.get_many(0))
+
+        with self.assertRaises(Empty):
+            q.get_many(2, block=False)
+        self.assertEqual(1, q.qsize())
+
+        msg = 'items of size 3 is bigger than maxsize: 2'
+        with self.assertRaisesRegex(ValueError, msg):
+            ShardedQueue(2).put_many((1, 2, 3))
+
+    def test_steals_from_other_lanes(self):
+        q = ShardedQueue(lanes=8)
+        t = threading.Thread(target=q.put_many, args=(range(10),))
+        t.start()
+        t.join()
+
+        self.assertEqual(tuple(range(10)), q.get_many(10, block=False))
+
+    def test_task_done_batch_join_timeout(self):
+        q = ShardedQueue(4)
+        q.put_many([1, 2, 3])
+        q.get_many(3)
+        self.assertFalse(q.join(0.01))
+
+        with self.assertRaises(ValueError):
+            q.task_done(4)
+
+        q.task_done(3)
+        self.assertTrue(q.join(0.01))
+
+    def test_task_done_join(self):
+        q = ShardedQueue()
+        with self.assertRaises(ValueError):
+            q.task_done()
+
+        q.put_many([1, 2])
+        q.get_many(2)
+        q.task_done()
+        q.task_done()
+        q.join()
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_many_producers_consumers(self):
+        count = 2000
+        nb_threads = 8
+        q = ShardedQueue(64, lanes=4)
+        received = [[] for _ in range(nb_threads)]
+
+        def producer(idx):
+            for x in range(count):
+                q.put((idx, x))
+
+        def consumer(idx):
+            for _ in range(count):
+                received[idx].append(q.get(True, 10))
+                q.task_done()
+
+        threads = [
+            threading.Thread(target=func, args=(idx,))
+            for idx in range(nb_threads)
+            for func in (producer, consumer)
+        ]
+        [t.start() for t in threads]
+        q.join()
+        [t.join() for t in threads]
+
+        self.assertTrue(q.empty())
+        items = sorted(item for per_consumer in received for item in per_consumer)
+        expected = sorted((idx, x) for idx in range(nb_threads) for x in range(count))
+        self.assertEqual(expected, items)
+
+        # per lane FIFO: every consumer sees the items of a producer in order
+        for per_consumer in received:
+            for idx in range(nb_threads):
+                seen = [x for producer_idx, x in per_consumer if producer_idx == idx]
+                self.assertEqual(sorted(seen), seen)
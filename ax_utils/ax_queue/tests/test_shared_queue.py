@@ -0,0 +1,187 @@
+import os
+import queue as std_queue
+import signal
+import tempfile
+import threading
+import time
+from unittest import TestCase, skipIf
+
+from ax_utils.ax_queue import AXSharedQueue, Empty, Full
+
+in_gevent = os.environ.get('ENFORCE_GEVENT_DURING_BUILD_TESTS')
+
+
+def run_child(func):
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            func()
+            code = 0
+        finally:
+            os._exit(code)
+    return pid
+
+
+def wait_child(pid):
+    _, status = os.waitpid(pid, 0)
+    return os.WEXITSTATUS(status)
+
+
+class TestSharedQueue(TestCase):
+    def test_size_is_required(self):
+        with self.assertRaises(ValueError):
+            AXSharedQueue()
+
+        with self.assertRaises(ValueError):
+            AXSharedQueue(-1)
+
+        self.assertEqual(AXSharedQueue(100).size, 104)
+
+    def test_get_put(self):
+        q = AXSharedQueue(64)
+        q.put(b'a')
+        q.put(bytearray(b'bc'))
+        q.put(memoryview(b'def'))
+        self.assertEqual(3, q.qsize())
+
+        self.assertEqual(b'a', q.get())
+        self.assertEqual(b'bc', q.get())
+        self.assertEqual(b'def', q.get())
+        self.assertTrue(q.empty())
+
+        with self.assertRaises(Empty):
+            q.get(True, 0.1)
+
+    def test_only_bytes(self):
+        q = AXSharedQueue(64)
+        with self.assertRaises(TypeError):
+            q.put('text')
+
+    def test_full(self):
+        q = AXSharedQueue(64)
+        q.put(b'x' * 40)
+        with self.assertRaises(Full):
+            q.put(b'x' * 40, True, 0.1)
+
+        with self.assertRaises(std_queue.Full):
+            q.put_nowait(b'x' * 40)
+
+        with self.assertRaisesRegex(ValueError, 'bigger than the queue size'):
+            q.put(b'x' * 100)
+
+    def test_wrap_around(self):
+        q = AXSharedQueue(64)
+        for i in range(100):
+            q.put_many([b'%d' % i, b'x' * 20])
+            self.assertEqual((b'%d' % i, b'x' * 20), q.get_many(2))
+
+    def test_put_many_get_many(self):
+        q = AXSharedQueue(256)
+        q.put_many([b'1', b'2', b'3'])
+        self.assertEqual((b'1', b'2'), q.get_many(2))
+        self.assertEqual((), q.get_many(0))
+
+        with self.assertRaises(Empty):
+            q.get_many(2, block=False)
+        self.assertEqual(b'3', q.get_nowait())
+
+        # 64 bytes hold at most 8 empty records
+        q = AXSharedQueue(64)
+        q.put_many([b''] * 8)
+        self.assertEqual((b'',) * 8, q.get_many(8))
+        with self.assertRaisesRegex(ValueError, 'bigger than the queue size'):
+            q.get_many(9)
+
+    def test_get_view(self):
+        q = AXSharedQueue(64)
+        q.put(b'x' * 40)
+
+        view = q.get_view()
+        self.assertTrue(view.readonly)
+        self.assertEqual(b'x' * 40, view.tobytes())
+
+        # the space is still used by the view
+        with self.assertRaises(Full):
+            q.put_nowait(b'y' * 40)
+
+        view.release()
+        q.put_nowait(b'y' * 40)
+        self.assertEqual(b'y' * 40, q.get())
+
+    def test_attach_by_path(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'queue')
+            q1 = AXSharedQueue(128, path)
+            q2 = AXSharedQueue(path=path)
+            self.assertEqual(128, q2.size)
+
+            q1.put(b'hello')
+            self.assertEqual(b'hello', q2.get())
+
+            with self.assertRaisesRegex(ValueError, 'not 256'):
+                AXSharedQueue(256, path)
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_fork_producer(self):
+        count = 5000
+        q = AXSharedQueue(1024)
+
+        def producer():
+            for x in range(count):
+                q.put(b'%d' % x)
+
+        pid = run_child(producer)
+        received = [int(q.get(True, 10)) for _ in range(count)]
+        self.assertEqual(0, wait_child(pid))
+        self.assertEqual(list(range(count)), received)
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_fork_consumer(self):
+        count = 5000
+        q = AXSharedQueue(1024)
+        results = AXSharedQueue(64)
+
+        def consumer():
+            for x in range(count // 10):
+                items = q.get_many(10, True, 10)
+                assert items == tuple(b'%d' % i for i in range(x * 10, x * 10 + 10))
+            results.put(b'ok')
+
+        pid = run_child(consumer)
+        for x in range(0, count, 10):
+            q.put_many([b'%d' % i for i in range(x, x + 10)])
+
+        self.assertEqual(b'ok', results.get(True, 10))
+        self.assertEqual(0, wait_child(pid))
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_owner_killed_while_holding_the_lock(self):
+        # the copies of big payloads happen under the lock, so most of the
+        # time the child is killed while it owns the mutex
+        payload = b'x' * (4 << 20)
+        for _ in range(5):
+            q = AXSharedQueue(16 << 20)
+
+            def churn(q=q):
+                while True:
+                    q.put(payload)
+                    q.get()
+
+            pid = run_child(churn)
+            time.sleep(0.1)
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+            done = []
+
+            def use(q=q):
+                q.put(b'ok', True, 5)
+                while q.get(True, 5) != b'ok':
+                    pass
+                done.append(True)
+
+            thread = threading.Thread(target=use, daemon=True)
+            thread.start()
+            thread.join(10)
+            self.assertEqual([True], done)
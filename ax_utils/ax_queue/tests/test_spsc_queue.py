@@ -0,0 +1,141 @@
+import os
+import queue as std_queue
+import threading
+from unittest import TestCase, skipIf
+
+from ax_utils.ax_queue import Empty, Full, SPSCQueue
+
+in_gevent = os.environ.get('ENFORCE_GEVENT_DURING_BUILD_TESTS')
+
+
+class TestSPSCQueue(TestCase):
+    def test_maxsize_is_required(self):
+        with self.assertRaises(TypeError):
+            SPSCQueue()
+
+        with self.assertRaises(ValueError):
+            SPSCQueue(0)
+
+    def test_maxsize_get(self):
+        q = SPSCQueue(100)
+        self.assertEqual(q.maxsize, 100)
+
+    def test_get_put(self):
+        q = SPSCQueue(3)
+        q.put(1)
+        q.put(2)
+        q.put(3)
+        self.assertTrue(q.full())
+        self.assertEqual(3, q.qsize())
+
+        with self.assertRaises(Full):
+            q.put(None, True, 0.1)
+
+        self.assertEqual(1, q.get())
+        self.assertEqual(2, q.get())
+        self.assertEqual(3, q.get())
+        self.assertTrue(q.empty())
+
+        with self.assertRaises(Empty):
+            q.get(True, 0.1)
+
+    def test_except_with_std_queue(self):
+        q = SPSCQueue(1)
+        with self.assertRaises(std_queue.Empty):
+            q.get_nowait()
+
+        q.put_nowait(1)
+        with self.assertRaises(std_queue.Full):
+            q.put_nowait(1)
+
+    def test_put_many_get_many(self):
+        q = SPSCQueue(4)
+        q.put_many([1, 2, 3])
+        self.assertEqual((1, 2), q.get_many(2))
+
+        # wraps around the end of the ring
+        q.put_many((4, 5, 6))
+        self.assertEqual((3, 4, 5, 6), q.get_many(4))
+
+        with self.assertRaises(Empty):
+            q.get_many(2, block=False)
+
+    def test_put_many_too_many_items(self):
+        q = SPSCQueue(1)
+        msg = 'items of size 3 is bigger than maxsize: 1'
+        with self.assertRaisesRegex(ValueError, msg):
+            q.put_many((1, 2, 3))
+
+        msg = 'you want to get 2 but maxsize is 1'
+        with self.assertRaisesRegex(ValueError, msg):
+            q.get_many(2)
+
+    def test_task_done_batch_join_timeout(self):
+        q = SPSCQueue(4)
+        q.put_many([1, 2, 3])
+        q.get_many(3)
+        self.assertFalse(q.join(0.01))
+
+        with self.assertRaises(ValueError):
+            q.task_done(4)
+
+        q.task_done(3)
+        self.assertTrue(q.join(0.01))
+
+    def test_task_done_join(self):
+        q = SPSCQueue(2)
+        with self.assertRaises(ValueError):
+            q.task_done()
+
+        q.put(1)
+        q.get()
+        q.task_done()
+        q.join()
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_producer_consumer(self):
+        count = 20000
+        q = SPSCQueue(16)
+        received = []
+
+        def producer():
+            for x in range(count):
+                q.put(x)
+
+        def consumer():
+            for _ in range(count):
+                received.append(q.get(True, 10))
+                q.task_done()
+
+        threads = [
+            threading.Thread(target=producer),
+            threading.Thread(target=consumer),
+        ]
+        [t.start() for t in threads]
+        q.join()
+        [t.join() for t in threads]
+
+        self.assertEqual(list(range(count)), received)
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_producer_consumer_many(self):
+        count = 20000
+        q = SPSCQueue(100)
+        received = []
+
+        def producer():
+            for x in range(0, count, 10):
+                q.put_many(range(x, x + 10))
+
+        def consumer():
+            for _ in range(count // 25):
+                received.extend(q.get_many(25, True, 10))
+
+        threads = [
+            threading.Thread(target=producer),
+            threading.Thread(target=consumer),
+        ]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+
+        self.assertEqual(list(range(count)), received)
@@ -0,0 +1,163 @@
+import array
+import gc
+import os
+import threading
+from unittest import TestCase, skipIf
+
+from ax_utils.ax_queue import Empty, Full, TypedQueue
+
+in_gevent = os.environ.get('ENFORCE_GEVENT_DURING_BUILD_TESTS')
+
+
+class TestTypedQueue(TestCase):
+    def test_get_put(self):
+        q = TypedQueue('q')
+        self.assertEqual('q', q.typecode)
+        self.assertEqual(8, q.itemsize)
+        q.put(1)
+        q.put_nowait(-(2**63))
+        q.put(2**63 - 1, False)
+        self.assertEqual(3, q.qsize())
+        self.assertEqual(1, q.get())
+        self.assertEqual(-(2**63), q.get_nowait())
+        self.assertEqual(2**63 - 1, q.get(False))
+        self.assertTrue(q.empty())
+
+        with self.assertRaises(Empty):
+            q.get(True, 0.01)
+
+    def test_typecodes(self):
+        for typecode in 'bBhHiIlLqQ':
+            q = TypedQueue(typecode)
+            bits = q.itemsize * 8
+            if typecode.islower():
+                low, high = -(2 ** (bits - 1)), 2 ** (bits - 1) - 1
+            else:
+                low, high = 0, 2**bits - 1
+            values = [low, 0, 1, high]
+            q.put_many(values)
+            self.assertEqual(tuple(values), q.get_many(len(values)))
+            with self.assertRaises(OverflowError):
+                q.put(high + 1)
+            with self.assertRaises(OverflowError):
+                q.put(low - 1)
+
+        q = TypedQueue('d')
+        q.put(1.5)
+        q.put(2)
+        self.assertEqual((1.5, 2.0), q.get_many(2))
+
+        q = TypedQueue('f')
+        q.put(0.1)
+        self.assertAlmostEqual(0.1, q.get(), places=6)
+
+        with self.assertRaises(ValueError):
+            TypedQueue('x')
+        with self.assertRaises(TypeError):
+            TypedQueue()
+
+    def test_conversion_errors(self):
+        q = TypedQueue('b')
+        with self.assertRaises(OverflowError):
+            q.put(128)
+        with self.assertRaises(OverflowError):
+            TypedQueue('B').put(-1)
+        with self.assertRaises(TypeError):
+            q.put('1')
+        with self.assertRaises(TypeError):
+            q.put(1.5)
+        with self.assertRaises(TypeError):
+            TypedQueue('d').put('1.5')
+
+        # a batch is put completely or not at all
+        with self.assertRaises(OverflowError):
+            q.put_many([1, 2, 1000])
+        self.assertEqual(0, q.qsize())
+
+    def test_get_many_asarray(self):
+        q = TypedQueue('d')
+        q.put_many(range(10))
+        values = q.get_many(4, asarray=True)
+        self.assertIsInstance(values, array.array)
+        self.assertEqual('d', values.typecode)
+        self.assertEqual(array.array('d', range(4)), values)
+        self.assertEqual(array.array('d'), q.get_many(0, asarray=True))
+        self.assertEqual((), q.get_many(0))
+        self.assertEqual(tuple(range(4, 10)), q.get_many(6))
+
+        with self.assertRaises(Empty):
+            q.get_many(1, False)
+
+    def test_put_many_buffer(self):
+        q = TypedQueue('i')
+        values = array.array('i', range(100))
+        q.put_many(values)
+        self.assertEqual(values, q.get_many(100, asarray=True))
+
+        # buffers of another type are converted item by item
+        q.put_many(array.array('h', [1, 2]))
+        self.assertEqual((1, 2), q.get_many(2))
+        q.put_many(memoryview(values)[10:20])
+        self.assertEqual(tuple(range(10, 20)), q.get_many(10))
+
+        q = TypedQueue('B')
+        q.put_many(b'abc')
+        self.assertEqual(b'abc', q.get_many(3, asarray=True).tobytes())
+
+    def test_ring_wraps_around(self):
+        q = TypedQueue('H')
+        expected = []
+        for i in range(200):
+            q.put_many(range(i, i + 7))
+            expected.extend(range(i, i + 7))
+            got = q.get_many(5)
+            self.assertEqual(tuple(expected[:5]), got)
+            del expected[:5]
+        self.assertEqual(tuple(expected), q.get_many(len(expected)))
+
+    def test_maxsize(self):
+        q = TypedQueue('l', 2)
+        self.assertEqual(2, q.maxsize)
+        q.put_many([1, 2])
+        self.assertTrue(q.full())
+        with self.assertRaises(Full):
+            q.put_nowait(3)
+        with self.assertRaises(Full):
+            q.put(3, True, 0.01)
+        with self.assertRaises(ValueError):
+            q.put_many([1, 2, 3])
+        with self.assertRaises(ValueError):
+            q.get_many(3)
+
+    def test_not_tracked_by_gc(self):
+        self.assertFalse(gc.is_tracked(TypedQueue('q')))
+
+    def test_task_done_join(self):
+        q = TypedQueue('q')
+        q.put_many([1, 2, 3])
+        q.get_many(3)
+        self.assertFalse(q.join(0.01))
+        q.task_done(3)
+        self.assertTrue(q.join())
+        with self.assertRaises(ValueError):
+            q.task_done()
+
+    @skipIf(in_gevent, 'gevent, we cannot block on queue')
+    def test_threads(self):
+        q = TypedQueue('q', 64)
+        result = []
+
+        def consume():
+            while True:
+                values = q.get_many(10, asarray=True)
+                result.extend(values)
+                if values[-1] == -1:
+                    return
+
+        t = threading.Thread(target=consume)
+        t.start()
+        for i in range(0, 999, 9):
+            q.put_many(array.array('q', range(i, i + 9)))
+        q.put(-1)
+        t.join()
+        self.assertEqual(list(range(999)) + [-1], result)
@@ -134,6 +134,412 @@ def benchmark_ax_queue():
     threaded_queue_test(queue.Queue, 'stdlib Queue   ')
 
 
+def benchmark_spsc_queue():
+    """Benchmark SPSCQueue against the mutex based AXQueue."""
+    from ax_utils.ax_queue import AXQueue, SPSCQueue
+
+    print('\n🚀 SPSCQueue Benchmarks')
+    print('=' * 50)
+
+    iterations = 200000
+    maxsize = 1024
+
+    print(f'\n📊 1 producer / 1 consumer ({iterations:,} items):')
+
+    def spsc_test(q, name, batch=1):
+        def producer():
+            if batch == 1:
+                for i in range(iterations):
+                    q.put(i)
+            else:
+                chunk = tuple(range(batch))
+                for _ in range(iterations // batch):
+                    q.put_many(chunk)
+
+        def consumer():
+            if batch == 1:
+                for _ in range(iterations):
+                    q.get()
+            else:
+                for _ in range(iterations // batch):
+                    q.get_many(batch)
+
+        threads = [
+            threading.Thread(target=producer),
+            threading.Thread(target=consumer),
+        ]
+        with timer(name):
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+    spsc_test(AXQueue(maxsize), '  AXQueue put/get              ')
+    spsc_test(SPSCQueue(maxsize), '  SPSCQueue put/get            ')
+    spsc_test(AXQueue(maxsize), '  AXQueue put_many/get_many    ', batch=64)
+    spsc_test(SPSCQueue(maxsize), '  SPSCQueue put_many/get_many  ', batch=64)
+
+
+def benchmark_queue_wait_strategy():
+    """Hand-off latency of AXQueue parking right away vs spinning first."""
+    from ax_utils.ax_queue import AXQueue
+
+    print('\n🚀 AXQueue wait strategy Benchmarks')
+    print('=' * 50)
+
+    iterations = 20000
+
+    print(f'\n📊 ping-pong hand-off latency ({iterations:,} round trips):')
+
+    def latency_test(spin_us, name):
+        ping = AXQueue(1, spin_us=spin_us)
+        pong = AXQueue(1, spin_us=spin_us)
+        latencies = []
+
+        def echo():
+            for _ in range(iterations):
+                pong.put(ping.get())
+
+        t = threading.Thread(target=echo)
+        t.start()
+        for _ in range(iterations):
+            start = time.perf_counter_ns()
+            ping.put(start)
+            pong.get()
+            latencies.append((time.perf_counter_ns() - start) / 2000)
+        t.join()
+
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[int(len(latencies) * 0.99)]
+        print(f'{name}: p50 {p50:8.1f}us  p99 {p99:8.1f}us')
+
+    latency_test(0, '  park (spin_us=0)   ')
+    latency_test(20, '  spin_us=20         ')
+    latency_test(200, '  spin_us=200        ')
+
+
+def benchmark_sharded_queue():
+    """Benchmark ShardedQueue against AXQueue with growing thread counts."""
+    from ax_utils.ax_queue import AXQueue, ShardedQueue
+
+    print('\n🚀 ShardedQueue Benchmarks')
+    print('=' * 50)
+
+    iterations = 64000
+
+    def scaling_test(q, name, threads_per_side):
+        per_thread = iterations // threads_per_side
+
+        def producer():
+            for i in range(per_thread):
+                q.put(i)
+
+        def consumer():
+            for _ in range(per_thread):
+                q.get()
+
+        threads = [threading.Thread(target=producer) for _ in range(threads_per_side)]
+        threads += [threading.Thread(target=consumer) for _ in range(threads_per_side)]
+        with timer(name):
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+    for nb_threads in (1, 2, 4, 8, 16, 32):
+        print(
+            f'\n📊 {nb_threads} producers / {nb_threads} consumers '
+            f'({iterations:,} items):'
+        )
+        scaling_test(AXQueue(1024), '  AXQueue              ', nb_threads)
+        scaling_test(
+            ShardedQueue(1024, lanes=nb_threads), '  ShardedQueue         ', nb_threads
+        )
+
+
+def benchmark_queue_spill():
+    """Sustained AXQueue throughput in memory vs spilling to disk."""
+    import tempfile
+
+    from ax_utils.ax_queue import AXQueue
+
+    print('\n🚀 AXQueue spill_dir Benchmarks')
+    print('=' * 50)
+
+    iterations = 200000
+    payload = b'x' * 100
+
+    def backlog_test(q, name):
+        # outage: everything queues up, then the consumer catches up
+        with timer(f'  {name} fill '):
+            for i in range(0, iterations, 100):
+                q.put_many([(i + j, payload) for j in range(100)])
+        with timer(f'  {name} drain'):
+            while q.get_up_to(100, False):
+                pass
+
+    def streaming_test(q, name):
+        def producer():
+            for i in range(iterations):
+                q.put((i, payload))
+
+        def consumer():
+            for _ in range(iterations):
+                q.get()
+
+        threads = [threading.Thread(target=producer), threading.Thread(target=consumer)]
+        with timer(f'  {name} producer/consumer'):
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+    with tempfile.TemporaryDirectory() as spill_dir:
+        print(f'\n📊 Backlog of {iterations:,} items:')
+        backlog_test(AXQueue(), 'in memory      ')
+        backlog_test(AXQueue(spill_dir=spill_dir, spill_after=1000), 'spill_after=1000')
+
+        print(f'\n📊 Streaming {iterations:,} items:')
+        streaming_test(AXQueue(), 'in memory      ')
+        streaming_test(AXQueue(spill_dir=spill_dir, spill_after=0), 'spill_after=0   ')
+
+
+def benchmark_typed_queue():
+    """Batches of floats through AXQueue (boxed) vs TypedQueue (unboxed)."""
+    import array
+
+    from ax_utils.ax_queue import AXQueue, TypedQueue
+
+    print('\n🚀 TypedQueue Benchmarks')
+    print('=' * 50)
+
+    iterations = 1000000
+    batch = 1000
+    samples = [float(i) for i in range(batch)]
+    samples_array = array.array('d', samples)
+
+    print(f'\n📊 {iterations:,} floats in batches of {batch}:')
+    q = AXQueue()
+    with timer('  AXQueue    list  put_many/get_many         '):
+        for _ in range(iterations // batch):
+            q.put_many(samples)
+            q.get_many(batch)
+
+    q = TypedQueue('d')
+    with timer('  TypedQueue list  put_many/get_many         '):
+        for _ in range(iterations // batch):
+            q.put_many(samples)
+            q.get_many(batch)
+
+    with timer('  TypedQueue array put_many/get_many(asarray)'):
+        for _ in range(iterations // batch):
+            q.put_many(samples_array)
+            q.get_many(batch, asarray=True)
+
+
+def benchmark_queue_gc():
+    """gc.collect() with a backlog of 1M items, with and without acyclic."""
+    import gc
+
+    from ax_utils.ax_queue import AXQueue
+
+    print('\n🚀 AXQueue acyclic Benchmarks')
+    print('=' * 50)
+
+    iterations = 1000000
+    collections = 5
+
+    # ints are not tracked by the GC, lists are
+    for payload, make in (('ints ', int), ('lists', lambda i: [i])):
+        print(f'\n📊 gc.collect() with {iterations:,} queued {payload.strip()}:')
+        for acyclic in (False, True):
+            q = AXQueue(acyclic=acyclic)
+            q.put_many([make(i) for i in range(iterations)])
+            gc.collect()
+            with timer(f'  {payload} acyclic={acyclic!s:5} x{collections}'):
+                for _ in range(collections):
+                    gc.collect()
+            del q
+
+
+def benchmark_queue_polling():
+    """Polling an empty AXQueue: get_nowait() + except Empty vs try_get()."""
+    from ax_utils.ax_queue import AXQueue, Empty
+
+    print('\n🚀 AXQueue polling Benchmarks')
+    print('=' * 50)
+
+    iterations = 1000000
+    q = AXQueue()
+
+    print(f'\n📊 {iterations:,} polls of an empty queue:')
+    with timer('  get_nowait() + except Empty'):
+        for _ in range(iterations):
+            try:
+                q.get_nowait()
+            except Empty:
+                pass
+
+    with timer('  try_get()                  '):
+        for _ in range(iterations):
+            q.try_get()
+
+    print(f'\n📊 {iterations:,} put/get pairs:')
+    with timer('  put_nowait()/get_nowait()  '):
+        for i in range(iterations):
+            q.put_nowait(i)
+            q.get_nowait()
+
+    with timer('  try_put()/try_get()        '):
+        for i in range(iterations):
+            q.try_put(i)
+            q.try_get()
+
+
+def benchmark_queue_drain():
+    """Emptying a backlog: get_nowait() loop vs drain(), and snapshot()."""
+    from ax_utils.ax_queue import AXQueue, Empty
+
+    print('\n🚀 AXQueue drain Benchmarks')
+    print('=' * 50)
+
+    iterations = 1000000
+    items = list(range(iterations))
+    q = AXQueue()
+
+    print(f'\n📊 Backlog of {iterations:,} items:')
+    q.put_many(items)
+    with timer('  get_nowait() loop'):
+        while True:
+            try:
+                q.get_nowait()
+            except Empty:
+                break
+
+    q.put_many(items)
+    with timer('  snapshot()       '):
+        q.snapshot()
+
+    with timer('  drain()          '):
+        q.drain()
+
+
+def benchmark_queue_streaming_put():
+    """A batch 100x bigger than maxsize: Python chunking vs put_many(atomic=False)."""
+    import itertools
+
+    from ax_utils.ax_queue import AXQueue
+
+    print('\n🚀 AXQueue streaming put_many Benchmarks')
+    print('=' * 50)
+
+    iterations = 200000
+    maxsize = 2000
+
+    def run(name, produce):
+        q = AXQueue(maxsize)
+
+        def consumer():
+            left = iterations
+            while left:
+                left -= len(q.get_up_to(maxsize))
+
+        t = threading.Thread(target=consumer)
+        with timer(f'  {name}'):
+            t.start()
+            produce(q)
+            t.join()
+
+    def chunked(q):
+        items = iter(range(iterations))
+        while True:
+            chunk = list(itertools.islice(items, maxsize // 4))
+            if not chunk:
+                return
+            q.put_many(chunk)
+
+    print(f'\n📊 {iterations:,} items from a generator, maxsize={maxsize}:')
+    run('put_many in chunks of maxsize/4', chunked)
+    run(
+        'put_many(atomic=False)         ',
+        lambda q: q.put_many(iter(range(iterations)), atomic=False),
+    )
+
+
+def benchmark_executor():
+    """Benchmark the AXQueue Executor against ThreadPoolExecutor."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from ax_utils.ax_queue import Executor
+
+    print('\n🚀 Executor Benchmarks')
+    print('=' * 50)
+
+    iterations = 50000
+
+    def task(x):
+        return x + 1
+
+    for workers in (1, 4, 16):
+        print(f'\n📊 {iterations:,} small tasks, {workers} workers:')
+        for name, executor_cls in (
+            ('ThreadPoolExecutor', ThreadPoolExecutor),
+            ('AX Executor       ', Executor),
+        ):
+            with executor_cls(max_workers=workers) as executor:
+                with timer(f'  {name} submit'):
+                    futures = [executor.submit(task, i) for i in range(iterations)]
+                    for f in futures:
+                        f.result()
+
+                with timer(f'  {name} map   '):
+                    list(executor.map(task, range(iterations)))
+
+
+def benchmark_async_queue():
+    """Benchmark AsyncAXQueue against run_in_executor(None, q.get)."""
+    import asyncio
+
+    from ax_utils.ax_queue import AsyncAXQueue, AXQueue
+
+    print('\n🚀 AsyncAXQueue Benchmarks')
+    print('=' * 50)
+
+    iterations = 20000
+    consumers = 100
+
+    print(f'\n📊 Thread producer -> {consumers} coroutines ({iterations:,} items):')
+
+    def producer(q):
+        for i in range(iterations):
+            q.put(i)
+
+    async def executor_consumer(q, count):
+        loop = asyncio.get_running_loop()
+        for _ in range(count):
+            await loop.run_in_executor(None, q.get)
+
+    async def adapter_consumer(aq, count):
+        for _ in range(count):
+            await aq.get()
+
+    async def run(consumer, q, native_queue):
+        t = threading.Thread(target=producer, args=(native_queue,))
+        tasks = [consumer(q, iterations // consumers) for _ in range(consumers)]
+        t.start()
+        await asyncio.gather(*tasks)
+        t.join()
+
+    q = AXQueue()
+    with timer('  run_in_executor(q.get)'):
+        asyncio.run(run(executor_consumer, q, q))
+
+    aq = AsyncAXQueue()
+    with timer('  AsyncAXQueue.get()    '):
+        asyncio.run(run(adapter_consumer, aq, aq.queue))
+
+
 def benchmark_ax_tree():
     """Benchmark AXTree performance."""
     from ax_utils.ax_tree import AXTree
@@ -246,6 +652,17 @@ def run_all_benchmarks():
     try:
         benchmark_deepcopy()
         benchmark_ax_queue()
+        benchmark_spsc_queue()
+        benchmark_sharded_queue()
+        benchmark_queue_wait_strategy()
+        benchmark_queue_spill()
+        benchmark_queue_gc()
+        benchmark_queue_polling()
+        benchmark_queue_drain()
+        benchmark_queue_streaming_put()
+        benchmark_executor()
+        benchmark_typed_queue()
+        benchmark_async_queue()
         benchmark_ax_tree()
         benchmark_props_to_tree()
         benchmark_unicode_utils()